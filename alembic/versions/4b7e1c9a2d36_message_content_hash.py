@@ -0,0 +1,58 @@
+"""messages.content_hash + unique (session_id, content_hash) for history dedup
+
+Revision ID: 4b7e1c9a2d36
+Revises: 9f19a59fa239
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+# revision identifiers, used by Alembic.
+revision = '4b7e1c9a2d36'
+down_revision = '9f19a59fa239'
+branch_labels = None
+depends_on = None
+
+
+def _content_hash(sender, text, timestamp):
+    # keep in sync with backend.app.db.message_content_hash
+    if timestamp is not None and timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None)
+    key = '\x1f'.join([sender or '', text or '', timestamp.isoformat() if timestamp else ''])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('messages') as batch:
+        batch.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    # Backfill: first occurrence of each (session, sender, text, timestamp)
+    # gets the hash, exact repeats and agent rows stay NULL.
+    conn = op.get_bind()
+    messages = sa.table('messages', sa.column('id', sa.Integer), sa.column('session_id', sa.String),
+                        sa.column('sender', sa.String), sa.column('text', sa.Text),
+                        sa.column('timestamp', sa.DateTime), sa.column('content_hash', sa.String))
+    rows = conn.execute(sa.select(messages.c.id, messages.c.session_id, messages.c.sender, messages.c.text, messages.c.timestamp).order_by(messages.c.id)).fetchall()
+    seen = set()
+    updates = []
+    for r in rows:
+        if r.sender == 'agent':
+            continue
+        h = _content_hash(r.sender, r.text, r.timestamp)
+        if (r.session_id, h) in seen:
+            continue
+        seen.add((r.session_id, h))
+        updates.append({'_id': r.id, '_hash': h})
+    if updates:
+        conn.execute(messages.update().where(messages.c.id == sa.bindparam('_id')).values(content_hash=sa.bindparam('_hash')), updates)
+
+    op.create_index('ux_messages_session_hash', 'messages', ['session_id', 'content_hash'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ux_messages_session_hash', table_name='messages')
+    with op.batch_alter_table('messages') as batch:
+        batch.drop_column('content_hash')
@@ -0,0 +1,38 @@
+"""session_summary: per-session aggregates for the result endpoint
+
+Revision ID: 7c2d5e8f1a94
+Revises: 4b7e1c9a2d36
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7c2d5e8f1a94'
+down_revision = '4b7e1c9a2d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # No backfill: a session's row is built from a full scan on its next
+    # write, and readers fall back to the same scan while it is missing.
+    op.create_table(
+        'session_summary',
+        sa.Column('session_id', sa.String(), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=True),
+        sa.Column('first_ts', sa.DateTime(), nullable=True),
+        sa.Column('last_ts', sa.DateTime(), nullable=True),
+        sa.Column('extractions_json', sa.Text(), nullable=True),
+        sa.Column('scam_detected', sa.Boolean(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('session_id'),
+    )
+    op.create_index('ix_session_summary_session_id', 'session_summary', ['session_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_session_summary_session_id', table_name='session_summary')
+    op.drop_table('session_summary')
@@ -0,0 +1,86 @@
+"""conversation_turns / conversation_slots + conversation_state.version
+
+Revision ID: a3f0c6d2b8e1
+Revises: 7c2d5e8f1a94
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import json
+from datetime import datetime
+
+# revision identifiers, used by Alembic.
+revision = 'a3f0c6d2b8e1'
+down_revision = '7c2d5e8f1a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation_state') as batch:
+        batch.add_column(sa.Column('version', sa.Integer(), nullable=True, server_default='0'))
+
+    op.create_table(
+        'conversation_turns',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('session_id', sa.String(), nullable=False),
+        sa.Column('turn_no', sa.Integer(), nullable=False),
+        sa.Column('sender', sa.String(), nullable=True),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('ts', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_conversation_turns_id', 'conversation_turns', ['id'])
+    op.create_index('ux_conversation_turns_session_turn', 'conversation_turns', ['session_id', 'turn_no'], unique=True)
+    op.create_table(
+        'conversation_slots',
+        sa.Column('session_id', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('value', sa.Text(), nullable=True),
+        sa.Column('turn_no', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('session_id', 'name'),
+    )
+
+    # Backfill from the legacy blobs: messages_json held the last 10 agent
+    # turns, numbered back from turn_count (keep in sync with
+    # backend.app.db.backfill_conversation_turns).
+    conn = op.get_bind()
+    state = sa.table('conversation_state', sa.column('session_id', sa.String), sa.column('turn_count', sa.Integer),
+                     sa.column('messages_json', sa.Text), sa.column('slots_json', sa.Text))
+    turns_t = sa.table('conversation_turns', sa.column('session_id', sa.String), sa.column('turn_no', sa.Integer),
+                       sa.column('sender', sa.String), sa.column('text', sa.Text), sa.column('ts', sa.DateTime))
+    slots_t = sa.table('conversation_slots', sa.column('session_id', sa.String), sa.column('name', sa.String),
+                       sa.column('value', sa.Text), sa.column('turn_no', sa.Integer))
+    rows = conn.execute(sa.select(state.c.session_id, state.c.turn_count, state.c.messages_json, state.c.slots_json)
+                        .where((state.c.messages_json.isnot(None)) | (state.c.slots_json.isnot(None)))).fetchall()
+    turns, slots = [], []
+    for r in rows:
+        try:
+            msgs = json.loads(r.messages_json) if r.messages_json else []
+            state_slots = json.loads(r.slots_json) if r.slots_json else {}
+        except Exception:
+            continue
+        last = max(r.turn_count or 0, len(msgs))
+        for i, m in enumerate(msgs):
+            try:
+                ts = datetime.fromisoformat(m['ts']) if m.get('ts') else None
+            except Exception:
+                ts = None
+            turns.append({'session_id': r.session_id, 'turn_no': last - len(msgs) + 1 + i, 'sender': m.get('sender'), 'text': m.get('text'), 'ts': ts})
+        for name, value in (state_slots or {}).items():
+            slots.append({'session_id': r.session_id, 'name': name, 'value': json.dumps(value), 'turn_no': last})
+    if turns:
+        conn.execute(turns_t.insert(), turns)
+    if slots:
+        conn.execute(slots_t.insert(), slots)
+
+
+def downgrade():
+    op.drop_table('conversation_slots')
+    op.drop_index('ux_conversation_turns_session_turn', table_name='conversation_turns')
+    op.drop_index('ix_conversation_turns_id', table_name='conversation_turns')
+    op.drop_table('conversation_turns')
+    with op.batch_alter_table('conversation_state') as batch:
+        batch.drop_column('version')
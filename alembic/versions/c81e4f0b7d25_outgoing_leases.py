@@ -0,0 +1,38 @@
+"""outgoing_messages: claim lease, attempts and retry schedule
+
+Revision ID: c81e4f0b7d25
+Revises: a3f0c6d2b8e1
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c81e4f0b7d25'
+down_revision = 'a3f0c6d2b8e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('outgoing_messages') as batch:
+        batch.add_column(sa.Column('claimed_by', sa.String(), nullable=True))
+        batch.add_column(sa.Column('lease_until', sa.DateTime(), nullable=True))
+        batch.add_column(sa.Column('attempts', sa.Integer(), nullable=True, server_default='0'))
+        batch.add_column(sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+    # existing queued rows are due now; rows stuck in 'sending' get an
+    # already-expired lease so the next worker reclaims them
+    op.execute("UPDATE outgoing_messages SET next_attempt_at = COALESCE(created_at, CURRENT_TIMESTAMP)")
+    op.execute("UPDATE outgoing_messages SET lease_until = CURRENT_TIMESTAMP WHERE status = 'sending'")
+    op.create_index('ix_outgoing_status_next_attempt', 'outgoing_messages', ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_outgoing_status_next_attempt', table_name='outgoing_messages')
+    with op.batch_alter_table('outgoing_messages') as batch:
+        batch.drop_column('next_attempt_at')
+        batch.drop_column('attempts')
+        batch.drop_column('lease_until')
+        batch.drop_column('claimed_by')
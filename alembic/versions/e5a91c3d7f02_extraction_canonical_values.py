@@ -0,0 +1,123 @@
+"""extractions: canonical_value, count, first/last seen + unique (session_id, type, canonical_value)
+
+Revision ID: e5a91c3d7f02
+Revises: c81e4f0b7d25
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    import phonenumbers
+except Exception:
+    phonenumbers = None
+
+# revision identifiers, used by Alembic.
+revision = 'e5a91c3d7f02'
+down_revision = 'c81e4f0b7d25'
+branch_labels = None
+depends_on = None
+
+
+# frozen copy of backend.app.extractions.canonical as of this revision: later
+# changes to the app's normalizers must not change what this migration does
+_PHONE_REGION = 'IN'
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_SCHEME_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.\-]*://')
+_URL_TRAILING = '.,;:!?)]}\'"'
+
+
+def _phone(value):
+    value = (value or '').strip()
+    if phonenumbers is not None:
+        try:
+            num = phonenumbers.parse(value, _PHONE_REGION)
+            if phonenumbers.is_possible_number(num):
+                return phonenumbers.format_number(num, phonenumbers.PhoneNumberFormat.E164)
+        except phonenumbers.NumberParseException:
+            pass
+    digits = re.sub(r'\D', '', value)
+    return '+' + digits if value.startswith('+') else digits
+
+
+def _url(value):
+    value = (value or '').strip().rstrip(_URL_TRAILING)
+    if not _SCHEME_RE.match(value):
+        value = 'http://' + value
+    try:
+        parts = urlsplit(value)
+        port = parts.port
+    except ValueError:
+        return value.lower()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    netloc = host
+    if parts.username is not None:
+        userinfo = parts.username + (f':{parts.password}' if parts.password is not None else '')
+        netloc = f'{userinfo}@{host}'
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        netloc += f':{port}'
+    return urlunsplit((scheme, netloc, parts.path.rstrip('/'), parts.query, ''))
+
+
+def _canonical(type_, value):
+    if type_ == 'phone':
+        return _phone(value)
+    if type_ == 'upi':
+        return (value or '').strip().lower()
+    if type_ == 'url':
+        return _url(value)
+    return (value or '').strip()
+
+
+def upgrade():
+    with op.batch_alter_table('extractions') as batch:
+        batch.add_column(sa.Column('canonical_value', sa.String(), nullable=True))
+        batch.add_column(sa.Column('count', sa.Integer(), nullable=True, server_default='1'))
+        batch.add_column(sa.Column('first_seen', sa.DateTime(), nullable=True))
+        batch.add_column(sa.Column('last_seen', sa.DateTime(), nullable=True))
+
+    # Backfill: the first row of each (session, type, canonical value) keeps
+    # the group's size as its count, the repeats are deleted. Seen times of
+    # existing rows are unknown and stay NULL.
+    conn = op.get_bind()
+    extractions = sa.table('extractions', sa.column('id', sa.Integer), sa.column('session_id', sa.String),
+                           sa.column('type', sa.String), sa.column('value', sa.String),
+                           sa.column('canonical_value', sa.String), sa.column('count', sa.Integer))
+    rows = conn.execute(sa.select(extractions.c.id, extractions.c.session_id, extractions.c.type, extractions.c.value).order_by(extractions.c.id)).fetchall()
+    keep = {}
+    counts = {}
+    dupes = []
+    for r in rows:
+        key = (r.session_id, r.type, _canonical(r.type, r.value))
+        if key in keep:
+            counts[key] += 1
+            dupes.append(r.id)
+        else:
+            keep[key] = r.id
+            counts[key] = 1
+    if keep:
+        conn.execute(
+            extractions.update().where(extractions.c.id == sa.bindparam('_id')).values(canonical_value=sa.bindparam('_cv'), count=sa.bindparam('_n')),
+            [{'_id': i, '_cv': key[2], '_n': counts[key]} for key, i in keep.items()],
+        )
+    for i in range(0, len(dupes), 500):
+        conn.execute(extractions.delete().where(extractions.c.id.in_(dupes[i:i + 500])))
+
+    op.create_index('ux_extractions_session_type_value', 'extractions', ['session_id', 'type', 'canonical_value'], unique=True)
+
+
+def downgrade():
+    # folded repeats are not restored
+    op.drop_index('ux_extractions_session_type_value', table_name='extractions')
+    with op.batch_alter_table('extractions') as batch:
+        batch.drop_column('last_seen')
+        batch.drop_column('first_seen')
+        batch.drop_column('count')
+        batch.drop_column('canonical_value')
@@ -0,0 +1,24 @@
+"""extractions: (canonical_value, type, session_id) index for cross-session lookups
+
+Revision ID: f2b64d8e1c37
+Revises: e5a91c3d7f02
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f2b64d8e1c37'
+down_revision = 'e5a91c3d7f02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_extractions_value_session', 'extractions', ['canonical_value', 'type', 'session_id'])
+
+
+def downgrade():
+    op.drop_index('ix_extractions_value_session', table_name='extractions')
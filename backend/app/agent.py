@@ -1,54 +1,49 @@
-import json
-import random
 import os
 from typing import Dict, Optional
 from datetime import datetime
-import json
-import re
 
-from .db import Message as DBMessage, ConversationState as CSModel, OutgoingMessage as OutMsg, Extraction as DBExtraction
+from .db import Message as DBMessage, OutgoingMessage as OutMsg
+from .conversation_state import get_store
+from . import session_summary
+from .outgoing_worker import ENQUEUED_KEY
+from .live_events import publish_session_event, stage_after_commit
 from .audit import append_event
 from backend.safety.safety_rules import check_reply_safety
 from .guvi_callback import send_guvi_callback
-import threading
-
-PERSONA_DIR = os.path.join(os.path.dirname(__file__), 'personas')
+from .persona_registry import get_registry, PersonaMatcher
 
 
 def load_persona(persona_id: str = 'honeypot_default') -> Dict:
-    path = os.path.join(PERSONA_DIR, 'honeypot_persona.json')
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return get_registry().get(persona_id).persona
 
 
 def simple_match(text: str, persona: Dict) -> (str, Dict):
-    t = text
-    # check behaviors: exact tokens, then regex
-    for b in persona.get('behaviors', []):
-        # token matches
-        for m in b.get('match', []):
-            if m.lower() in t.lower():
-                return random.choice(b.get('response_templates', [])), {}
-        # regex patterns
-        for pattern in b.get('patterns', []) if b.get('patterns') else []:
-            mobj = re.search(pattern, t, flags=re.IGNORECASE)
-            if mobj:
-                slots = {k: v for k, v in mobj.groupdict().items() if v is not None}
-                return random.choice(b.get('response_templates', [])), slots
-
-    # default heuristics
-    digits = ''.join([c for c in t if c.isdigit()])
-    if len(digits) >= 6:
-        return random.choice(["Thanks — can you confirm the last 4 digits?", "Got it. What's the account holder name?"]), {}
-    fallbacks = persona.get('fallbacks', [])
-    if fallbacks:
-        return random.choice(fallbacks), {}
-    return "Okay.", {}
-
-
-def respond(session_id: str, incoming_text: str, db: Optional[object] = None, persona_id: str = 'honeypot_default', background_tasks: Optional[object] = None) -> Dict:
-    persona = load_persona(persona_id)
-    reply, slots = simple_match(incoming_text, persona)
+    """Match `text` against an ad-hoc persona dict (compiled on each call).
+
+    `respond()` uses the registry's cached matcher instead.
+    """
+    return PersonaMatcher(persona).match(text)
+
+
+def _persist_turn(db, session_id: str, reply: str, slots: Dict):
+    """Stage the agent message, turn (see conversation_state.py) and outgoing
+    row, flush them and fold the agent message into the session summary.
+    Returns the session's new TurnState."""
+    now = datetime.utcnow()
+    db.add(DBMessage(session_id=session_id, sender='agent', text=reply, timestamp=now, raw=reply))
+    state = get_store().append_turn(db, session_id, 'agent', reply, now, slots)
+    db.add(OutMsg(session_id=session_id, content=reply, status='queued', created_at=now))
+    db.info[ENQUEUED_KEY] = True  # wake the outgoing dispatcher on commit
+    db.flush()
+    session_summary.record(db, session_id, session_summary.SummaryDelta().add_message(now, agent=True))
+    publish_session_event(db, session_id, {'type': 'message', 'sender': 'agent', 'text': reply, 'timestamp': now.isoformat()})
+    return state
+
+
+def respond(session_id: str, incoming_text: str, db: Optional[object] = None, persona_id: str = 'honeypot_default', commit: bool = True) -> Dict:
+    entry = get_registry().get(persona_id)
+    persona = entry.persona
+    reply, slots = entry.matcher.match(incoming_text)
 
     # Run safety checks on the generated reply. If the reply is unsafe,
     # replace with a safe fallback or a redacted version.
@@ -68,64 +63,23 @@ def respond(session_id: str, incoming_text: str, db: Optional[object] = None, pe
         except Exception:
             pass
 
-    # persist agent message and queue outgoing send if db provided
+    # persist agent message, conversation state and outgoing send if db provided.
+    # All three rows go into the caller's transaction; with commit=False the
+    # caller owns the unit of work and commits once (see routes._ingest_message).
     if db is not None:
-        # persist agent message first (critical)
-        try:
-            msg = DBMessage(session_id=session_id, sender='agent', text=reply, timestamp=datetime.utcnow(), raw=reply)
-            db.add(msg)
-            db.commit()
-        except Exception:
-            try:
-                db.rollback()
-            except Exception:
-                pass
-
-        # update conversation state (best-effort)
+        state = None
         try:
-            cs = db.query(CSModel).filter(CSModel.session_id == session_id).first()
-            if not cs:
-                cs = CSModel(
-                    session_id=session_id,
-                    turn_count=1,
-                    last_agent_reply=reply,
-                    messages_json=json.dumps([{'sender': 'agent', 'text': reply, 'ts': datetime.utcnow().isoformat()}]),
-                    slots_json=json.dumps(slots)
-                )
-                db.add(cs)
-                db.commit()
-            else:
-                cs.turn_count = (cs.turn_count or 0) + 1
-                cs.last_agent_reply = reply
-                try:
-                    msgs = json.loads(cs.messages_json) if cs.messages_json else []
-                except Exception:
-                    msgs = []
-                msgs.append({'sender': 'agent', 'text': reply, 'ts': datetime.utcnow().isoformat()})
-                cs.messages_json = json.dumps(msgs[-10:])
-                try:
-                    existing_slots = json.loads(cs.slots_json) if cs.slots_json else {}
-                except Exception:
-                    existing_slots = {}
-                existing_slots.update(slots or {})
-                cs.slots_json = json.dumps(existing_slots)
+            state = _persist_turn(db, session_id, reply, slots)
+            if commit:
                 db.commit()
         except Exception:
+            if not commit:
+                raise
             try:
                 db.rollback()
             except Exception:
                 pass
 
-        # enqueue outgoing message (best-effort)
-        try:
-            with db.begin():
-                out = OutMsg(session_id=session_id, content=reply, status='queued', created_at=datetime.utcnow())
-                db.add(out)
-        except Exception:
-            try:
-                db.rollback()
-            except Exception:
-                pass
         # Check for conversation completion and trigger final GUVI callback asynchronously
         try:
             # completion rules: persona setting -> env override -> defaults
@@ -147,20 +101,17 @@ def respond(session_id: str, incoming_text: str, db: Optional[object] = None, pe
             # phrase-based completion detection on incoming text
             end_phrases = ['thank you', 'thanks', 'bye', 'ok done', 'done', 'goodbye']
 
-            # reload conversation state
-            cs = db.query(CSModel).filter(CSModel.session_id == session_id).first()
+            # conversation state after this turn (cached; reloaded if the turn failed)
+            if state is None:
+                state = get_store().get(db, session_id)
             is_complete = False
-            if cs and (cs.turn_count or 0) >= int(complete_after):
+            if state and (state.turn_count or 0) >= int(complete_after):
                 is_complete = True
 
             # check completion slots
-            if completion_slots and cs:
-                try:
-                    slots = json.loads(cs.slots_json) if cs.slots_json else {}
-                    if all(s in slots and slots.get(s) for s in completion_slots):
-                        is_complete = True
-                except Exception:
-                    pass
+            if completion_slots and state:
+                if all(s in state.slots and state.slots.get(s) for s in completion_slots):
+                    is_complete = True
 
             # phrase check on last incoming_text
             if incoming_text:
@@ -170,20 +121,12 @@ def respond(session_id: str, incoming_text: str, db: Optional[object] = None, pe
                         is_complete = True
                         break
 
-            if is_complete and cs:
+            if is_complete and state:
                 # build final payload
-                messages = db.query(DBMessage).filter(DBMessage.session_id == session_id).order_by(DBMessage.timestamp).all()
-                extractions = db.query(DBExtraction).filter(DBExtraction.session_id == session_id).all()
-                extracted = {"bankAccounts": [], "upiIds": [], "phishingLinks": [], "phoneNumbers": [], "suspiciousKeywords": []}
-                for e in extractions:
-                    if e.type == 'phone':
-                        extracted['phoneNumbers'].append(e.value)
-                    if e.type == 'upi':
-                        extracted['upiIds'].append(e.value)
-                    if e.type == 'url':
-                        extracted['phishingLinks'].append(e.value)
-                total_messages = len(messages)
-                agent_notes = cs.last_agent_reply if getattr(cs, 'last_agent_reply', None) else f"Agent completed after {cs.turn_count} turns"
+                summary = session_summary.get(db, session_id)
+                extracted = session_summary.extracted_intelligence(summary)
+                total_messages = summary.message_count or 0
+                agent_notes = reply or f"Agent completed after {state.turn_count} turns"
                 payload = {
                     'sessionId': session_id,
                     'scamDetected': True,
@@ -191,16 +134,11 @@ def respond(session_id: str, incoming_text: str, db: Optional[object] = None, pe
                     'extractedIntelligence': extracted,
                     'agentNotes': agent_notes
                 }
-                # schedule using BackgroundTasks when provided; otherwise fall back to thread
-                try:
-                    if background_tasks is not None:
-                        background_tasks.add_task(send_guvi_callback, payload)
-                    else:
-                        t = threading.Thread(target=send_guvi_callback, args=(payload,), daemon=True)
-                        t.start()
-                    append_event('guvi_callback_scheduled_by_agent', {'sessionId': session_id, 'via': 'background_tasks' if background_tasks is not None else 'thread'})
-                except Exception:
-                    append_event('guvi_callback_schedule_failed', {'sessionId': session_id})
+                if commit:
+                    _send_final_callback(payload)
+                else:
+                    # the caller's transaction may still roll back: send once it commits
+                    stage_after_commit(db, _send_final_callback, payload)
         except Exception:
             try:
                 append_event('agent_completion_check_error', {'sessionId': session_id})
@@ -211,3 +149,14 @@ def respond(session_id: str, incoming_text: str, db: Optional[object] = None, pe
         'reply': reply,
         'persona': persona.get('name')
     }
+
+
+def _send_final_callback(payload: Dict) -> None:
+    # hand to the async sender (never blocks this thread)
+    session_id = payload.get('sessionId')
+    try:
+        res = send_guvi_callback(payload)
+        append_event('guvi_callback_scheduled_by_agent', {'sessionId': session_id, 'via': res.get('status')})
+    except Exception:
+        append_event('guvi_callback_schedule_failed', {'sessionId': session_id})
+
@@ -1,15 +1,34 @@
+"""Append-only, HMAC-signed audit log.
+
+Each entry is two lines in `AUDIT_FILE`: the canonical JSON of
+{ts, type, payload} and its hex HMAC-SHA256 signature.
+
+`append_event` only timestamps the entry and puts it on a bounded queue
+(`AUDIT_QUEUE_SIZE`; callers block when it is full rather than lose audit
+records). One writer thread keeps the file open, signs and writes whatever
+has accumulated (up to `AUDIT_BATCH` entries) in a single write, and also
+emits the entries to the `sentinel.audit` logger. `AUDIT_FSYNC` controls
+durability:
+
+- `always`: fsync after every batch;
+- `interval` (default): fsync at most every `AUDIT_FSYNC_INTERVAL` seconds;
+- `never`: leave it to the OS.
+
+`flush()` waits until everything appended so far is written and synced;
+readers call it first, and `shutdown_audit()` (application shutdown, and at
+interpreter exit) drains the queue and closes the file.
+"""
 import hmac
 import hashlib
 import json
 from datetime import datetime
 import os
+import time
+import queue
+import atexit
+import threading
 from pathlib import Path
-import hmac
-import hashlib
-import json
-from datetime import datetime
-import os
-from pathlib import Path
+from typing import Optional
 import logging
 
 # structured logger
@@ -27,6 +46,11 @@ HMAC_KEY = os.getenv("AUDIT_HMAC_KEY", None)
 HMAC_KEY_NEXT = os.getenv("AUDIT_HMAC_KEY_NEXT", None)
 USE_NEXT_FOR_SIGN = os.getenv("AUDIT_HMAC_KEY_USE_NEXT", "0") == "1"
 
+QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("AUDIT_BATCH", "512"))
+FSYNC_POLICY = os.getenv("AUDIT_FSYNC", "interval").strip().lower()
+FSYNC_INTERVAL = float(os.getenv("AUDIT_FSYNC_INTERVAL", "1"))
+
 # For local development and tests, fall back to a well-known default key
 # so audit signing doesn't raise. In production, set `AUDIT_HMAC_KEY` explicitly.
 if not HMAC_KEY and not HMAC_KEY_NEXT:
@@ -41,15 +65,16 @@ def _sign_with_key(data: bytes, key: str) -> str:
     return hmac.new(key.encode("utf-8"), data, hashlib.sha256).hexdigest()
 
 
-def _sign(data: bytes) -> str:
-    key = None
+def _signing_key() -> str:
     if USE_NEXT_FOR_SIGN and HMAC_KEY_NEXT:
-        key = HMAC_KEY_NEXT
-    elif HMAC_KEY:
-        key = HMAC_KEY
-    else:
-        raise RuntimeError("No AUDIT_HMAC_KEY configured for signing audit entries")
-    return _sign_with_key(data, key)
+        return HMAC_KEY_NEXT
+    if HMAC_KEY:
+        return HMAC_KEY
+    raise RuntimeError("No AUDIT_HMAC_KEY configured for signing audit entries")
+
+
+def _sign(data: bytes) -> str:
+    return _sign_with_key(data, _signing_key())
 
 
 def _verify_signature(data: bytes, sig: str) -> bool:
@@ -69,53 +94,263 @@ def _verify_signature(data: bytes, sig: str) -> bool:
     return False
 
 
+def _canonical(entry: dict) -> bytes:
+    return json.dumps(entry, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def _record(raw: bytes, sig: str) -> bytes:
+    """Two-line record: canonical JSON, then its signature."""
+    # Preserve current two-line JSONL+sig format for streaming compatibility.
+    return raw + b"\n" + (sig + "\n").encode("utf-8")
+
+
+_ROTATE = object()
+
+
+class AuditWriter:
+    """Single background thread owning the open audit file.
+
+    It also rotates the file into sealed segments (see audit_segments.py)
+    once it is `segment_bytes` large or `segment_seconds` old (0 disables
+    either limit).
+    """
+
+    def __init__(self, path: Path, queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 fsync: str = FSYNC_POLICY, fsync_interval: float = FSYNC_INTERVAL,
+                 segment_bytes: Optional[int] = None, segment_seconds: Optional[int] = None):
+        from . import audit_segments
+        self.path = Path(path)
+        self.segment_bytes = audit_segments.SEGMENT_BYTES if segment_bytes is None else segment_bytes
+        self.segment_seconds = audit_segments.SEGMENT_SECONDS if segment_seconds is None else segment_seconds
+        self._tracker = None
+        self.batch_size = max(1, batch_size)
+        self.fsync = fsync if fsync in ("always", "interval", "never") else "interval"
+        self.fsync_interval = max(0.0, fsync_interval)
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, entry: dict, raw: bytes) -> None:
+        """Queue an entry and its canonical JSON (encoded by the caller, so
+        later changes to the payload object don't leak in)."""
+        self.start()
+        self._q.put((entry, raw))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until entries submitted so far are written (and synced)."""
+        t = self._thread
+        if t is None or not t.is_alive():
+            return True
+        done = threading.Event()
+        self._q.put(done)
+        return done.wait(timeout)
+
+    def rotate(self, timeout: float = 5.0) -> bool:
+        """Seal the live segment now (no-op when it is empty)."""
+        self.start()
+        self._q.put(_ROTATE)
+        return self.flush(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        t = self._thread
+        if t is None or not t.is_alive():
+            return
+        self._q.put(None)
+        t.join(timeout)
+
+    # -- writer thread ---------------------------------------------------
+
+    def _open(self):
+        if self._file is None:
+            from .audit_segments import COMPRESS, SegmentTracker, compress_in_background, list_segments
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self._tracker is None:
+                self._tracker = SegmentTracker.resume(self.path)
+                if COMPRESS:
+                    # finish compressions a previous process did not get to
+                    for m in list_segments():
+                        if not m.get("compressed"):
+                            compress_in_background(m)
+            self._file = open(self.path, "ab")
+        return self._file
+
+    def _rotate(self) -> None:
+        from . import audit_segments
+        if self._tracker is None:
+            self._open()
+        if self._tracker.entries == 0:
+            return
+        try:
+            self._sync()
+            self._file.close()
+        except Exception:
+            pass
+        self._file = None
+        try:
+            manifest = audit_segments.seal(self.path, self._tracker)
+        except Exception as e:
+            # keep appending to the same file; retried on the next batch
+            try:
+                _audit_logger.warning({"audit_rotate_failed": str(e)})
+            except Exception:
+                pass
+            return
+        self._tracker = audit_segments.SegmentTracker(manifest["chain_digest"])
+        if audit_segments.COMPRESS:
+            audit_segments.compress_in_background(manifest)
+
+    def _sync(self) -> None:
+        if self._dirty and self._file is not None and self.fsync != "never":
+            os.fsync(self._file.fileno())
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _write(self, entries) -> None:
+        try:
+            f = self._open()
+            sigs = [_sign(raw) for _, raw in entries]
+            f.write(b"".join(_record(raw, sig) for (_, raw), sig in zip(entries, sigs)))
+            f.flush()
+            self._dirty = True
+            for (entry, raw), sig in zip(entries, sigs):
+                self._tracker.add(entry.get("ts"), sig, len(raw) + len(sig) + 2)
+            if self.fsync == "always" or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+        except Exception as e:
+            # reopen on the next batch (e.g. the file was moved away)
+            try:
+                _audit_logger.warning({"audit_write_failed": str(e), "entries": len(entries)})
+            except Exception:
+                pass
+            try:
+                if self._file is not None:
+                    self._file.close()
+            except Exception:
+                pass
+            self._file = None
+            return
+        for entry, _ in entries:
+            try:
+                # also emit structured JSON line to audit logger
+                # include an indicator of which key was used for signing (best-effort)
+                log_entry = dict(entry)
+                log_entry["_audit_signed_with_next"] = USE_NEXT_FOR_SIGN and bool(HMAC_KEY_NEXT)
+                _audit_logger.info(log_entry)
+            except Exception:
+                pass
+
+    def _run(self):
+        while True:
+            try:
+                # with unsynced data, wake up in time to honour the interval
+                item = self._q.get(timeout=self.fsync_interval if self._dirty else None)
+            except queue.Empty:
+                self._safe_sync()
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            entries, waiters, stop, rotate = [], [], False, False
+            for it in batch:
+                if it is None:
+                    stop = True
+                elif it is _ROTATE:
+                    rotate = True
+                elif isinstance(it, threading.Event):
+                    waiters.append(it)
+                else:
+                    entries.append(it)
+            if entries:
+                self._write(entries)
+            if rotate or (self._tracker is not None and self._tracker.due(self.segment_bytes, self.segment_seconds)):
+                self._rotate()
+            if waiters or stop:
+                self._safe_sync()
+                for w in waiters:
+                    w.set()
+            if stop:
+                try:
+                    if self._file is not None:
+                        self._file.close()
+                except Exception:
+                    pass
+                self._file = None
+                return
+
+    def _safe_sync(self) -> None:
+        try:
+            self._sync()
+        except Exception:
+            pass
+
+
+_writer: Optional[AuditWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> AuditWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter(AUDIT_FILE)
+    return _writer
+
+
 def append_event(event_type: str, payload: dict):
     entry = {
         "ts": datetime.utcnow().isoformat() + "Z",
         "type": event_type,
         "payload": payload
     }
-    raw = json.dumps(entry, separators=(",", ":"), sort_keys=True).encode("utf-8")
-    sig = _sign(raw)
-    # Preserve current two-line JSONL+sig format for streaming compatibility.
-    try:
-        with open(AUDIT_FILE, "ab") as f:
-            f.write(raw + b"\n")
-            f.write((sig + "\n").encode("utf-8"))
-    except Exception:
-        pass
+    raw = _canonical(entry)
     try:
-        # also emit structured JSON line to audit logger
-        # include an indicator of which key was used for signing (best-effort)
-        log_entry = dict(entry)
-        log_entry["_audit_signed_with_next"] = USE_NEXT_FOR_SIGN and bool(HMAC_KEY_NEXT)
-        _audit_logger.info(log_entry)
+        get_writer().submit(entry, raw)
     except Exception:
         pass
 
 
+def flush(timeout: float = 5.0) -> bool:
+    """Wait until every event appended so far is on disk."""
+    if _writer is None:
+        return True
+    return _writer.flush(timeout)
+
+
+def rotate(timeout: float = 5.0) -> bool:
+    """Seal the live segment (e.g. before switching signing keys)."""
+    return get_writer().rotate(timeout)
+
+
+def shutdown_audit(timeout: float = 5.0) -> None:
+    """Drain queued events, sync and close the audit file."""
+    if _writer is not None:
+        _writer.close(timeout)
+
+
+atexit.register(shutdown_audit)
+
+
 def read_events():
     """Read the audit file and return a list of entries with signature validity.
 
     The audit file uses a two-line format per entry: raw JSON line (bytes)
-    followed by a hex signature line (utf-8).
+    followed by a hex signature line (utf-8). Sealed segments are included,
+    oldest first. For large logs prefer
+    `audit_reader.iter_events()` (lazy, indexed) or `audit_reader.verify_file()`.
     """
-    if not AUDIT_FILE.exists():
-        return []
-    events = []
-    with open(AUDIT_FILE, "rb") as f:
-        lines = f.read().splitlines()
-    for i in range(0, len(lines), 2):
-        raw = lines[i]
-        sig = lines[i + 1].decode("utf-8") if i + 1 < len(lines) else ""
-        valid = False
-        try:
-            valid = _verify_signature(raw, sig)
-        except Exception:
-            valid = False
-        try:
-            raw_decoded = raw.decode("utf-8")
-        except Exception:
-            raw_decoded = ""
-        events.append({"raw": raw_decoded, "sig": sig, "valid": valid})
-    return events
+    from .audit_reader import iter_events
+    return [{"raw": e["raw"], "sig": e["sig"], "valid": e["valid"]} for e in iter_events()]
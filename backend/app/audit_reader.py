@@ -0,0 +1,325 @@
+"""Streaming reads and verification of the audit log.
+
+`audit.read_events()` used to load the whole file and verify every entry.
+Here entries are yielded lazily from an mmap of the file, and a sidecar
+index (`<audit file>.idx`) lets time-range and type queries skip straight
+to the parts of the file that can match.
+
+Index format (JSON lines): a header `{"version": 1, "every": N}` followed by
+one line per block of N entries:
+
+    {"start": <byte offset>, "end": <byte offset>, "n": <entries>,
+     "first_ts": ..., "last_ts": ..., "types": [...]}
+
+`build_index()` is incremental: it appends blocks for entries written since
+the last run and starts over if the file was truncated or replaced. Entries
+after the last full block are always scanned directly.
+
+`verify_file()` checks every signature across a process pool, one task per
+group of index blocks, returning counts and the offsets of bad entries.
+`verify_all()` adds the sealed segments and their manifest chain.
+"""
+import os
+import json
+import mmap
+import hmac
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+INDEX_VERSION = 1
+INDEX_EVERY = int(os.getenv("AUDIT_INDEX_EVERY", "1024"))
+VERIFY_WORKERS = int(os.getenv("AUDIT_VERIFY_WORKERS", "0")) or None  # default: CPU count
+# index blocks handed to one verification task
+VERIFY_BLOCKS_PER_TASK = 16
+
+TimeBound = Union[str, datetime, None]
+
+
+def index_path(path: Path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + ".idx")
+
+
+def _ts_key(value: TimeBound) -> Optional[str]:
+    # entries carry ISO-8601 UTC strings, which order lexicographically
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _keys() -> List[str]:
+    from . import audit
+    return [k for k in (audit.HMAC_KEY, audit.HMAC_KEY_NEXT) if k]
+
+
+def _valid(raw: bytes, sig: str, keys: Sequence[str]) -> bool:
+    for key in keys:
+        try:
+            if hmac.compare_digest(hmac.new(key.encode("utf-8"), raw, hashlib.sha256).hexdigest(), sig):
+                return True
+        except Exception:
+            pass
+    return False
+
+
+class _Mapped:
+    """Read-only mmap of a file (an empty file maps to b"")."""
+
+    def __init__(self, path: Path):
+        self._f = open(path, "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self.buf = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.size = size
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _records(buf, start: int, end: int) -> Iterator[Tuple[int, bytes, str, int]]:
+    """(offset, raw, sig, next offset) per complete two-line record in [start, end)."""
+    pos = start
+    while pos < end:
+        nl = buf.find(b"\n", pos, end)
+        if nl < 0:
+            return
+        raw = buf[pos:nl]
+        nl2 = buf.find(b"\n", nl + 1, end)
+        if nl2 < 0:
+            # signature line not written (yet)
+            return
+        yield pos, raw, buf[nl + 1:nl2].decode("utf-8", "replace"), nl2 + 1
+        pos = nl2 + 1
+
+
+def iter_records(path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, bytes, str]]:
+    path = Path(path)
+    if not path.exists():
+        return
+    with _Mapped(path) as m:
+        for off, raw, sig, _ in _records(m.buf, start, m.size if end is None else min(end, m.size)):
+            yield off, raw, sig
+
+
+# -- index ----------------------------------------------------------------
+
+def load_index(path: Path) -> Tuple[int, List[dict]]:
+    """(entries per block, blocks) of the sidecar index; no blocks if absent."""
+    idx = index_path(path)
+    if not idx.exists():
+        return INDEX_EVERY, []
+    blocks = []
+    every = INDEX_EVERY
+    with open(idx, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                break  # torn last line
+            if i == 0:
+                if rec.get("version") != INDEX_VERSION:
+                    return INDEX_EVERY, []
+                every = rec.get("every", INDEX_EVERY)
+                continue
+            blocks.append(rec)
+    return every, blocks
+
+
+def build_index(path: Path, every: int = INDEX_EVERY) -> List[dict]:
+    """Bring the sidecar index up to date with `path` and return its blocks."""
+    path = Path(path)
+    idx = index_path(path)
+    if not path.exists():
+        return []
+    old_every, blocks = load_index(path)
+    size = path.stat().st_size
+    if old_every != every or (blocks and blocks[-1]["end"] > size):
+        # different block size, or the log was truncated/replaced
+        blocks = []
+    mode = "a" if blocks else "w"
+    start = blocks[-1]["end"] if blocks else 0
+    new_blocks = []
+    cur = None
+    with _Mapped(path) as m:
+        for off, raw, _, nxt in _records(m.buf, start, m.size):
+            try:
+                entry = json.loads(raw)
+                ts, typ = entry.get("ts"), entry.get("type")
+            except ValueError:
+                ts, typ = None, None
+            if cur is None:
+                cur = {"start": off, "end": off, "n": 0, "first_ts": ts, "last_ts": ts, "types": set()}
+            cur["n"] += 1
+            cur["end"] = nxt
+            if ts is not None:
+                if cur["first_ts"] is None or ts < cur["first_ts"]:
+                    cur["first_ts"] = ts
+                if cur["last_ts"] is None or ts > cur["last_ts"]:
+                    cur["last_ts"] = ts
+            if typ is not None:
+                cur["types"].add(typ)
+            if cur["n"] >= every:
+                cur["types"] = sorted(cur["types"])
+                new_blocks.append(cur)
+                cur = None
+    if new_blocks or mode == "w":
+        with open(idx, mode, encoding="utf-8") as f:
+            if mode == "w":
+                f.write(json.dumps({"version": INDEX_VERSION, "every": every}) + "\n")
+            for b in new_blocks:
+                f.write(json.dumps(b, separators=(",", ":")) + "\n")
+    return blocks + new_blocks
+
+
+def _block_matches(block: dict, since: Optional[str], until: Optional[str], types: Optional[set]) -> bool:
+    if since is not None and block.get("last_ts") is not None and block["last_ts"] < since:
+        return False
+    if until is not None and block.get("first_ts") is not None and block["first_ts"] > until:
+        return False
+    if types is not None and not types.intersection(block.get("types") or ()):
+        return False
+    return True
+
+
+# -- queries --------------------------------------------------------------
+
+def _matches(raw: bytes, since: Optional[str], until: Optional[str], types: Optional[set]) -> bool:
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        return False
+    ts = entry.get("ts") or ""
+    if since is not None and ts < since:
+        return False
+    if until is not None and ts > until:
+        return False
+    return types is None or entry.get("type") in types
+
+
+def _event(raw: bytes, sig: str, keys: Sequence[str], verify: bool, **extra) -> Dict:
+    try:
+        raw_decoded = raw.decode("utf-8")
+    except Exception:
+        raw_decoded = ""
+    return dict({"raw": raw_decoded, "sig": sig, "valid": _valid(raw, sig, keys) if verify else None}, **extra)
+
+
+def iter_events(path: Optional[Path] = None, since: TimeBound = None, until: TimeBound = None,
+                types: Optional[Sequence[str]] = None, verify: bool = True, use_index: bool = True) -> Iterator[Dict]:
+    """Yield {"raw", "sig", "valid", ...} per entry, oldest first.
+
+    Without `path` this covers the whole log: sealed segments (see
+    audit_segments.py; those whose manifest ts range cannot match are
+    skipped) followed by the live file. Live entries carry their byte
+    "offset", archived ones their "segment".
+
+    With `since`/`until`/`types` only matching entries are yielded, and
+    index blocks that cannot contain a match are not read at all.
+    """
+    since_k, until_k = _ts_key(since), _ts_key(until)
+    type_set = set(types) if types else None
+    filtering = since_k is not None or until_k is not None or type_set is not None
+    keys = _keys() if verify else []
+    if path is None:
+        from . import audit, audit_segments
+        audit.flush()
+        path = audit.AUDIT_FILE
+        for m in audit_segments.list_segments():
+            if not _block_matches({"first_ts": m.get("first_ts"), "last_ts": m.get("last_ts")}, since_k, until_k, None):
+                continue
+            try:
+                for raw, sig in audit_segments.iter_segment(m):
+                    if not filtering or _matches(raw, since_k, until_k, type_set):
+                        yield _event(raw, sig, keys, verify, segment=m["segment"])
+            except FileNotFoundError:
+                # deleted by retention (or still being compressed) meanwhile
+                continue
+    path = Path(path)
+    if not path.exists():
+        return
+    blocks = build_index(path) if (use_index and filtering) else []
+
+    with _Mapped(path) as m:
+        ranges = [(b["start"], b["end"]) for b in blocks if _block_matches(b, since_k, until_k, type_set)]
+        ranges.append((blocks[-1]["end"] if blocks else 0, m.size))
+        for start, end in ranges:
+            for off, raw, sig, _ in _records(m.buf, start, end):
+                if not filtering or _matches(raw, since_k, until_k, type_set):
+                    yield _event(raw, sig, keys, verify, offset=off)
+
+
+# -- verification ---------------------------------------------------------
+
+def _verify_range(args) -> Tuple[int, List[int]]:
+    path, start, end, keys = args
+    total, bad = 0, []
+    for off, raw, sig in iter_records(Path(path), start, end):
+        total += 1
+        if not _valid(raw, sig, keys):
+            bad.append(off)
+    return total, bad
+
+
+def verify_file(path: Optional[Path] = None, workers: Optional[int] = VERIFY_WORKERS) -> Dict:
+    """Verify every entry; returns {"total", "invalid", "invalid_offsets"}.
+
+    Work is split along index blocks and spread over `workers` processes
+    (`workers=1` verifies in this process). Without `path` this checks the
+    live file only; `verify_all()` also covers the sealed segments.
+    """
+    if path is None:
+        from . import audit
+        audit.flush()
+        path = audit.AUDIT_FILE
+    path = Path(path)
+    if not path.exists():
+        return {"total": 0, "invalid": 0, "invalid_offsets": []}
+    keys = _keys()
+    blocks = build_index(path)
+    tasks = []
+    for i in range(0, len(blocks), VERIFY_BLOCKS_PER_TASK):
+        group = blocks[i:i + VERIFY_BLOCKS_PER_TASK]
+        tasks.append((str(path), group[0]["start"], group[-1]["end"], keys))
+    tasks.append((str(path), blocks[-1]["end"] if blocks else 0, None, keys))
+
+    if workers == 1 or len(tasks) == 1:
+        results = [_verify_range(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_verify_range, tasks))
+    bad = [off for _, offs in results for off in offs]
+    return {"total": sum(n for n, _ in results), "invalid": len(bad), "invalid_offsets": bad}
+
+
+def verify_all(workers: Optional[int] = VERIFY_WORKERS) -> Dict:
+    """Verify the whole log: every sealed segment against its manifest, the
+    manifest chain, then the live file.
+
+    Returns {"ok", "segments": [per-segment results], "chain_breaks":
+    [segment numbers], "live": verify_file() result}.
+    """
+    from . import audit_segments
+    manifests = audit_segments.list_segments()
+    segments = []
+    for m in manifests:
+        try:
+            segments.append(audit_segments.verify_segment(m))
+        except FileNotFoundError:
+            # deleted by retention meanwhile
+            continue
+    breaks = audit_segments.verify_chain(manifests)
+    live = verify_file(None, workers=workers)
+    ok = all(r["ok"] for r in segments) and not breaks and not live["invalid"]
+    return {"ok": ok, "segments": segments, "chain_breaks": breaks, "live": live}
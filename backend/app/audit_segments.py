@@ -0,0 +1,331 @@
+"""Segmented audit storage: rotation, archives, manifests and retention.
+
+The writer appends to the live segment (`AUDIT_FILE`). Once it reaches
+`AUDIT_SEGMENT_BYTES` or is `AUDIT_SEGMENT_SECONDS` old it is sealed:
+
+- moved to `<LOG_DIR>/audit_segments/audit-<n>.log` and gzip-compressed in the
+  background to `audit-<n>.log.gz` (the entry format is unchanged);
+- described by `audit-<n>.manifest.json`: entry count, first/last ts, size,
+  and a rolling HMAC chain digest
+  `d_i = HMAC(key, d_{i-1} + sig_i)` seeded with the previous segment's
+  digest. The manifest itself is signed.
+
+The chain detects dropped, reordered or spliced entries inside a segment and
+missing segments between manifests. Everything here works on one segment
+at a time: `verify_segment()` and `redact_segment()` are O(segment), and
+`apply_retention()` deletes or redacts sealed segments by age without
+touching the live one. A redacted segment's entries are re-signed; its
+manifest keeps the original `chain_digest` (so the chain to the next
+segment still verifies) and adds `content_digest` over the new entries.
+
+The chain is keyed with the signing key in use; when switching
+`AUDIT_HMAC_KEY_USE_NEXT`, call `audit.rotate()` so a segment never mixes keys.
+"""
+import os
+import re
+import gzip
+import json
+import time
+import hmac
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import audit
+
+SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+SEGMENT_SECONDS = int(os.getenv("AUDIT_SEGMENT_SECONDS", "86400"))
+COMPRESS = os.getenv("AUDIT_SEGMENT_COMPRESS", "1") == "1"
+
+_NAME_RE = re.compile(r"^audit-(\d+)\.manifest\.json$")
+
+
+def segment_dir() -> Path:
+    return audit.LOG_DIR / "audit_segments"
+
+
+def _keys() -> List[str]:
+    return [k for k in (audit.HMAC_KEY, audit.HMAC_KEY_NEXT) if k]
+
+
+def chain_step(prev: str, sig: str, key: str) -> str:
+    return hmac.new(key.encode("utf-8"), (prev + sig).encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _manifest_sig(manifest: Dict, key: str) -> str:
+    body = {k: v for k, v in manifest.items() if k != "sig"}
+    return audit._sign_with_key(json.dumps(body, separators=(",", ":"), sort_keys=True).encode("utf-8"), key)
+
+
+def _write_manifest(manifest: Dict) -> Dict:
+    manifest = dict(manifest)
+    manifest["sig"] = _manifest_sig(manifest, audit._signing_key())
+    path = segment_dir() / f"audit-{manifest['segment']:08d}.manifest.json"
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return manifest
+
+
+def list_segments() -> List[Dict]:
+    """Manifests of sealed segments, oldest first."""
+    d = segment_dir()
+    if not d.is_dir():
+        return []
+    out = []
+    for p in d.iterdir():
+        if _NAME_RE.match(p.name):
+            try:
+                with open(p, "r", encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(out, key=lambda m: m["segment"])
+
+
+class SegmentTracker:
+    """Running manifest fields of the live segment (writer thread only)."""
+
+    def __init__(self, prev_digest: str = "", key: Optional[str] = None):
+        self.key = key or audit._signing_key()
+        self.prev_digest = prev_digest
+        self.digest = prev_digest
+        self.entries = 0
+        self.bytes = 0
+        self.first_ts: Optional[str] = None
+        self.last_ts: Optional[str] = None
+        self.started = time.time()
+
+    def add(self, ts: Optional[str], sig: str, nbytes: int) -> None:
+        if self.entries == 0:
+            self.first_ts = ts
+            self.started = time.time()
+        self.entries += 1
+        self.bytes += nbytes
+        self.last_ts = ts
+        self.digest = chain_step(self.digest, sig, self.key)
+
+    def due(self, max_bytes: int = SEGMENT_BYTES, max_seconds: int = SEGMENT_SECONDS) -> bool:
+        if self.entries == 0:
+            return False
+        if max_bytes and self.bytes >= max_bytes:
+            return True
+        return bool(max_seconds) and time.time() - self.started >= max_seconds
+
+    @classmethod
+    def resume(cls, live: Path) -> "SegmentTracker":
+        """Rebuild the tracker after a restart by scanning the live segment."""
+        segments = list_segments()
+        tracker = cls(segments[-1]["chain_digest"] if segments else "")
+        if Path(live).exists():
+            for raw, sig in _iter_plain(Path(live)):
+                try:
+                    ts = json.loads(raw).get("ts")
+                except ValueError:
+                    ts = None
+                tracker.add(ts, sig, len(raw) + len(sig) + 2)
+            if tracker.first_ts:
+                try:
+                    tracker.started = datetime.fromisoformat(tracker.first_ts.rstrip("Z")).timestamp()
+                except ValueError:
+                    pass
+        return tracker
+
+
+def seal(live: Path, tracker: SegmentTracker) -> Dict:
+    """Move the (closed) live segment into the archive and write its manifest."""
+    d = segment_dir()
+    d.mkdir(parents=True, exist_ok=True)
+    segments = list_segments()
+    seq = segments[-1]["segment"] + 1 if segments else 1
+    name = f"audit-{seq:08d}.log"
+    os.replace(live, d / name)
+    try:
+        # offsets in the sidecar index belong to the old file
+        Path(str(live) + ".idx").unlink()
+    except OSError:
+        pass
+    manifest = {
+        "segment": seq,
+        "file": name,
+        "compressed": False,
+        "entries": tracker.entries,
+        "bytes": tracker.bytes,
+        "first_ts": tracker.first_ts,
+        "last_ts": tracker.last_ts,
+        "prev_digest": tracker.prev_digest,
+        "chain_digest": tracker.digest,
+        "redacted": False,
+        "sealed_at": datetime.utcnow().isoformat() + "Z",
+    }
+    return _write_manifest(manifest)
+
+
+def compress_segment(manifest: Dict) -> Dict:
+    """gzip a sealed segment in place (tmp file + rename) and update its manifest."""
+    if manifest.get("compressed"):
+        return manifest
+    d = segment_dir()
+    src = d / manifest["file"]
+    dst = d / (manifest["file"] + ".gz")
+    tmp = dst.with_name(dst.name + ".tmp")
+    with open(src, "rb") as fin, gzip.open(tmp, "wb") as fout:
+        while True:
+            chunk = fin.read(1 << 20)
+            if not chunk:
+                break
+            fout.write(chunk)
+    os.replace(tmp, dst)
+    manifest = _write_manifest(dict(manifest, file=dst.name, compressed=True))
+    src.unlink()
+    return manifest
+
+
+def compress_pending() -> int:
+    """Compress sealed segments left uncompressed (e.g. by a crash)."""
+    n = 0
+    for m in list_segments():
+        if not m.get("compressed") and (segment_dir() / m["file"]).exists():
+            compress_segment(m)
+            n += 1
+    return n
+
+
+def compress_in_background(manifest: Dict) -> None:
+    def _run():
+        try:
+            compress_segment(manifest)
+        except Exception as e:
+            audit._audit_logger.warning({"audit_segment_compress_failed": manifest.get("segment"), "error": str(e)})
+    threading.Thread(target=_run, name="audit-segment-compress", daemon=True).start()
+
+
+def _iter_plain(path: Path) -> Iterator[Tuple[bytes, str]]:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rb") as f:
+        while True:
+            raw = f.readline()
+            sig = f.readline()
+            if not raw or not sig.endswith(b"\n"):
+                return
+            yield raw.rstrip(b"\n"), sig.rstrip(b"\n").decode("utf-8", "replace")
+
+
+def iter_segment(manifest: Dict) -> Iterator[Tuple[bytes, str]]:
+    """(raw, sig) of each entry of a sealed segment."""
+    yield from _iter_plain(segment_dir() / manifest["file"])
+
+
+def verify_segment(manifest: Dict) -> Dict:
+    """Check a sealed segment against its manifest in one pass."""
+    keys = _keys()
+    manifest_ok = any(hmac.compare_digest(_manifest_sig(manifest, k), manifest.get("sig", "")) for k in keys)
+    digests = {k: manifest["prev_digest"] for k in keys}
+    entries, invalid = 0, 0
+    for raw, sig in iter_segment(manifest):
+        entries += 1
+        if not any(hmac.compare_digest(audit._sign_with_key(raw, k), sig) for k in keys):
+            invalid += 1
+        for k in keys:
+            digests[k] = chain_step(digests[k], sig, k)
+    expected = manifest.get("content_digest") if manifest.get("redacted") else manifest["chain_digest"]
+    chain_ok = any(hmac.compare_digest(d, expected or "") for d in digests.values())
+    return {
+        "segment": manifest["segment"],
+        "ok": manifest_ok and chain_ok and invalid == 0 and entries == manifest["entries"],
+        "manifest_ok": manifest_ok,
+        "chain_ok": chain_ok,
+        "entries": entries,
+        "invalid": invalid,
+    }
+
+
+def verify_chain(segments: Optional[List[Dict]] = None) -> List[int]:
+    """Segments whose prev_digest does not continue the previous manifest."""
+    segments = segments if segments is not None else list_segments()
+    return [cur["segment"] for prev, cur in zip(segments, segments[1:])
+            if cur["prev_digest"] != prev["chain_digest"] or cur["segment"] != prev["segment"] + 1]
+
+
+def _redact_value(v):
+    from backend.safety.purge_old_logs import redact_content
+    if isinstance(v, str):
+        return redact_content(v)
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, int) and len(str(abs(v))) >= 6:
+        return redact_content(str(v))
+    if isinstance(v, dict):
+        return {k: _redact_value(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_redact_value(x) for x in v]
+    return v
+
+
+def redact_segment(manifest: Dict) -> Dict:
+    """Rewrite a sealed segment with digit runs in payloads masked.
+
+    Entries are re-signed and `content_digest` is chained over the new
+    signatures; `chain_digest` is kept so the segment chain still links.
+    """
+    key = audit._signing_key()
+    d = segment_dir()
+    src = d / manifest["file"]
+    name = manifest["file"] if manifest["file"].endswith(".gz") else manifest["file"] + ".gz"
+    tmp = d / (name + ".tmp")
+    digest, entries = manifest["prev_digest"], 0
+    with gzip.open(tmp, "wb") as out:
+        for raw, _ in _iter_plain(src):
+            try:
+                entry = json.loads(raw)
+                entry["payload"] = _redact_value(entry.get("payload"))
+                raw = audit._canonical(entry)
+            except ValueError:
+                pass
+            sig = audit._sign_with_key(raw, key)
+            out.write(raw + b"\n" + sig.encode("utf-8") + b"\n")
+            digest = chain_step(digest, sig, key)
+            entries += 1
+    os.replace(tmp, d / name)
+    if name != manifest["file"]:
+        src.unlink()
+    manifest = dict(manifest, file=name, compressed=True, redacted=True, content_digest=digest,
+                    redacted_at=datetime.utcnow().isoformat() + "Z")
+    return _write_manifest(manifest)
+
+
+def delete_segment(manifest: Dict) -> None:
+    d = segment_dir()
+    for p in (d / manifest["file"], d / f"audit-{manifest['segment']:08d}.manifest.json"):
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def apply_retention(delete_after_days: Optional[int] = None, redact_after_days: Optional[int] = None,
+                    now: Optional[datetime] = None, dry_run: bool = False) -> Dict[str, List[int]]:
+    """Delete / redact sealed segments whose newest entry is older than the cutoffs.
+
+    The live segment is never touched. Returns the affected segment numbers.
+    """
+    now = now or datetime.utcnow()
+    delete_cut = (now - timedelta(days=delete_after_days)).isoformat() if delete_after_days is not None else None
+    redact_cut = (now - timedelta(days=redact_after_days)).isoformat() if redact_after_days is not None else None
+    done = {"deleted": [], "redacted": []}
+    for m in list_segments():
+        last = m.get("last_ts") or ""
+        if delete_cut is not None and last < delete_cut:
+            if not dry_run:
+                delete_segment(m)
+            done["deleted"].append(m["segment"])
+        elif redact_cut is not None and last < redact_cut and not m.get("redacted"):
+            if not dry_run:
+                redact_segment(m)
+            done["redacted"].append(m["segment"])
+    return done
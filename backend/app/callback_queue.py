@@ -1,59 +1,292 @@
+"""Durable queue for GUVI callbacks that could not be delivered right away.
+
+Items live in a SQLite database in WAL mode (`CALLBACK_QUEUE_DB`), separate
+from the application database so the queue keeps working when the main DB
+is Postgres or unavailable. Each item carries its attempt count and the time
+of its next attempt. The worker:
+
+- dequeues due items in batches under a short lease (an item whose worker
+  died becomes due again when the lease lapses);
+- deletes delivered items;
+- reschedules failed ones with exponential backoff
+  (`CALLBACK_BACKOFF_BASE` doubling up to `CALLBACK_BACKOFF_MAX`);
+- moves an item to the `dead` state after `CALLBACK_MAX_ATTEMPTS`.
+
+Dead items stay in the table for inspection and can be revived with
+`requeue_dead()`. `import_legacy_files()` moves payloads from the old
+file-per-payload directory (`CALLBACK_QUEUE_DIR`) into the queue.
+"""
 import os
 import json
 import time
+import random
+import sqlite3
 import threading
-import requests
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from .audit import append_event
 
 QUEUE_DIR = Path(os.getenv("CALLBACK_QUEUE_DIR", "data/callback_queue"))
-QUEUE_DIR.mkdir(parents=True, exist_ok=True)
-RETRY_INTERVAL = int(os.getenv("CALLBACK_RETRY_INTERVAL", "30"))  # seconds
+QUEUE_DB = Path(os.getenv("CALLBACK_QUEUE_DB", "data/callback_queue.db"))
+RETRY_INTERVAL = int(os.getenv("CALLBACK_RETRY_INTERVAL", "30"))  # seconds, max idle poll
+BATCH_SIZE = int(os.getenv("CALLBACK_BATCH_SIZE", "50"))
+MAX_ATTEMPTS = int(os.getenv("CALLBACK_MAX_ATTEMPTS", "10"))
+BACKOFF_BASE = float(os.getenv("CALLBACK_BACKOFF_BASE", "30"))
+BACKOFF_MAX = float(os.getenv("CALLBACK_BACKOFF_MAX", "3600"))
+LEASE_SECONDS = int(os.getenv("CALLBACK_LEASE_SECONDS", "120"))
 
+GUVI_URL = "https://hackathon.guvi.in/api/updateHoneyPotFinalResult"  # also used by guvi_callback
 
-def _queue_file_name():
-    return str(int(time.time() * 1000)) + ".json"
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS callback_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_callback_queue_due ON callback_queue (status, next_attempt_at);
+"""
 
 
-def enqueue(payload: dict):
-    # write payload to a file for persistent retry
-    fname = QUEUE_DIR / _queue_file_name()
-    with open(fname, "w", encoding="utf-8") as f:
-        json.dump(payload, f)
-    append_event("callback_enqueued", {"file": str(fname), "sessionId": payload.get("sessionId")})
-    return str(fname)
+class QueueItem:
+    __slots__ = ('id', 'session_id', 'payload', 'attempts')
 
+    def __init__(self, id: int, session_id: Optional[str], payload: dict, attempts: int):
+        self.id = id
+        self.session_id = session_id
+        self.payload = payload
+        self.attempts = attempts
 
-def _process_file(path: Path):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            payload = json.load(f)
-        guvi_url = "https://hackathon.guvi.in/api/updateHoneyPotFinalResult"
-        guvi_key = os.getenv("GUVI_API_KEY", "")
-        headers = {"Content-Type": "application/json", "x-api-key": guvi_key}
-        resp = requests.post(guvi_url, json=payload, headers=headers, timeout=5)
-        resp.raise_for_status()
-        append_event("callback_sent_from_queue", {"file": str(path), "status": resp.status_code})
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay after the `attempts`-th failed delivery (exponential, half jittered)."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+class CallbackQueue:
+    """SQLite-backed queue; one connection shared behind a lock."""
+
+    def __init__(self, path: Path = QUEUE_DB, synchronous: Optional[str] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous or os.getenv('CALLBACK_QUEUE_SYNCHRONOUS', 'FULL')}")
+        self._conn.executescript(_SCHEMA)
+        self._wake = threading.Event()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _tx(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                res = fn(self._conn)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return res
+
+    def enqueue(self, payload: dict, delay: float = 0.0) -> int:
+        return self.enqueue_many([payload], delay)[0]
+
+    def enqueue_many(self, payloads: List[dict], delay: float = 0.0) -> List[int]:
+        now = time.time()
+
+        def _insert(conn):
+            ids = []
+            for p in payloads:
+                cur = conn.execute(
+                    "INSERT INTO callback_queue (session_id, payload, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (p.get('sessionId'), json.dumps(p), now + delay, now, now))
+                ids.append(cur.lastrowid)
+            return ids
+
+        ids = self._tx(_insert)
+        self._wake.set()
+        return ids
+
+    def dequeue(self, limit: int = BATCH_SIZE, now: Optional[float] = None) -> List[QueueItem]:
+        """Lease up to `limit` due items (pending, or in flight with a lapsed lease)."""
+        now = now if now is not None else time.time()
+
+        def _claim(conn):
+            rows = conn.execute(
+                "SELECT id, session_id, payload, attempts FROM callback_queue"
+                " WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'inflight' AND lease_until < ?)"
+                " ORDER BY next_attempt_at, id LIMIT ?", (now, now, limit)).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE callback_queue SET status = 'inflight', attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+                    [(now + LEASE_SECONDS, now, r[0]) for r in rows])
+            return rows
+
+        items = []
+        for id_, session_id, payload, attempts in self._tx(_claim):
+            try:
+                data = json.loads(payload)
+            except Exception:
+                data = {}
+            items.append(QueueItem(id_, session_id, data, attempts + 1))
+        return items
+
+    def ack(self, ids: List[int]) -> None:
+        """Delivered: drop the items."""
+        if ids:
+            self._tx(lambda conn: conn.executemany("DELETE FROM callback_queue WHERE id = ?", [(i,) for i in ids]))
+
+    def nack(self, failures: List[Tuple[QueueItem, str]], now: Optional[float] = None) -> List[int]:
+        """Reschedule failed items with backoff; returns ids moved to `dead`."""
+        if not failures:
+            return []
+        now = now if now is not None else time.time()
+        retry, dead = [], []
+        for item, error in failures:
+            if item.attempts >= MAX_ATTEMPTS:
+                dead.append((error, now, item.id))
+            else:
+                retry.append((now + backoff_seconds(item.attempts), error, now, item.id))
+
+        def _update(conn):
+            if retry:
+                conn.executemany("UPDATE callback_queue SET status = 'pending', lease_until = NULL, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?", retry)
+            if dead:
+                conn.executemany("UPDATE callback_queue SET status = 'dead', lease_until = NULL, last_error = ?, updated_at = ? WHERE id = ?", dead)
+
+        self._tx(_update)
+        return [d[2] for d in dead]
+
+    def requeue_dead(self, ids: Optional[List[int]] = None) -> int:
+        """Give dead-lettered items (all, or `ids`) a fresh set of attempts."""
+        now = time.time()
+        sql = "UPDATE callback_queue SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = 'dead'"
+        if ids is None:
+            n = self._tx(lambda conn: conn.execute(sql, (now, now)).rowcount)
+        else:
+            n = self._tx(lambda conn: sum(conn.execute(sql + " AND id = ?", (now, now, i)).rowcount for i in ids))
+        if n:
+            self._wake.set()
+        return n
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(CASE WHEN status = 'pending' THEN next_attempt_at ELSE lease_until END)"
+                " FROM callback_queue WHERE status IN ('pending', 'inflight')").fetchone()
+        return row[0] if row else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM callback_queue GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def wait(self, timeout: float) -> None:
+        """Sleep until an enqueue or `timeout`, whichever comes first."""
+        self._wake.wait(max(0.0, timeout))
+        self._wake.clear()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> CallbackQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = CallbackQueue()
+    return _queue
+
+
+def enqueue(payload: dict) -> int:
+    """Persist a payload for retried delivery; returns its queue id."""
+    item_id = get_queue().enqueue(payload)
+    append_event("callback_enqueued", {"id": item_id, "sessionId": payload.get("sessionId")})
+    return item_id
+
+
+def import_legacy_files(queue_dir: Path = QUEUE_DIR, queue: Optional[CallbackQueue] = None) -> int:
+    """One-shot import of `*.json` payload files from the old file queue.
+
+    Each file is enqueued and then deleted; unreadable files are renamed to
+    `*.json.bad` so they are not retried. Returns the number imported.
+    """
+    queue = queue or get_queue()
+    queue_dir = Path(queue_dir)
+    if not queue_dir.is_dir():
+        return 0
+    imported = 0
+    for path in sorted(queue_dir.glob("*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except Exception as e:
+            append_event("callback_import_error", {"file": str(path), "error": str(e)})
+            try:
+                path.rename(path.with_name(path.name + ".bad"))
+            except OSError:
+                pass
+            continue
+        queue.enqueue(payload)
         path.unlink()
-        return True
-    except Exception as e:
-        append_event("callback_queue_error", {"file": str(path), "error": str(e)})
-        return False
+        imported += 1
+    if imported:
+        append_event("callback_queue_imported", {"dir": str(queue_dir), "count": imported})
+    return imported
 
 
-def process_queue_once():
-    files = sorted(QUEUE_DIR.glob("*.json"))
-    for f in files:
-        _process_file(f)
+def process_queue_once(limit: int = BATCH_SIZE) -> int:
+    """Deliver one batch of due items; returns how many were attempted.
+
+    The batch is sent concurrently over the GUVI sender's pooled client,
+    one attempt per item; backoff between attempts is the queue's.
+    """
+    from .guvi_callback import get_sender
+
+    queue = get_queue()
+    items = queue.dequeue(limit)
+    if not items:
+        return 0
+    try:
+        errors = get_sender().post_many([item.payload for item in items], timeout=LEASE_SECONDS)
+    except Exception as e:
+        errors = [str(e) or type(e).__name__] * len(items)
+    delivered, failures = [], []
+    for item, error in zip(items, errors):
+        if error is None:
+            delivered.append(item.id)
+            append_event("callback_sent_from_queue", {"id": item.id, "sessionId": item.session_id, "attempts": item.attempts})
+        else:
+            failures.append((item, error))
+            append_event("callback_queue_error", {"id": item.id, "sessionId": item.session_id, "attempts": item.attempts, "error": error})
+    queue.ack(delivered)
+    for item_id in queue.nack(failures):
+        append_event("callback_dead_lettered", {"id": item_id})
+    return len(items)
 
 
 def _worker_loop():
+    queue = get_queue()
     while True:
         try:
-            process_queue_once()
+            if process_queue_once() >= BATCH_SIZE:
+                continue
         except Exception as e:
             append_event("callback_queue_worker_error", {"error": str(e)})
-        time.sleep(RETRY_INTERVAL)
+        due = queue.next_due()
+        queue.wait(RETRY_INTERVAL if due is None else min(RETRY_INTERVAL, due - time.time()))
 
 
 _worker_thread = None
@@ -63,7 +296,10 @@ def start_worker():
     global _worker_thread
     if _worker_thread and _worker_thread.is_alive():
         return
+    try:
+        import_legacy_files()
+    except Exception as e:
+        append_event("callback_import_error", {"dir": str(QUEUE_DIR), "error": str(e)})
     _worker_thread = threading.Thread(target=_worker_loop, daemon=True)
     _worker_thread.start()
-    append_event("callback_worker_started", {"interval": RETRY_INTERVAL})
-
+    append_event("callback_worker_started", {"interval": RETRY_INTERVAL, "db": str(QUEUE_DB)})
@@ -0,0 +1,219 @@
+"""Per-session conversation state: turn counter, append-only turn log, slots.
+
+An agent turn used to decode `messages_json` / `slots_json`, append, and
+re-encode both blobs. That is read-modify-write on growing text, and two
+concurrent turns of one session could lose each other's update. A turn is now:
+
+- one compare-and-set UPDATE of `conversation_state` on its `version`
+  (bumps `turn_count`, sets `last_agent_reply`);
+- one INSERT into `conversation_turns` keyed by (session_id, turn_no);
+- one upsert per *changed* slot in `conversation_slots`.
+
+If the UPDATE matches no row, another writer got there first: the state is
+reloaded and the turn retried (up to `MAX_RETRIES`).
+
+Hot sessions are kept in an in-process LRU (`CONVERSATION_CACHE_SIZE`
+entries) so a turn does not reload state and slots first. The cache is only
+a guess: the version check validates it on every write. Entries touched by a
+transaction that rolls back are dropped.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, func, insert, update
+from sqlalchemy.orm import Session as OrmSession
+
+from .db import ConversationState, ConversationTurn, ConversationSlot
+
+MAX_RETRIES = 3
+CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', '1024'))
+
+_TOUCHED_KEY = 'conversation_state_touched'
+
+
+class ConcurrentTurnError(RuntimeError):
+    """Raised when a turn keeps losing the version race."""
+
+
+class TurnState:
+    __slots__ = ('session_id', 'version', 'turn_count', 'slots')
+
+    def __init__(self, session_id: str, version: int, turn_count: int, slots: Dict):
+        self.session_id = session_id
+        self.version = version
+        self.turn_count = turn_count
+        self.slots = slots
+
+
+def _upsert_slot_stmt(db):
+    dialect = db.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    stmt = dialect_insert(ConversationSlot.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=['session_id', 'name'],
+        set_={'value': stmt.excluded.value, 'turn_no': stmt.excluded.turn_no},
+    )
+
+
+def _insert_state_stmt(db):
+    """INSERT into conversation_state that skips an existing session, if supported."""
+    dialect = db.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(ConversationState.__table__)
+    return dialect_insert(ConversationState.__table__).on_conflict_do_nothing(index_elements=['session_id'])
+
+
+class ConversationStore:
+    def __init__(self, max_sessions: int = CACHE_SIZE):
+        self.max_sessions = max(0, max_sessions)
+        self._cache: 'OrderedDict[str, TurnState]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -- cache -------------------------------------------------------------
+
+    def _cached(self, session_id: str) -> Optional[TurnState]:
+        with self._lock:
+            state = self._cache.get(session_id)
+            if state is not None:
+                self._cache.move_to_end(session_id)
+            return state
+
+    def _put(self, state: TurnState) -> None:
+        if not self.max_sessions:
+            return
+        with self._lock:
+            self._cache[state.session_id] = state
+            self._cache.move_to_end(state.session_id)
+            while len(self._cache) > self.max_sessions:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, session_id: str) -> None:
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    # -- db ----------------------------------------------------------------
+
+    def _load(self, db, session_id: str) -> Optional[TurnState]:
+        row = db.query(ConversationState.version, ConversationState.turn_count).filter(ConversationState.session_id == session_id).first()
+        if row is None:
+            return None
+        slots = {}
+        for name, value in db.query(ConversationSlot.name, ConversationSlot.value).filter(ConversationSlot.session_id == session_id):
+            try:
+                slots[name] = json.loads(value) if value is not None else None
+            except Exception:
+                slots[name] = value
+        return TurnState(session_id, row.version or 0, row.turn_count or 0, slots)
+
+    def get(self, db, session_id: str) -> Optional[TurnState]:
+        """Current state of the session (cached or loaded), or None if it has none."""
+        state = self._cached(session_id)
+        if state is None:
+            state = self._load(db, session_id)
+            if state is not None:
+                self._put(state)
+        return state
+
+    def append_turn(self, db, session_id: str, sender: str, text: str, ts, slots: Optional[Dict] = None) -> TurnState:
+        """Record one turn in the caller's transaction and return the new state."""
+        slots = slots or {}
+        for _ in range(MAX_RETRIES):
+            state = self.get(db, session_id)
+            if state is None:
+                # first turn; if a concurrent first turn created the row, go
+                # through the versioned UPDATE like any other lost race
+                res = db.execute(_insert_state_stmt(db).values(
+                    session_id=session_id, turn_count=1, last_agent_reply=text, version=1, human_override=False))
+                if res.rowcount != 1:
+                    self.invalidate(session_id)
+                    continue
+                new = TurnState(session_id, 1, 1, {})
+            else:
+                res = db.execute(
+                    update(ConversationState.__table__)
+                    .where(ConversationState.session_id == session_id, func.coalesce(ConversationState.version, 0) == state.version)
+                    .values(turn_count=func.coalesce(ConversationState.turn_count, 0) + 1,
+                            last_agent_reply=text,
+                            version=func.coalesce(ConversationState.version, 0) + 1)
+                )
+                if res.rowcount != 1:
+                    # lost the race (or the cache was stale): reload and retry
+                    self.invalidate(session_id)
+                    continue
+                new = TurnState(session_id, state.version + 1, state.turn_count + 1, dict(state.slots))
+            break
+        else:
+            raise ConcurrentTurnError(f'could not record turn for session {session_id}')
+
+        db.execute(insert(ConversationTurn.__table__).values(session_id=session_id, turn_no=new.turn_count, sender=sender, text=text, ts=ts))
+        changed = [{'session_id': session_id, 'name': k, 'value': json.dumps(v), 'turn_no': new.turn_count}
+                   for k, v in slots.items() if k not in new.slots or new.slots[k] != v]
+        if changed:
+            self._write_slots(db, changed)
+            new.slots.update(slots)
+
+        db.info.setdefault(_TOUCHED_KEY, set()).add(session_id)
+        self._put(new)
+        return new
+
+    def _write_slots(self, db, rows: List[Dict]) -> None:
+        stmt = _upsert_slot_stmt(db)
+        if stmt is not None:
+            db.execute(stmt, rows)
+            return
+        t = ConversationSlot.__table__
+        for r in rows:
+            res = db.execute(update(t).where(t.c.session_id == r['session_id'], t.c.name == r['name']).values(value=r['value'], turn_no=r['turn_no']))
+            if res.rowcount == 0:
+                db.execute(insert(t).values(**r))
+
+    def recent_turns(self, db, session_id: str, limit: int = 10) -> List[ConversationTurn]:
+        """Last `limit` turns, oldest first."""
+        rows = (db.query(ConversationTurn).filter(ConversationTurn.session_id == session_id)
+                .order_by(ConversationTurn.turn_no.desc()).limit(limit).all())
+        return list(reversed(rows))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ConversationStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore()
+    return _store
+
+
+@event.listens_for(OrmSession, 'after_soft_rollback')
+def _drop_rolled_back(session, previous_transaction):
+    touched = session.info.pop(_TOUCHED_KEY, None)
+    if touched and _store is not None:
+        for session_id in touched:
+            _store.invalidate(session_id)
+
+
+@event.listens_for(OrmSession, 'after_transaction_end')
+def _forget_ended(session, transaction):
+    # only the outermost transaction decides; a released SAVEPOINT can still
+    # be rolled back with its parent (after_soft_rollback handles that)
+    if transaction.parent is None:
+        session.info.pop(_TOUCHED_KEY, None)
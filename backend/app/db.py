@@ -1,7 +1,9 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean, Index, insert, select, update, bindparam, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import hashlib
+import threading
 from datetime import datetime
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///data/sentinel.db")
@@ -17,6 +19,85 @@ else:
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+
+def _async_database_url(url: str):
+    """Map a sync DATABASE_URL to its async driver (aiosqlite / asyncpg)."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return None
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(DATABASE_URL)
+
+# Optional async engine. When the async driver (aiosqlite/asyncpg) is not
+# installed these stay None and async routes fall back to the sync engine
+# in the threadpool.
+async_engine = None
+AsyncSessionLocal = None
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from sqlalchemy.pool import NullPool
+
+    if ASYNC_DATABASE_URL:
+        if ASYNC_DATABASE_URL.startswith("sqlite"):
+            # SQLite connections are cheap to open and must not be shared
+            # across event loops (e.g. TestClient portals), so don't pool them
+            async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+        else:
+            async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+        AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+except Exception:
+    async_engine = None
+    AsyncSessionLocal = None
+
+# Pool checkout accounting: how many connections each engine has handed out
+# right now and in total. Exported as Prometheus metrics and via pool_stats().
+_pool_lock = threading.Lock()
+_pool_counts = {}
+
+
+def _track_pool(eng, label: str) -> None:
+    try:
+        from backend.phase4.metrics import DB_POOL_CHECKED_OUT, DB_POOL_CHECKOUTS
+    except Exception:
+        DB_POOL_CHECKED_OUT = DB_POOL_CHECKOUTS = None
+    _pool_counts[label] = {'checked_out': 0, 'checkouts': 0}
+
+    @event.listens_for(eng, 'checkout')
+    def _on_checkout(dbapi_conn, record, proxy):
+        with _pool_lock:
+            _pool_counts[label]['checked_out'] += 1
+            _pool_counts[label]['checkouts'] += 1
+        try:
+            DB_POOL_CHECKED_OUT.labels(engine=label).inc()
+            DB_POOL_CHECKOUTS.labels(engine=label).inc()
+        except Exception:
+            pass
+
+    @event.listens_for(eng, 'checkin')
+    def _on_checkin(dbapi_conn, record):
+        with _pool_lock:
+            _pool_counts[label]['checked_out'] -= 1
+        try:
+            DB_POOL_CHECKED_OUT.labels(engine=label).dec()
+        except Exception:
+            pass
+
+
+def pool_stats() -> dict:
+    """{engine label: {'checked_out': n, 'checkouts': total}}"""
+    with _pool_lock:
+        return {k: dict(v) for k, v in _pool_counts.items()}
+
+
+_track_pool(engine, 'sync')
+if async_engine is not None:
+    _track_pool(async_engine.sync_engine, 'async')
+
+
 class Session(Base):
     __tablename__ = "sessions"
     id = Column(String, primary_key=True, index=True)
@@ -29,9 +110,34 @@ class ConversationState(Base):
     session_id = Column(String, primary_key=True, index=True)
     turn_count = Column(Integer, default=0)
     last_agent_reply = Column(Text, nullable=True)
-    messages_json = Column(Text, nullable=True)  # JSON array of last N messages
-    slots_json = Column(Text, nullable=True)     # JSON object for extracted slots
+    # legacy JSON blobs, superseded by conversation_turns / conversation_slots
+    # and no longer written (see conversation_state.py)
+    messages_json = Column(Text, nullable=True)
+    slots_json = Column(Text, nullable=True)
     human_override = Column(Boolean, default=False)
+    # bumped on every turn; turn updates are compare-and-set on it
+    version = Column(Integer, default=0)
+
+class ConversationTurn(Base):
+    """Append-only log of agent turns; turn_no matches ConversationState.turn_count."""
+    __tablename__ = 'conversation_turns'
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, nullable=False)
+    turn_no = Column(Integer, nullable=False)
+    sender = Column(String)
+    text = Column(Text)
+    ts = Column(DateTime)
+
+    __table_args__ = (
+        Index('ux_conversation_turns_session_turn', 'session_id', 'turn_no', unique=True),
+    )
+
+class ConversationSlot(Base):
+    __tablename__ = 'conversation_slots'
+    session_id = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)
+    value = Column(Text)  # JSON-encoded slot value
+    turn_no = Column(Integer)  # turn that last set it
 
 class Message(Base):
     __tablename__ = "messages"
@@ -41,14 +147,43 @@ class Message(Base):
     text = Column(Text)
     timestamp = Column(DateTime)
     raw = Column(Text)
+    # sha256 of (sender, text, timestamp) for client-supplied messages; NULL for
+    # agent rows and for repeats of an already-stored message
+    content_hash = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index('ux_messages_session_hash', 'session_id', 'content_hash', unique=True),
+    )
+
+class SessionSummary(Base):
+    """Per-session aggregates maintained on ingest (see session_summary.py)."""
+    __tablename__ = 'session_summary'
+    session_id = Column(String, primary_key=True, index=True)
+    message_count = Column(Integer, default=0)
+    first_ts = Column(DateTime, nullable=True)
+    last_ts = Column(DateTime, nullable=True)
+    extractions_json = Column(Text, nullable=True)  # JSON object {type: [distinct values]}
+    scam_detected = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 class Extraction(Base):
+    """One row per distinct (session, type, canonical value); see extractions.py."""
     __tablename__ = "extractions"
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String, index=True)
     type = Column(String)
-    value = Column(String)
+    value = Column(String)  # first spelling seen
     confidence = Column(Float)
+    canonical_value = Column(String, nullable=True)
+    count = Column(Integer, default=1)
+    first_seen = Column(DateTime, nullable=True)
+    last_seen = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ux_extractions_session_type_value', 'session_id', 'type', 'canonical_value', unique=True),
+        # value -> sessions (cross-session lookups, see intel_index.py)
+        Index('ix_extractions_value_session', 'canonical_value', 'type', 'session_id'),
+    )
 
 
 class OutgoingMessage(Base):
@@ -58,6 +193,15 @@ class OutgoingMessage(Base):
     content = Column(Text)
     status = Column(String, default='queued')
     created_at = Column(DateTime, default=datetime.utcnow)
+    # delivery lease / retry schedule (see outgoing_worker.claim_batch)
+    claimed_by = Column(String, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_outgoing_status_next_attempt', 'status', 'next_attempt_at'),
+    )
 
 def init_db():
     from pathlib import Path
@@ -75,32 +219,203 @@ def init_db():
     if DATABASE_URL.startswith("sqlite"):
         try:
             with engine.begin() as conn:
-                try:
-                    res = conn.execute("PRAGMA table_info('conversation_state')")
-                    cols = [r[1] for r in res.fetchall()]
-                except Exception:
-                    cols = []
-
-                if cols:
-                    if 'messages_json' not in cols:
-                        try:
-                            conn.execute("ALTER TABLE conversation_state ADD COLUMN messages_json TEXT")
-                        except Exception:
-                            pass
-                    if 'slots_json' not in cols:
-                        try:
-                            conn.execute("ALTER TABLE conversation_state ADD COLUMN slots_json TEXT")
-                        except Exception:
-                            pass
-                    if 'human_override' not in cols:
-                        try:
-                            conn.execute("ALTER TABLE conversation_state ADD COLUMN human_override BOOLEAN DEFAULT 0")
-                        except Exception:
-                            pass
+                _sqlite_add_columns(conn, 'conversation_state', {
+                    'messages_json': 'TEXT',
+                    'slots_json': 'TEXT',
+                    'human_override': 'BOOLEAN DEFAULT 0',
+                })
+                if 'version' in _sqlite_add_columns(conn, 'conversation_state', {'version': 'INTEGER DEFAULT 0'}):
+                    backfill_conversation_turns(conn)
+                if 'content_hash' in _sqlite_add_columns(conn, 'messages', {'content_hash': 'VARCHAR(64)'}):
+                    backfill_message_hashes(conn)
+                conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_session_hash ON messages (session_id, content_hash)")
+                if 'next_attempt_at' in _sqlite_add_columns(conn, 'outgoing_messages', {
+                    'claimed_by': 'VARCHAR',
+                    'lease_until': 'DATETIME',
+                    'attempts': 'INTEGER DEFAULT 0',
+                    'next_attempt_at': 'DATETIME',
+                }):
+                    conn.exec_driver_sql("UPDATE outgoing_messages SET next_attempt_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE next_attempt_at IS NULL")
+                    conn.exec_driver_sql("UPDATE outgoing_messages SET lease_until = CURRENT_TIMESTAMP WHERE status = 'sending'")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_outgoing_status_next_attempt ON outgoing_messages (status, next_attempt_at)")
+                if 'canonical_value' in _sqlite_add_columns(conn, 'extractions', {
+                    'canonical_value': 'VARCHAR',
+                    'count': 'INTEGER DEFAULT 1',
+                    'first_seen': 'DATETIME',
+                    'last_seen': 'DATETIME',
+                }):
+                    backfill_extraction_values(conn)
+                conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ux_extractions_session_type_value ON extractions (session_id, type, canonical_value)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_extractions_value_session ON extractions (canonical_value, type, session_id)")
         except Exception:
             # Silently ignore migration failures (best-effort for local/dev)
             pass
 
+
+def _sqlite_add_columns(conn, table: str, columns: dict) -> list:
+    """Add any of `columns` ({name: ddl}) missing from `table`; returns the added names."""
+    try:
+        cols = [r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info('{table}')").fetchall()]
+    except Exception:
+        cols = []
+    added = []
+    if not cols:
+        return added
+    for name, ddl in columns.items():
+        if name not in cols:
+            try:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+                added.append(name)
+            except Exception:
+                pass
+    return added
+
+
+def message_content_hash(sender, text, timestamp) -> str:
+    """Dedup key for a message. Timestamps are compared as stored (wall time,
+    tzinfo dropped), matching how both SQLite and Postgres persist them."""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None)
+    key = '\x1f'.join([sender or '', text or '', timestamp.isoformat() if timestamp else ''])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def backfill_message_hashes(conn) -> int:
+    """Hash existing non-agent messages; later exact repeats keep NULL."""
+    rows = conn.execute(
+        select(Message.id, Message.session_id, Message.sender, Message.text, Message.timestamp)
+        .where(Message.content_hash.is_(None)).order_by(Message.id)
+    ).fetchall()
+    seen = set()
+    updates = []
+    for r in rows:
+        if r.sender == 'agent':
+            continue
+        h = message_content_hash(r.sender, r.text, r.timestamp)
+        if (r.session_id, h) in seen:
+            continue
+        seen.add((r.session_id, h))
+        updates.append({'_id': r.id, '_hash': h})
+    if updates:
+        conn.execute(update(Message.__table__).where(Message.__table__.c.id == bindparam('_id')).values(content_hash=bindparam('_hash')), updates)
+    return len(updates)
+
+
+def backfill_extraction_values(conn) -> int:
+    """Canonicalize legacy extraction rows and fold repeats into the first
+    row of each (session, type, canonical value); returns rows removed."""
+    from .extractions import canonical
+    t = Extraction.__table__
+    rows = conn.execute(
+        select(t.c.id, t.c.session_id, t.c.type, t.c.value).where(t.c.canonical_value.is_(None)).order_by(t.c.id)
+    ).fetchall()
+    keep = {}
+    counts = {}
+    dupes = []
+    for r in rows:
+        key = (r.session_id, r.type, canonical(r.type, r.value))
+        if key in keep:
+            counts[key] += 1
+            dupes.append(r.id)
+        else:
+            keep[key] = r.id
+            counts[key] = 1
+    if keep:
+        conn.execute(
+            update(t).where(t.c.id == bindparam('_id')).values(canonical_value=bindparam('_cv'), count=bindparam('_n')),
+            [{'_id': i, '_cv': key[2], '_n': counts[key]} for key, i in keep.items()],
+        )
+    for i in range(0, len(dupes), 500):
+        conn.execute(t.delete().where(t.c.id.in_(dupes[i:i + 500])))
+    return len(dupes)
+
+
+def backfill_conversation_turns(conn) -> int:
+    """Copy legacy messages_json / slots_json blobs into the turn log and
+    slot table. messages_json held the last 10 agent turns, so they are
+    numbered back from turn_count. Returns the number of states copied."""
+    import json
+    cs = ConversationState.__table__
+    rows = conn.execute(
+        select(cs.c.session_id, cs.c.turn_count, cs.c.messages_json, cs.c.slots_json)
+        .where((cs.c.messages_json.isnot(None)) | (cs.c.slots_json.isnot(None)))
+    ).fetchall()
+    turns, slots = [], []
+    for r in rows:
+        try:
+            msgs = json.loads(r.messages_json) if r.messages_json else []
+            state_slots = json.loads(r.slots_json) if r.slots_json else {}
+        except Exception:
+            continue
+        last = max(r.turn_count or 0, len(msgs))
+        for i, m in enumerate(msgs):
+            try:
+                ts = datetime.fromisoformat(m['ts']) if m.get('ts') else None
+            except Exception:
+                ts = None
+            turns.append({'session_id': r.session_id, 'turn_no': last - len(msgs) + 1 + i, 'sender': m.get('sender'), 'text': m.get('text'), 'ts': ts})
+        for name, value in (state_slots or {}).items():
+            slots.append({'session_id': r.session_id, 'name': name, 'value': json.dumps(value), 'turn_no': last})
+    if turns:
+        conn.execute(insert(ConversationTurn.__table__), turns)
+    if slots:
+        conn.execute(insert(ConversationSlot.__table__), slots)
+    return len(rows)
+
+
+def _insert_ignore_stmt(db):
+    """INSERT ... ON CONFLICT (session_id, content_hash) DO NOTHING, if supported."""
+    dialect = db.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(Message.__table__).on_conflict_do_nothing(index_elements=['session_id', 'content_hash'])
+
+
+def insert_messages_ignore_duplicates(db, rows: list) -> list:
+    """Bulk insert message rows (dicts with content_hash) in one statement,
+    skipping any whose (session_id, content_hash) is already stored. The
+    unique index makes this safe against concurrent merges of one history.
+    Returns the rows that were inserted."""
+    if not rows:
+        return []
+    stmt = _insert_ignore_stmt(db)
+    if stmt is not None and getattr(db.get_bind().dialect, 'insert_executemany_returning', False):
+        inserted = {tuple(r) for r in db.execute(stmt.returning(Message.session_id, Message.content_hash), rows)}
+        return [r for r in rows if (r['session_id'], r['content_hash']) in inserted]
+    hashes = [r['content_hash'] for r in rows]
+    existing = set(db.execute(
+        select(Message.session_id, Message.content_hash).where(Message.content_hash.in_(hashes))
+    ).fetchall())
+    rows = [r for r in rows if (r['session_id'], r['content_hash']) not in existing]
+    if rows:
+        db.execute(stmt if stmt is not None else insert(Message.__table__), rows)
+    return rows
+
+
+def insert_incoming_message(db, row: dict):
+    """Insert an incoming message, always storing it.
+
+    The row claims its content_hash when free; a repeat of an already-stored
+    message is stored with a NULL hash so it never conflicts. Returns the new id.
+    """
+    stmt = _insert_ignore_stmt(db)
+    if stmt is not None:
+        res = db.execute(stmt.values(**row))
+        if res.rowcount == 1:
+            return res.inserted_primary_key[0]
+    else:
+        dup = db.execute(
+            select(Message.id).where(Message.session_id == row['session_id'], Message.content_hash == row['content_hash'])
+        ).first()
+        if dup is None:
+            return db.execute(insert(Message.__table__).values(**row)).inserted_primary_key[0]
+    return db.execute(insert(Message.__table__).values(**dict(row, content_hash=None))).inserted_primary_key[0]
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -109,6 +424,15 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Yield an AsyncSession, or None when no async driver is available."""
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 # Ensure DB and schema up-to-date on import
 try:
     init_db()
@@ -1,7 +1,9 @@
 import re
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterable
 import os
 
+from .detector_engine import DetectorEngine
+
 KEYWORDS = [
     "verify", "account", "blocked", "upi", "transfer", "pay", "urgent",
     "immediately", "password", "otp", "pin", "bank", "paytm"
@@ -11,7 +13,43 @@ PHONE_RE = re.compile(r"(\+?\d{1,3}[\s-]?)?((?:\d[\s-]?){6,15}\d)")
 UPI_RE = re.compile(r"\b[A-Za-z0-9.\-_]{3,}@[a-zA-Z]+\b")
 URL_RE = re.compile(r"https?://[^\s]+|www\.[^\s]+")
 
+# (phrases, score weight, reason) — a rule fires if any phrase is present
+PHRASE_RULES = [
+    # presence of phrases indicating UPI request even if no id provided
+    (("upi id", "share your upi", "share upi"), 0.4, "upi_phrase_detected"),
+    # payment request phrase
+    (("send payment", "send money", "share your upi"), 0.2, "payment_phrase_detected"),
+]
+
+_ENGINE = DetectorEngine(KEYWORDS, PHRASE_RULES, PHONE_RE, UPI_RE, URL_RE)
+
+
 def detect(text: str) -> Dict[str, Any]:
+    return _ENGINE.detect(text)
+
+
+def detect_many(texts: Iterable[str]) -> List[Dict[str, Any]]:
+    """Run the detector over a batch of texts, returning results in input order.
+
+    Identical texts in one batch (gateways often re-send the same message)
+    are scanned once; each position still gets its own result dict.
+    """
+    seen: Dict[str, Dict[str, Any]] = {}
+    out: List[Dict[str, Any]] = []
+    for text in texts:
+        res = seen.get(text)
+        if res is None:
+            res = seen[text] = _ENGINE.detect(text)
+            out.append(res)
+        else:
+            out.append({"score": res["score"], "reasons": list(res["reasons"]),
+                        "matches": {k: list(v) for k, v in res["matches"].items()}})
+    return out
+
+
+def _detect_reference(text: str) -> Dict[str, Any]:
+    """Original multi-pass implementation, kept as the oracle for tests and
+    `dev-scripts/bench_detector.py`."""
     text_lower = text.lower()
     score = 0.0
     reasons: List[str] = []
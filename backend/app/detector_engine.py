@@ -0,0 +1,105 @@
+"""Precompiled detector engine backing `backend.app.detector.detect`.
+
+The engine is built once at import time from the detector's keyword list,
+phrase rules and entity patterns, and produces exactly the same result dict
+as the original multi-pass implementation:
+
+- the text is lowercased once; keywords and then phrase rules are two
+  separate substring (`in`) checks against that one copy;
+- entity patterns (phone, UPI, URL) keep their `findall` semantics,
+  including overlaps across types (the digits of `9876543210@ybl` are both a
+  phone and part of a UPI id), but each scan is anchored: phone matches are
+  gated on their first character and the UPI/URL scans start at the first
+  `@` / `http` / `www.` offset instead of position 0.
+"""
+import re
+from typing import Dict, Any, List, Pattern, Sequence, Tuple
+
+# characters allowed in the local part of a UPI id (mirrors UPI_RE)
+_UPI_LOCAL_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.-_")
+_PHONE_STRIP_RE = re.compile(r"[^0-9+]")
+
+
+class DetectorEngine:
+    """Compiled form of the detector rules.
+
+    `phrase_rules` is a sequence of `(phrases, weight, reason)`; a rule fires
+    when any of its phrases occurs in the lowercased text.
+    """
+
+    def __init__(self, keywords: Sequence[str], phrase_rules: Sequence[Tuple[Sequence[str], float, str]],
+                 phone_re: Pattern, upi_re: Pattern, url_re: Pattern):
+        self.keywords = tuple(keywords)
+        self.phrase_rules = tuple((tuple(p), w, r) for p, w, r in phrase_rules)
+        # every phone match starts with '+' or a digit; the leading lookahead
+        # lets the regex engine skip all other offsets cheaply
+        self._phone_re = re.compile(r"(?=[+\d])" + phone_re.pattern, phone_re.flags)
+        self._upi_re = upi_re
+        self._url_re = url_re
+
+    def _phones(self, text: str) -> List[str]:
+        out = []
+        for m in self._phone_re.finditer(text):
+            norm = _PHONE_STRIP_RE.sub("", m.group(0))
+            # norm holds only ascii digits and '+'
+            if len(norm) - norm.count("+") >= 6:
+                out.append(norm)
+        return out
+
+    def _upis(self, text: str) -> List[str]:
+        at = text.find("@")
+        if at < 0:
+            return []
+        # any match ends in the run of local-part chars right before an '@'
+        start = at
+        while start > 0 and text[start - 1] in _UPI_LOCAL_CHARS:
+            start -= 1
+        return self._upi_re.findall(text, start)
+
+    def _urls(self, text: str) -> List[str]:
+        h = text.find("http")
+        w = text.find("www.")
+        if h < 0 and w < 0:
+            return []
+        start = w if h < 0 else h if w < 0 else min(h, w)
+        return self._url_re.findall(text, start)
+
+    def detect(self, text: str) -> Dict[str, Any]:
+        text_lower = text.lower()
+        score = 0.0
+        reasons: List[str] = []
+        matches = {"phones": [], "upis": [], "urls": []}
+
+        kw_matches = [k for k in self.keywords if k in text_lower]
+        if kw_matches:
+            score += min(0.5, 0.05 * len(kw_matches))
+            reasons.append(f"keywords:{', '.join(set(kw_matches))}")
+
+        for phrases, weight, reason in self.phrase_rules:
+            for p in phrases:
+                if p in text_lower:
+                    score += weight
+                    reasons.append(reason)
+                    break
+
+        matches["phones"] = self._phones(text)
+        if matches["phones"]:
+            score += 0.3
+            reasons.append("phone_detected")
+
+        upi = self._upis(text)
+        if upi:
+            matches["upis"] = upi
+            score += 0.4
+            reasons.append("upi_detected")
+
+        urls = self._urls(text)
+        if urls:
+            matches["urls"] = urls
+            score += 0.2
+            reasons.append("url_detected")
+
+        if score > 1.0:
+            score = 1.0
+
+        return {"score": round(score, 3), "reasons": reasons, "matches": matches}
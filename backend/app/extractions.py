@@ -0,0 +1,155 @@
+"""Canonical extraction values and deduplicating extraction writes.
+
+The detector reports every phone/UPI/URL occurrence as written, so the same
+intelligence shows up in many spellings ("+91 98765-43210", "09876543210",
+"Scammer@YBL", "HTTP://Evil.com:80/"). `canonical()` maps each to one form:
+
+- phone: E.164 via `phonenumbers` (national numbers are read in
+  `PHONE_DEFAULT_REGION`, default IN); digits with an optional leading "+"
+  when the number cannot be parsed
+- upi: stripped and lowercased
+- url: lowercase scheme and host, scheme-default port and fragment dropped,
+  no trailing slash, trailing punctuation from the surrounding text removed
+
+`extractions` holds one row per (session_id, type, canonical_value) with a
+`count` and `first_seen` / `last_seen`; `value` keeps the first spelling
+seen. `upsert()` writes a unit's matches with one INSERT .. ON CONFLICT DO
+UPDATE (SQLite/Postgres; update-then-insert elsewhere), so repeated
+intelligence costs an index hit instead of a new row.
+"""
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from sqlalchemy import insert, update
+
+from .db import Extraction
+
+try:
+    import phonenumbers
+except Exception:
+    phonenumbers = None
+
+PHONE_DEFAULT_REGION = os.getenv('PHONE_DEFAULT_REGION', 'IN')
+
+# detector match key -> (extraction type, confidence)
+MATCH_TYPES = {'phones': ('phone', 0.9), 'upis': ('upi', 0.9), 'urls': ('url', 0.8)}
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_SCHEME_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.\-]*://')
+_URL_TRAILING = '.,;:!?)]}\'"'
+
+
+def normalize_phone(value: str, region: str = PHONE_DEFAULT_REGION) -> str:
+    value = (value or '').strip()
+    if phonenumbers is not None:
+        try:
+            num = phonenumbers.parse(value, region)
+            if phonenumbers.is_possible_number(num):
+                return phonenumbers.format_number(num, phonenumbers.PhoneNumberFormat.E164)
+        except phonenumbers.NumberParseException:
+            pass
+    digits = re.sub(r'\D', '', value)
+    return '+' + digits if value.startswith('+') else digits
+
+
+def normalize_upi(value: str) -> str:
+    return (value or '').strip().lower()
+
+
+def normalize_url(value: str) -> str:
+    value = (value or '').strip().rstrip(_URL_TRAILING)
+    if not _SCHEME_RE.match(value):
+        # the detector also matches bare "www." links
+        value = 'http://' + value
+    try:
+        parts = urlsplit(value)
+        port = parts.port
+    except ValueError:
+        return value.lower()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    netloc = host
+    if parts.username is not None:
+        userinfo = parts.username + (f':{parts.password}' if parts.password is not None else '')
+        netloc = f'{userinfo}@{host}'
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        netloc += f':{port}'
+    return urlunsplit((scheme, netloc, parts.path.rstrip('/'), parts.query, ''))
+
+
+_NORMALIZERS = {'phone': normalize_phone, 'upi': normalize_upi, 'url': normalize_url}
+
+
+def canonical(type_: str, value: str) -> str:
+    fn = _NORMALIZERS.get(type_)
+    return fn(value) if fn is not None else (value or '').strip()
+
+
+def from_matches(session_id: str, matches: Dict[str, List[str]]) -> List[dict]:
+    """Extraction rows (one per occurrence, canonical value filled in) for detector matches."""
+    rows = []
+    for key, (type_, confidence) in MATCH_TYPES.items():
+        for value in matches.get(key, []):
+            rows.append({'session_id': session_id, 'type': type_, 'value': value,
+                         'canonical_value': canonical(type_, value), 'confidence': confidence})
+    return rows
+
+
+def _aggregate(rows: List[dict], seen_at: datetime) -> List[dict]:
+    # one row per key: a single multi-row ON CONFLICT statement may not
+    # touch the same target row twice (Postgres)
+    merged: Dict[tuple, dict] = {}
+    for r in rows:
+        cv = r.get('canonical_value') or canonical(r['type'], r['value'])
+        key = (r['session_id'], r['type'], cv)
+        m = merged.get(key)
+        if m is None:
+            merged[key] = {'session_id': r['session_id'], 'type': r['type'], 'value': r['value'],
+                           'canonical_value': cv, 'confidence': r.get('confidence'),
+                           'count': 1, 'first_seen': seen_at, 'last_seen': seen_at}
+        else:
+            m['count'] += 1
+    # fixed key order keeps concurrent writers from locking rows in opposite orders
+    return [merged[k] for k in sorted(merged)]
+
+
+def _upsert_stmt(db):
+    dialect = db.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    t = Extraction.__table__
+    stmt = dialect_insert(t)
+    return stmt.on_conflict_do_update(
+        index_elements=['session_id', 'type', 'canonical_value'],
+        set_={'count': t.c.count + stmt.excluded.count, 'last_seen': stmt.excluded.last_seen},
+    )
+
+
+def upsert(db, rows: List[dict], seen_at: Optional[datetime] = None) -> List[dict]:
+    """Record extraction occurrences in `db`'s transaction; returns the merged rows."""
+    merged = _aggregate(rows, seen_at or datetime.utcnow())
+    if not merged:
+        return merged
+    stmt = _upsert_stmt(db)
+    if stmt is not None:
+        db.execute(stmt, merged)
+        return merged
+    t = Extraction.__table__
+    for r in merged:
+        res = db.execute(
+            update(t)
+            .where(t.c.session_id == r['session_id'], t.c.type == r['type'], t.c.canonical_value == r['canonical_value'])
+            .values(count=t.c.count + r['count'], last_seen=r['last_seen'])
+        )
+        if res.rowcount == 0:
+            db.execute(insert(t).values(**r))
+    return merged
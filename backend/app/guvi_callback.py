@@ -1,47 +1,290 @@
+"""Asynchronous delivery of final results to GUVI.
+
+`send_guvi_callback(payload)` never blocks the caller: it schedules delivery
+on a dedicated asyncio loop thread and returns immediately. Deliveries share
+one keep-alive httpx client, at most `GUVI_CALLBACK_CONCURRENCY` requests are
+in flight, and retries wait with jittered exponential backoff on the loop
+(`asyncio.sleep`), so a GUVI outage costs no request-serving threads.
+
+Callbacks are coalesced per session: a submission waits
+`GUVI_CALLBACK_DEBOUNCE_SECONDS` (at most `GUVI_CALLBACK_MAX_DELAY_SECONDS`
+since the first one) for newer payloads of the same session, and only the
+latest is sent. A payload whose content hash matches the last one GUVI
+accepted for that session is skipped. Every request carries an
+`Idempotency-Key` derived from the session and content hash, so retries and
+queue redeliveries of one payload are recognisable as duplicates.
+
+A payload that still fails after `GUVI_CALLBACK_ATTEMPTS` tries, arrives
+while the circuit breaker is open, or finds more than
+`GUVI_CALLBACK_MAX_PENDING` deliveries already waiting is handed to the
+persistent queue (`callback_queue`), which retries on its own schedule.
+"""
 import os
-import requests
+import json
+import random
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import httpx
 from .audit import append_event
-from .callback_queue import enqueue
+from .callback_queue import enqueue, GUVI_URL
 from .circuit_breaker import outgoing_breaker
-import time
 
+CONCURRENCY = int(os.getenv("GUVI_CALLBACK_CONCURRENCY", "8"))
+MAX_PENDING = int(os.getenv("GUVI_CALLBACK_MAX_PENDING", "1000"))
+ATTEMPTS = int(os.getenv("GUVI_CALLBACK_ATTEMPTS", "3"))
+BACKOFF_BASE = float(os.getenv("GUVI_CALLBACK_BACKOFF_BASE", "1"))
+TIMEOUT = float(os.getenv("GUVI_CALLBACK_TIMEOUT", "5"))
+DEBOUNCE_SECONDS = float(os.getenv("GUVI_CALLBACK_DEBOUNCE_SECONDS", "2"))
+MAX_DELAY_SECONDS = float(os.getenv("GUVI_CALLBACK_MAX_DELAY_SECONDS", "10"))
+# sessions whose last delivered hash is remembered
+SENT_HASHES_MAX = 10000
+
+
+def payload_hash(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+
+
+def idempotency_key(payload: dict) -> str:
+    return f"{payload.get('sessionId') or ''}:{payload_hash(payload)[:32]}"
+
+
+def _headers(payload: dict) -> dict:
+    return {"Content-Type": "application/json", "x-api-key": os.getenv("GUVI_API_KEY", ""), "Idempotency-Key": idempotency_key(payload)}
+
+
+def _jittered(delay: float) -> float:
+    return random.uniform(delay / 2, delay)
+
+
+class CallbackSender:
+    def __init__(self, concurrency: int = CONCURRENCY, max_pending: int = MAX_PENDING, attempts: int = ATTEMPTS,
+                 debounce: float = DEBOUNCE_SECONDS, max_delay: float = MAX_DELAY_SECONDS, transport=None):
+        self.concurrency = max(1, concurrency)
+        self._transport = transport
+        self.max_pending = max_pending
+        self.attempts = max(1, attempts)
+        self.debounce = max(0.0, debounce)
+        self.max_delay = max(self.debounce, max_delay)
+        # loop-thread state: sessionId -> [latest payload, first submit time, timer]
+        self._coalescing: Dict[str, list] = {}
+        self._inflight: Dict[str, int] = {}
+        self._sent: 'OrderedDict[str, str]' = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    # -- loop thread -------------------------------------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=_run, name='guvi-callback-sender', daemon=True)
+                self._thread.start()
+                ready.wait(5)
+                self._loop = loop
+            return self._loop
+
+    def _http(self) -> httpx.AsyncClient:
+        # created lazily on the loop thread
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            self._client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(TIMEOUT), transport=self._transport)
+            self._sem = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    # -- public ------------------------------------------------------------
+
+    def submit(self, payload: dict) -> dict:
+        """Schedule delivery from any thread; never blocks on the network."""
+        if len(self._tasks) + len(self._coalescing) >= self.max_pending:
+            return self._hand_off(payload, 'backlog')
+        if self.debounce > 0 and payload.get('sessionId'):
+            self._ensure_loop().call_soon_threadsafe(self._coalesce, payload)
+        else:
+            self._ensure_loop().call_soon_threadsafe(self._spawn, payload)
+        return {"status": "scheduled"}
+
+    def post_many(self, payloads: List[dict], timeout: Optional[float] = None) -> List[Optional[str]]:
+        """Blocking single attempt per payload over the shared pool (used by
+        the persistent queue). Returns None per success (including payloads
+        already delivered), else the error."""
+        async def _one(p):
+            if self._already_sent(p):
+                return None
+            return await self.post_once(p)
+
+        async def _all():
+            return await asyncio.gather(*(_one(p) for p in payloads))
+        fut = asyncio.run_coroutine_threadsafe(_all(), self._ensure_loop())
+        return fut.result(timeout)
 
-def send_guvi_callback(payload: dict):
-    """Attempt to send final result to GUVI, with retries and enqueue fallback."""
-    if not outgoing_breaker.allow():
-        append_event('guvi_callback_shortcircuited', {'sessionId': payload.get('sessionId')})
-        return {'status': 'shortcircuited'}
+    def stop(self, timeout: float = 5.0) -> None:
+        """Cancel pending deliveries (handing them to the queue) and stop the loop."""
+        loop = self._loop
+        if loop is None:
+            return
 
-    guvi_url = "https://hackathon.guvi.in/api/updateHoneyPotFinalResult"
-    guvi_key = os.getenv("GUVI_API_KEY", "")
-    headers = {"Content-Type": "application/json", "x-api-key": guvi_key}
+        async def _shutdown():
+            # payloads still waiting out their debounce go to the queue
+            for session_id in list(self._coalescing):
+                entry = self._coalescing.pop(session_id)
+                entry[2].cancel()
+                if not self._already_sent(entry[0]):
+                    self._hand_off(entry[0], 'shutdown')
+            tasks = list(self._tasks)
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._client is not None:
+                await self._client.aclose()
+                self._client = None
 
-    attempts = 0
-    max_attempts = 3
-    backoff = 1
-    while attempts < max_attempts:
         try:
-            resp = requests.post(guvi_url, json=payload, headers=headers, timeout=5)
-            resp.raise_for_status()
-            try:
-                outgoing_breaker.record_success()
-            except Exception:
-                pass
-            append_event("guvi_callback_sent", {"payload": payload, "status": resp.status_code})
-            return {"status": "sent", "code": resp.status_code}
-        except Exception as e:
-            attempts += 1
+            asyncio.run_coroutine_threadsafe(_shutdown(), loop).result(timeout)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            self._loop = None
+            self._thread = None
+
+    # -- delivery ----------------------------------------------------------
+
+    def _spawn(self, payload: dict) -> None:
+        task = asyncio.ensure_future(self.deliver(payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _coalesce(self, payload: dict) -> None:
+        session_id = payload['sessionId']
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        entry = self._coalescing.get(session_id)
+        if entry is None:
+            entry = self._coalescing[session_id] = [payload, now, None]
+        else:
+            entry[0] = payload
+            entry[2].cancel()
+        entry[2] = loop.call_at(min(now + self.debounce, entry[1] + self.max_delay), self._flush, session_id)
+
+    def _flush(self, session_id: str) -> None:
+        if self._inflight.get(session_id):
+            # one delivery per session at a time; look again after the window
+            entry = self._coalescing.get(session_id)
+            if entry is not None:
+                entry[2] = asyncio.get_running_loop().call_later(self.debounce, self._flush, session_id)
+            return
+        entry = self._coalescing.pop(session_id, None)
+        if entry is None:
+            return
+        if self._already_sent(entry[0]):
+            append_event('guvi_callback_unchanged', {'sessionId': session_id})
+            return
+        self._spawn(entry[0])
+
+    def _already_sent(self, payload: dict) -> bool:
+        session_id = payload.get('sessionId')
+        return session_id is not None and self._sent.get(session_id) == payload_hash(payload)
+
+    def _mark_sent(self, payload: dict) -> None:
+        session_id = payload.get('sessionId')
+        if session_id is None:
+            return
+        self._sent[session_id] = payload_hash(payload)
+        self._sent.move_to_end(session_id)
+        while len(self._sent) > SENT_HASHES_MAX:
+            self._sent.popitem(last=False)
+
+    def _hand_off(self, payload: dict, reason: str) -> dict:
+        try:
+            item_id = enqueue(payload)
+        except Exception:
+            append_event("enqueue_failed", {"sessionId": payload.get("sessionId")})
+            return {"status": "dropped", "reason": reason}
+        return {"status": "queued", "reason": reason, "id": item_id}
+
+    async def post_once(self, payload: dict) -> Optional[str]:
+        client = self._http()
+        async with self._sem:
             try:
-                outgoing_breaker.record_failure()
-            except Exception:
-                pass
-            append_event("guvi_callback_error", {"attempt": attempts, "error": str(e)})
-            time.sleep(backoff)
-            backoff *= 2
-
-    # Enqueue for persistent retry
-    try:
-        enqueue(payload)
-    except Exception:
-        append_event("enqueue_failed", {"sessionId": payload.get("sessionId")})
-    return {"status": "failed_enqueued", "attempts": attempts}
+                resp = await client.post(GUVI_URL, json=payload, headers=_headers(payload))
+                resp.raise_for_status()
+            except Exception as e:
+                try:
+                    outgoing_breaker.record_failure()
+                except Exception:
+                    pass
+                return str(e) or type(e).__name__
+        try:
+            outgoing_breaker.record_success()
+        except Exception:
+            pass
+        self._mark_sent(payload)
+        return None
+
+    async def deliver(self, payload: dict) -> dict:
+        """Up to `attempts` tries with jittered backoff, then the persistent queue."""
+        session_id = payload.get('sessionId')
+        self._inflight[session_id] = self._inflight.get(session_id, 0) + 1
+        try:
+            delay = BACKOFF_BASE
+            for attempt in range(1, self.attempts + 1):
+                if not outgoing_breaker.allow():
+                    append_event('guvi_callback_shortcircuited', {'sessionId': session_id})
+                    return await asyncio.to_thread(self._hand_off, payload, 'circuit_open')
+                error = await self.post_once(payload)
+                if error is None:
+                    append_event("guvi_callback_sent", {"payload": payload, "attempt": attempt})
+                    return {"status": "sent", "attempts": attempt}
+                append_event("guvi_callback_error", {"sessionId": session_id, "attempt": attempt, "error": error})
+                if attempt < self.attempts:
+                    await asyncio.sleep(_jittered(delay))
+                    delay *= 2
+            return await asyncio.to_thread(self._hand_off, payload, 'attempts_exhausted')
+        except asyncio.CancelledError:
+            # shutting down: keep the payload for the persistent queue
+            self._hand_off(payload, 'shutdown')
+            raise
+        finally:
+            n = self._inflight.pop(session_id, 1) - 1
+            if n > 0:
+                self._inflight[session_id] = n
+
+
+_sender: Optional[CallbackSender] = None
+_sender_lock = threading.Lock()
+
+
+def get_sender() -> CallbackSender:
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = CallbackSender()
+    return _sender
+
+
+def send_guvi_callback(payload: dict) -> dict:
+    """Schedule delivery of a final result to GUVI; returns immediately."""
+    return get_sender().submit(payload)
+
+
+def shutdown_sender(timeout: float = 5.0) -> None:
+    if _sender is not None:
+        _sender.stop(timeout)
@@ -0,0 +1,104 @@
+"""Cross-session lookups: which sessions share this UPI id / phone / URL.
+
+Since extractions are deduplicated per session (see extractions.py), the
+rows of one canonical value across all sessions are exactly its posting
+list. `ix_extractions_value_session` on (canonical_value, type, session_id)
+is the inverted index over them. The ingest upsert keeps it current, and a
+lookup is a range scan of that index whatever the size of the table.
+
+Looked-up values go through the same canonicalization as ingest. Without an
+explicit type, a value is tried as every type it could plausibly be (a bare
+"name@bank" as UPI, digits as a phone, anything with a scheme or "www." as a
+URL).
+
+Each value returns at most `INTEL_LOOKUP_MAX_SESSIONS` sessions, most
+recently seen first, together with the full session count.
+"""
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, tuple_
+
+from .db import Extraction as DBExtraction
+from .extractions import canonical
+
+MAX_SESSIONS = int(os.getenv('INTEL_LOOKUP_MAX_SESSIONS', '1000'))
+BATCH_MAX = int(os.getenv('INTEL_LOOKUP_BATCH_MAX', '500'))
+
+TYPES = ('phone', 'upi', 'url')
+
+_URL_HINT_RE = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.\-]*://|www\.)', re.I)
+_UPI_HINT_RE = re.compile(r'^[A-Za-z0-9.\-_]+@[A-Za-z]+$')
+_PHONE_HINT_RE = re.compile(r'^\+?[\d\s\-().]{6,}$')
+
+
+def candidates(value: str, type_: Optional[str] = None) -> List[Tuple[str, str]]:
+    """(type, canonical value) pairs `value` may be stored as."""
+    value = (value or '').strip()
+    if not value:
+        return []
+    if type_ is not None:
+        types = [type_]
+    else:
+        types = []
+        if _URL_HINT_RE.match(value):
+            types.append('url')
+        if _UPI_HINT_RE.match(value):
+            types.append('upi')
+        if _PHONE_HINT_RE.match(value):
+            types.append('phone')
+        if not types:
+            # free-form input: try it as a (schemeless) link
+            types.append('url')
+    out = []
+    for t in types:
+        cv = canonical(t, value)
+        if cv and (t, cv) not in out:
+            out.append((t, cv))
+    return out
+
+
+def lookup_many(db, values: List[str], type_: Optional[str] = None, max_sessions: int = MAX_SESSIONS) -> List[Dict]:
+    """One result per input value, in order (see the module docstring)."""
+    per_value = [candidates(v, type_) for v in values]
+    keys = sorted({k for c in per_value for k in c})
+    totals: Dict[Tuple[str, str], int] = {}
+    postings: Dict[Tuple[str, str], List[Dict]] = {}
+    if keys:
+        match = tuple_(DBExtraction.canonical_value, DBExtraction.type).in_([(cv, t) for t, cv in keys])
+        for t, cv, n in (db.query(DBExtraction.type, DBExtraction.canonical_value, func.count(DBExtraction.id))
+                         .filter(match).group_by(DBExtraction.type, DBExtraction.canonical_value)):
+            totals[(t, cv)] = n
+        if totals and max_sessions > 0:
+            rank = func.row_number().over(
+                partition_by=(DBExtraction.type, DBExtraction.canonical_value),
+                order_by=(DBExtraction.last_seen.desc().nullslast(), DBExtraction.id.desc()),
+            ).label('rank')
+            ranked = (db.query(DBExtraction.type, DBExtraction.canonical_value, DBExtraction.session_id,
+                               DBExtraction.count.label('occurrences'), DBExtraction.first_seen, DBExtraction.last_seen, rank)
+                      .filter(match).subquery())
+            rows = db.query(ranked).filter(ranked.c.rank <= max_sessions).order_by(ranked.c.type, ranked.c.canonical_value, ranked.c.rank)
+            for r in rows:
+                postings.setdefault((r.type, r.canonical_value), []).append({
+                    'sessionId': r.session_id,
+                    'count': r.occurrences,
+                    'firstSeen': r.first_seen.isoformat() if r.first_seen else None,
+                    'lastSeen': r.last_seen.isoformat() if r.last_seen else None,
+                })
+    results = []
+    for value, cands in zip(values, per_value):
+        matches = []
+        for key in cands:
+            n = totals.get(key)
+            if not n:
+                continue
+            sessions = postings.get(key, [])
+            matches.append({'type': key[0], 'canonicalValue': key[1], 'sessionCount': n,
+                            'sessions': sessions, 'truncated': len(sessions) < n})
+        results.append({'value': value, 'matches': matches})
+    return results
+
+
+def lookup(db, value: str, type_: Optional[str] = None, max_sessions: int = MAX_SESSIONS) -> Dict:
+    return lookup_many(db, [value], type_, max_sessions)[0]
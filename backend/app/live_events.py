@@ -0,0 +1,167 @@
+"""Getting persisted events to live viewers (SSE) from any thread.
+
+Ingest and agent code runs in threadpool threads, in the group-commit thread
+or inside `AsyncSession.run_sync`, none of which may touch the broker's
+event loop directly. `PublishBridge` captures the server loop at startup;
+`publish()` appends to a deque from any thread and wakes the loop at most
+once per burst (`call_soon_threadsafe`). A single drain task on the loop
+then hands batches of up to `SSE_PUBLISH_BATCH` events to the broker in
+order, so there is no task per message. If more than
+`SSE_PUBLISH_BACKLOG` events are waiting, the oldest are dropped (viewers
+recover through the DB history on reconnect).
+
+`publish_session_event(db, session_id, data)` stages an event on the ORM
+session and publishes it only when the outermost transaction commits.
+Events staged inside a SAVEPOINT that rolls back (a failed group-commit
+unit) are discarded with it. The staging itself is `stage_after_commit()`,
+which other side effects that must not run for rolled-back writes (the
+agent's final GUVI callback) use as well.
+"""
+import os
+import json
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+from .sse_broker import get_broker
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_BATCH = int(os.getenv('SSE_PUBLISH_BATCH', '100'))
+PUBLISH_BACKLOG = int(os.getenv('SSE_PUBLISH_BACKLOG', '10000'))
+
+_PENDING_KEY = 'after_commit_pending'
+
+
+class PublishBridge:
+    def __init__(self, max_batch: int = PUBLISH_BATCH, max_backlog: int = PUBLISH_BACKLOG, broker=None):
+        self.max_batch = max(1, max_batch)
+        self._items = deque(maxlen=max(1, max_backlog))
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._broker = broker
+        self.dropped = 0
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Bind to the loop the broker's subscribers live on (call at startup)."""
+        self._loop = loop or asyncio.get_event_loop()
+
+    def publish(self, channel: str, message: str) -> bool:
+        """Queue one event from any thread; False if no loop is bound."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+        with self._lock:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append((channel, message))
+            if self._scheduled:
+                return True
+            self._scheduled = True
+        try:
+            loop.call_soon_threadsafe(self._start_drain)
+        except RuntimeError:
+            # loop shut down between the check and the call
+            with self._lock:
+                self._scheduled = False
+            return False
+        return True
+
+    def _start_drain(self) -> None:
+        asyncio.ensure_future(self._drain())
+
+    def _next_batch(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            n = min(len(self._items), self.max_batch)
+            batch = [self._items.popleft() for _ in range(n)]
+            if not batch:
+                self._scheduled = False
+            return batch
+
+    async def _drain(self) -> None:
+        broker = self._broker or get_broker()
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                await broker.publish_many(batch)
+            except Exception as e:
+                logger.warning('live event publish failed: %s', e)
+
+
+_bridge = None
+_bridge_lock = threading.Lock()
+
+
+def get_bridge() -> PublishBridge:
+    global _bridge
+    if _bridge is None:
+        with _bridge_lock:
+            if _bridge is None:
+                _bridge = PublishBridge()
+    return _bridge
+
+
+def session_channel(session_id: str) -> str:
+    return f'session:{session_id}'
+
+
+def _publish(channel: str, message: str) -> None:
+    get_bridge().publish(channel, message)
+
+
+def publish_session_event(db, session_id: str, data: dict) -> None:
+    """Publish `data` to the session's viewers once `db` commits (now if db is None)."""
+    message = json.dumps(data, default=str)
+    if db is None:
+        _publish(session_channel(session_id), message)
+        return
+    stage_after_commit(db, _publish, session_channel(session_id), message)
+
+
+def stage_after_commit(db, fn: Callable, *args) -> None:
+    """Call `fn(*args)` once `db`'s outermost transaction commits.
+
+    Dropped if the transaction or SAVEPOINT it was staged in rolls back.
+    """
+    txn = db.get_nested_transaction() or db.get_transaction()
+    db.info.setdefault(_PENDING_KEY, []).append((txn, fn, args))
+
+
+def _within(txn, ancestor) -> bool:
+    if txn is None:
+        return ancestor.parent is None
+    while txn is not None:
+        if txn is ancestor:
+            return True
+        txn = txn.parent
+    return False
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _run_committed(session):
+    # after_commit only fires for the outermost transaction
+    pending = session.info.pop(_PENDING_KEY, None)
+    for _, fn, args in pending or ():
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.warning('after-commit action failed: %s', e)
+
+
+@event.listens_for(OrmSession, 'after_soft_rollback')
+def _discard_rolled_back(session, previous_transaction):
+    pending = session.info.get(_PENDING_KEY)
+    if pending:
+        kept = [p for p in pending if not _within(p[0], previous_transaction)]
+        if kept:
+            session.info[_PENDING_KEY] = kept
+        else:
+            session.info.pop(_PENDING_KEY, None)
@@ -10,7 +10,11 @@ from .db import init_db
 from dotenv import load_dotenv
 import os
 from .callback_queue import start_worker
-from .outgoing_worker import start_outgoing_worker
+from .outgoing_worker import start_outgoing_worker, stop_outgoing_worker
+from .unit_of_work import shutdown_committer
+from .guvi_callback import shutdown_sender
+from .live_events import get_bridge
+from .audit import shutdown_audit
 from backend.phase4.metrics import metrics_payload
 from backend.logging_config import setup_logging
 
@@ -81,3 +85,31 @@ def startup_event():
         start_outgoing_worker()
     except Exception as e:
         print("Failed to start outgoing worker:", e)
+    # live SSE events are published from worker threads onto this loop
+    try:
+        get_bridge().start()
+    except Exception as e:
+        print("Failed to start live event bridge:", e)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # commit any ingest units still waiting in the group committer
+    try:
+        shutdown_committer()
+    except Exception as e:
+        print("Failed to drain group committer:", e)
+    try:
+        stop_outgoing_worker()
+    except Exception as e:
+        print("Failed to stop outgoing worker:", e)
+    # pending GUVI retries are handed to the persistent queue
+    try:
+        shutdown_sender()
+    except Exception as e:
+        print("Failed to stop GUVI callback sender:", e)
+    # last: everything above may still append audit events
+    try:
+        shutdown_audit()
+    except Exception as e:
+        print("Failed to flush audit log:", e)
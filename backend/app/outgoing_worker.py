@@ -1,8 +1,36 @@
+"""Outgoing message dispatcher.
+
+Queued `OutgoingMessage` rows are delivered to `OUTGOING_ENDPOINT` by an
+asyncio dispatcher running on its own thread:
+
+- due rows are claimed in batches with one `UPDATE ... RETURNING` (with
+  `FOR UPDATE SKIP LOCKED` on Postgres), moving them to `sending` under a
+  lease (`claimed_by`, `lease_until`) so any number of processes can
+  dispatch from one table without double-sending; a row whose lease
+  expired (its worker died) becomes claimable again;
+- a failed send is re-queued with exponential backoff (`next_attempt_at`)
+  until `OUTGOING_MAX_ATTEMPTS`, then marked `failed`;
+- up to `OUTGOING_CONCURRENCY` requests are in flight at once over one pooled
+  keep-alive httpx client, so a slow response no longer stalls the queue;
+- results are written back in bulk, fenced on `claimed_by`;
+- the dispatcher sleeps until a transaction that queued outgoing rows
+  commits (`notify_outgoing()`), falling back to polling every
+  `OUTGOING_WORKER_INTERVAL` seconds.
+
+`_process_one(db)` runs a single claim/send/update pass synchronously.
+"""
 import os
 import time
+import asyncio
 import threading
-import requests
-from datetime import datetime
+import random
+import socket
+import uuid
+import httpx
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, bindparam, event, func, or_, select, update
+from sqlalchemy.orm import Session as OrmSession
 from .db import SessionLocal, OutgoingMessage
 from .audit import append_event
 import json
@@ -34,99 +62,267 @@ def _write_http_log(entry: dict):
 INTERVAL = int(os.getenv("OUTGOING_WORKER_INTERVAL", "5"))
 OUT_ENDPOINT = os.getenv("OUTGOING_ENDPOINT", "")
 OUT_API_KEY = os.getenv("OUTGOING_API_KEY", "")
+CONCURRENCY = int(os.getenv("OUTGOING_CONCURRENCY", "16"))
+BATCH_SIZE = int(os.getenv("OUTGOING_BATCH_SIZE", "50"))
+TIMEOUT = float(os.getenv("OUTGOING_TIMEOUT", "8"))
+LEASE_SECONDS = int(os.getenv("OUTGOING_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.getenv("OUTGOING_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE = float(os.getenv("OUTGOING_BACKOFF_BASE", "5"))
+BACKOFF_MAX = float(os.getenv("OUTGOING_BACKOFF_MAX", "600"))
 
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 
-def _process_one(db):
-    msgs = db.query(OutgoingMessage).filter(OutgoingMessage.status == 'queued').order_by(OutgoingMessage.created_at).limit(10).all()
-    for m in msgs:
-        try:
-            payload = {"sessionId": m.session_id, "content": m.content}
-            if OUT_ENDPOINT:
-                headers = {"Content-Type": "application/json"}
-                if OUT_API_KEY:
-                    headers["x-api-key"] = OUT_API_KEY
-                try:
-                    OUTGOING_ATTEMPTS.inc()
-                except Exception:
-                    pass
-                # record attempt
-                append_event("outgoing_attempt", {"id": m.id, "sessionId": m.session_id, "endpoint": OUT_ENDPOINT})
-                _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "request", "id": m.id, "sessionId": m.session_id, "endpoint": OUT_ENDPOINT, "request": payload})
-                resp = requests.post(OUT_ENDPOINT, json=payload, headers=headers, timeout=8)
-                # log status and body
-                status_code = getattr(resp, 'status_code', None)
-                text = None
-                try:
-                    text = resp.text
-                except Exception:
-                    text = None
-                _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "response", "id": m.id, "sessionId": m.session_id, "endpoint": OUT_ENDPOINT, "status": status_code, "response_body": text})
-                resp.raise_for_status()
-                m.status = 'sent'
-                append_event("outgoing_sent", {"id": m.id, "sessionId": m.session_id, "status": status_code, "response_body": text})
-                try:
-                    OUTGOING_SUCCESS.inc()
-                except Exception:
-                    pass
-            else:
-                # no endpoint configured: mark as simulated sent
-                try:
-                    OUTGOING_ATTEMPTS.inc()
-                except Exception:
-                    pass
-                m.status = 'sent'
-                append_event("outgoing_sent_simulated", {"id": m.id, "sessionId": m.session_id})
-                _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "simulated_sent", "id": m.id, "sessionId": m.session_id, "content": m.content})
-            db.add(m)
+# session.info flag set by writers that queue outgoing rows
+ENQUEUED_KEY = 'outgoing_enqueued'
+
+
+class _Claimed:
+    __slots__ = ('id', 'session_id', 'content', 'attempts', 'claimed_by')
+
+    def __init__(self, id, session_id, content, attempts, claimed_by):
+        self.id = id
+        self.session_id = session_id
+        self.content = content
+        self.attempts = attempts
+        self.claimed_by = claimed_by
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before the retry following attempt number `attempts` (exponential, half jittered)."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+def _claimable(t, now):
+    return or_(
+        and_(t.c.status == 'queued', t.c.next_attempt_at <= now),
+        and_(t.c.status == 'sending', t.c.lease_until < now),
+    )
+
+
+def claim_batch(db, limit: int, worker_id: Optional[str] = None, now: Optional[datetime] = None) -> List[_Claimed]:
+    """Atomically lease up to `limit` due rows to `worker_id` and return them."""
+    if limit <= 0:
+        return []
+    worker_id = worker_id or WORKER_ID
+    now = now or datetime.utcnow()
+    t = OutgoingMessage.__table__
+    dialect = db.get_bind().dialect
+    ids = select(t.c.id).where(_claimable(t, now)).order_by(t.c.next_attempt_at, t.c.id).limit(limit)
+    if dialect.name == 'postgresql':
+        ids = ids.with_for_update(skip_locked=True)
+    values = {'status': 'sending', 'claimed_by': worker_id, 'lease_until': now + timedelta(seconds=LEASE_SECONDS),
+              'attempts': func.coalesce(t.c.attempts, 0) + 1}
+    cols = (t.c.id, t.c.session_id, t.c.content, t.c.attempts)
+    if getattr(dialect, 'update_returning', False):
+        stmt = update(t).where(t.c.id.in_(ids.scalar_subquery()), _claimable(t, now)).values(**values)
+        rows = db.execute(stmt.returning(*cols)).fetchall()
+    else:
+        candidate = [r[0] for r in db.execute(ids).fetchall()]
+        if not candidate:
             db.commit()
-        except Exception as e:
-            # record failure, include exception and any response text
-            try:
-                m.status = 'failed'
-                db.add(m)
-                db.commit()
-            except Exception:
-                # log error
-                _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "error", "id": getattr(m, 'id', None), "sessionId": getattr(m, 'session_id', None), "error": str(e)})
-                try:
-                    m.status = 'failed'
-                    db.add(m)
-                    db.commit()
-                except Exception:
-                    try:
-                        db.rollback()
-                    except Exception:
-                        pass
-            append_event("outgoing_send_error", {"id": getattr(m, 'id', None), "error": str(e)})
-            try:
-                OUTGOING_FAILURE.inc()
-            except Exception:
-                pass
+            return []
+        db.execute(update(t).where(t.c.id.in_(candidate), _claimable(t, now)).values(**values))
+        rows = db.execute(select(*cols).where(t.c.id.in_(candidate), t.c.claimed_by == worker_id, t.c.status == 'sending')).fetchall()
+    db.commit()
+    return [_Claimed(r[0], r[1], r[2], r[3] or 0, worker_id) for r in rows]
 
 
-def _worker_loop():
-    db = SessionLocal()
+def apply_results(db, outcomes: List[Tuple[_Claimed, str]], now: Optional[datetime] = None) -> None:
+    """Record send outcomes ('sent' / 'failed') for rows their worker still holds.
+
+    Sent rows are updated with one statement per worker; failures are
+    re-queued with backoff (or given up on) in one executemany. Rows whose
+    lease has been taken over by another worker are left alone.
+    """
+    if not outcomes:
+        return
+    now = now or datetime.utcnow()
+    t = OutgoingMessage.__table__
+    sent: Dict[str, List[int]] = {}
+    retries = []
+    for m, status in outcomes:
+        if status == 'sent':
+            sent.setdefault(m.claimed_by, []).append(m.id)
+        elif m.attempts >= MAX_ATTEMPTS:
+            retries.append({'_id': m.id, '_by': m.claimed_by, '_status': 'failed', '_next': None})
+        else:
+            retries.append({'_id': m.id, '_by': m.claimed_by, '_status': 'queued', '_next': now + timedelta(seconds=backoff_seconds(m.attempts))})
+    for worker_id, ids in sent.items():
+        db.execute(update(t).where(t.c.id.in_(ids), t.c.claimed_by == worker_id, t.c.status == 'sending')
+                   .values(status='sent', claimed_by=None, lease_until=None))
+    if retries:
+        db.execute(update(t).where(t.c.id == bindparam('_id'), t.c.claimed_by == bindparam('_by'), t.c.status == 'sending')
+                   .values(status=bindparam('_status'), next_attempt_at=bindparam('_next'), claimed_by=None, lease_until=None), retries)
+    db.commit()
+
+
+async def _send(client: Optional[httpx.AsyncClient], m: _Claimed) -> str:
+    """Deliver one claimed row; returns its new status."""
     try:
-        while True:
-            try:
-                _process_one(db)
-            except Exception as e:
-                append_event("outgoing_worker_error", {"error": str(e)})
-            time.sleep(INTERVAL)
-    finally:
+        OUTGOING_ATTEMPTS.inc()
+    except Exception:
+        pass
+    if not OUT_ENDPOINT or client is None:
+        # no endpoint configured: mark as simulated sent
+        append_event("outgoing_sent_simulated", {"id": m.id, "sessionId": m.session_id})
+        _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "simulated_sent", "id": m.id, "sessionId": m.session_id, "content": m.content})
+        return 'sent'
+    payload = {"sessionId": m.session_id, "content": m.content}
+    headers = {"Content-Type": "application/json"}
+    if OUT_API_KEY:
+        headers["x-api-key"] = OUT_API_KEY
+    try:
+        # record attempt
+        append_event("outgoing_attempt", {"id": m.id, "sessionId": m.session_id, "endpoint": OUT_ENDPOINT})
+        _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "request", "id": m.id, "sessionId": m.session_id, "endpoint": OUT_ENDPOINT, "request": payload})
+        resp = await client.post(OUT_ENDPOINT, json=payload, headers=headers)
+        text = resp.text
+        _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "response", "id": m.id, "sessionId": m.session_id, "endpoint": OUT_ENDPOINT, "status": resp.status_code, "response_body": text})
+        resp.raise_for_status()
+        append_event("outgoing_sent", {"id": m.id, "sessionId": m.session_id, "status": resp.status_code, "response_body": text})
+        try:
+            OUTGOING_SUCCESS.inc()
+        except Exception:
+            pass
+        return 'sent'
+    except Exception as e:
+        _write_http_log({"ts": datetime.utcnow().isoformat(), "event": "error", "id": m.id, "sessionId": m.session_id, "error": str(e)})
+        append_event("outgoing_send_error", {"id": m.id, "error": str(e)})
         try:
-            db.close()
+            OUTGOING_FAILURE.inc()
         except Exception:
             pass
+        return 'failed'
 
 
+def _new_client(concurrency: int) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(TIMEOUT))
+
+
+async def _send_all(rows: List[_Claimed]) -> List[Tuple[_Claimed, str]]:
+    async with _new_client(max(1, CONCURRENCY)) as client:
+        statuses = await asyncio.gather(*(_send(client, m) for m in rows))
+    return list(zip(rows, statuses))
+
+
+def _process_one(db):
+    """One synchronous pass: claim a batch, send it, record the results."""
+    rows = claim_batch(db, BATCH_SIZE)
+    if rows:
+        apply_results(db, asyncio.run(_send_all(rows)))
+    return len(rows)
+
+
+def _with_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+class OutgoingDispatcher:
+    def __init__(self, concurrency: int = CONCURRENCY, batch_size: int = BATCH_SIZE, interval: float = INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def notify(self) -> None:
+        """Wake the dispatcher (safe to call from any thread)."""
+        loop, wake = self._loop, self._wake
+        if loop is not None and wake is not None:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass
+
+    def stop(self) -> None:
+        self._stopping = True
+        self.notify()
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        in_flight: Dict[asyncio.Task, _Claimed] = {}
+        results: List[Tuple[_Claimed, str]] = []
+        async with _new_client(self.concurrency) as client:
+            while not self._stopping or in_flight:
+                if results:
+                    done, results = results, []
+                    try:
+                        await asyncio.to_thread(_with_session, apply_results, done)
+                    except Exception as e:
+                        append_event("outgoing_worker_error", {"error": str(e)})
+                self._wake.clear()
+                free = self.concurrency - len(in_flight)
+                if free > 0 and not self._stopping:
+                    try:
+                        rows = await asyncio.to_thread(_with_session, claim_batch, min(free, self.batch_size))
+                    except Exception as e:
+                        append_event("outgoing_worker_error", {"error": str(e)})
+                        rows = []
+                    for m in rows:
+                        in_flight[asyncio.ensure_future(_send(client, m))] = m
+                    if len(rows) == min(free, self.batch_size):
+                        # more may be queued: claim again once results are in
+                        self._wake.set()
+                waiter = asyncio.ensure_future(self._wake.wait())
+                # also wakes for retries falling due and lapsed leases
+                done, _ = await asyncio.wait(set(in_flight) | {waiter}, timeout=self.interval, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                for task in done:
+                    m = in_flight.pop(task, None)
+                    if m is not None:
+                        results.append((m, task.result() if not task.cancelled() else 'failed'))
+            if results:
+                await asyncio.to_thread(_with_session, apply_results, results)
+
+
+_dispatcher: Optional[OutgoingDispatcher] = None
 _thread = None
 
 
+def notify_outgoing() -> None:
+    if _dispatcher is not None:
+        _dispatcher.notify()
+
+
+@event.listens_for(OrmSession, 'after_transaction_end')
+def _notify_after_commit(session, transaction):
+    # writers set session.info[ENQUEUED_KEY]; wake once their outermost
+    # transaction ends (a rollback only causes a harmless empty claim)
+    if transaction.parent is None and session.info.pop(ENQUEUED_KEY, False):
+        notify_outgoing()
+
+
+def _worker_main(dispatcher: OutgoingDispatcher):
+    # rows a crashed worker left in `sending` are reclaimed once their
+    # lease expires, by whichever worker claims next
+    while not dispatcher._stopping:
+        try:
+            asyncio.run(dispatcher.run())
+        except Exception as e:
+            append_event("outgoing_worker_error", {"error": str(e)})
+            time.sleep(INTERVAL)
+
+
 def start_outgoing_worker():
-    global _thread
+    global _thread, _dispatcher
     if _thread and _thread.is_alive():
         return
-    _thread = threading.Thread(target=_worker_loop, daemon=True)
+    _dispatcher = OutgoingDispatcher()
+    _thread = threading.Thread(target=_worker_main, args=(_dispatcher,), name='outgoing-dispatcher', daemon=True)
     _thread.start()
-    append_event("outgoing_worker_started", {"interval": INTERVAL, "endpoint_configured": bool(OUT_ENDPOINT)})
+    append_event("outgoing_worker_started", {"interval": INTERVAL, "concurrency": _dispatcher.concurrency, "worker": WORKER_ID, "endpoint_configured": bool(OUT_ENDPOINT)})
+
+
+def stop_outgoing_worker(timeout: float = 5.0):
+    if _dispatcher is not None:
+        _dispatcher.stop()
+    if _thread is not None:
+        _thread.join(timeout)
@@ -0,0 +1,161 @@
+"""In-process persona registry with precompiled matchers.
+
+Every `*.json` file in the persona directory is loaded once, indexed by its
+`id` field (file stem when missing) and compiled into a `PersonaMatcher`.
+Files are re-checked at most every `PERSONA_RELOAD_CHECK_SECONDS` and
+reloaded when their mtime changes; `reload()` forces a rescan (used by the
+admin endpoint). A file that fails to parse keeps its previous version.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .audit import append_event
+
+PERSONA_DIR = Path(os.getenv('PERSONA_DIR', str(Path(__file__).resolve().parent / 'personas')))
+DEFAULT_PERSONA_ID = 'honeypot_default'
+RELOAD_CHECK_SECONDS = float(os.getenv('PERSONA_RELOAD_CHECK_SECONDS', '2'))
+
+_DIGIT_FALLBACKS = ["Thanks — can you confirm the last 4 digits?", "Got it. What's the account holder name?"]
+
+
+class PersonaMatcher:
+    """Compiled form of a persona's behaviors.
+
+    Behaviors are tried in order; within a behavior match tokens are checked
+    before regex patterns, exactly like the original `simple_match` loop.
+    """
+
+    def __init__(self, persona: Dict):
+        self.behaviors = []
+        for b in persona.get('behaviors', []):
+            tokens = tuple(m.lower() for m in b.get('match', []) or [])
+            patterns = tuple(re.compile(p, re.IGNORECASE) for p in (b.get('patterns') or []))
+            self.behaviors.append((tokens, patterns, list(b.get('response_templates', []))))
+        self.fallbacks = list(persona.get('fallbacks', []) or [])
+
+    def match(self, text: str) -> Tuple[str, Dict]:
+        t_lower = text.lower()
+        for tokens, patterns, templates in self.behaviors:
+            for tok in tokens:
+                if tok in t_lower:
+                    return random.choice(templates), {}
+            for rx in patterns:
+                mobj = rx.search(text)
+                if mobj:
+                    slots = {k: v for k, v in mobj.groupdict().items() if v is not None}
+                    return random.choice(templates), slots
+
+        # default heuristics
+        if sum(1 for c in text if c.isdigit()) >= 6:
+            return random.choice(_DIGIT_FALLBACKS), {}
+        if self.fallbacks:
+            return random.choice(self.fallbacks), {}
+        return "Okay.", {}
+
+
+class PersonaEntry:
+    __slots__ = ('id', 'path', 'mtime', 'persona', 'matcher')
+
+    def __init__(self, persona_id: str, path: Path, mtime: float, persona: Dict):
+        self.id = persona_id
+        self.path = path
+        self.mtime = mtime
+        self.persona = persona
+        self.matcher = PersonaMatcher(persona)
+
+
+class PersonaRegistry:
+    def __init__(self, persona_dir: Path = PERSONA_DIR, check_interval: float = RELOAD_CHECK_SECONDS, default_id: str = DEFAULT_PERSONA_ID):
+        self.persona_dir = Path(persona_dir)
+        self.check_interval = check_interval
+        self.default_id = default_id
+        self._by_id: Dict[str, PersonaEntry] = {}
+        self._by_path: Dict[Path, PersonaEntry] = {}
+        self._failed: Dict[Path, float] = {}
+        self._lock = threading.Lock()
+        self._last_check = None
+
+    def _load(self, path: Path, mtime: float) -> Optional[PersonaEntry]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                persona = json.load(f)
+            return PersonaEntry(persona.get('id') or path.stem, path, mtime, persona)
+        except Exception as e:
+            try:
+                append_event('persona_load_failed', {'file': str(path), 'error': str(e)})
+            except Exception:
+                pass
+            return None
+
+    def _refresh(self) -> None:
+        seen = set()
+        changed = False
+        for path in sorted(self.persona_dir.glob('*.json')):
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            seen.add(path)
+            cur = self._by_path.get(path)
+            if (cur is not None and cur.mtime == mtime) or self._failed.get(path) == mtime:
+                continue
+            entry = self._load(path, mtime)
+            if entry is None:
+                # don't retry (and re-log) the same broken file until it changes
+                self._failed[path] = mtime
+                continue
+            self._failed.pop(path, None)
+            self._by_path[path] = entry
+            changed = True
+        for path in [p for p in self._by_path if p not in seen]:
+            del self._by_path[path]
+            changed = True
+        if changed or self._last_check is None:
+            self._by_id = {e.id: e for e in self._by_path.values()}
+        self._last_check = time.monotonic()
+
+    def _maybe_refresh(self) -> None:
+        if self._last_check is not None and time.monotonic() - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if self._last_check is None or time.monotonic() - self._last_check >= self.check_interval:
+                self._refresh()
+
+    def reload(self) -> List[str]:
+        """Force a rescan of the persona directory; returns loaded persona ids."""
+        with self._lock:
+            self._refresh()
+            return sorted(self._by_id)
+
+    def ids(self) -> List[str]:
+        self._maybe_refresh()
+        return sorted(self._by_id)
+
+    def get(self, persona_id: Optional[str] = None) -> PersonaEntry:
+        """Return the entry for `persona_id`, falling back to the default persona."""
+        self._maybe_refresh()
+        entry = self._by_id.get(persona_id or self.default_id) or self._by_id.get(self.default_id)
+        if entry is None:
+            if not self._by_id:
+                raise LookupError(f'no personas found in {self.persona_dir}')
+            entry = self._by_id[sorted(self._by_id)[0]]
+        return entry
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> PersonaRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PersonaRegistry()
+    return _registry
@@ -1,36 +1,243 @@
-import time
-from collections import deque
+"""Per-API-key rate limiting.
+
+Both backends use a sliding-window counter: each key keeps the request count
+of the current fixed window and of the previous one, and the number of
+requests in the last `RATE_LIMIT_WINDOW` seconds is estimated as
+
+    prev * (1 - elapsed_in_current_window / window) + current
+
+That is O(1) state per key instead of one timestamp per request.
+
+`RATE_LIMIT_BACKEND` selects the implementation:
+
+- `memory` (default): per-process, with keys spread over `RATE_LIMIT_SHARDS`
+  independently locked shards.
+- `redis`: shared by all workers via an atomic Lua script on
+  `RATE_LIMIT_REDIS_URL` (default `REDIS_URL`). If Redis is unreachable
+  the process falls back to its in-memory limiter and does not dial Redis
+  again for `RATE_LIMIT_REDIS_RETRY_SECONDS`.
+
+Async routes use `is_allowed_async()`, which runs a Redis round trip in the
+default executor instead of on the event loop.
+"""
 import os
+import time
+import asyncio
+import zlib
 from threading import Lock
+from typing import Dict, List, Optional
+
+try:
+    import redis
+except Exception:
+    redis = None
 
-# Simple sliding window rate limiter per API key
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # seconds
 RATE_LIMIT_MAX = int(os.getenv("RATE_LIMIT_MAX", "60"))
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+RATE_LIMIT_REDIS_RETRY_SECONDS = float(os.getenv("RATE_LIMIT_REDIS_RETRY_SECONDS", "5"))
+
+
+class RateLimiter:
+    """Interface: `allow()` consumes one request, `usage()` only reports."""
+
+    window: int
+    limit: int
+    # True when allow()/usage() may block on network I/O
+    blocking = False
+
+    def allow(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def usage(self, key: str) -> dict:
+        raise NotImplementedError
+
+
+def _roll(state: List[float], window_start: float, window: int) -> None:
+    """Advance a [window_start, prev, cur] state to `window_start`."""
+    if state[0] == window_start:
+        return
+    state[1] = state[2] if state[0] == window_start - window else 0
+    state[2] = 0
+    state[0] = window_start
+
+
+def _estimate(state: List[float], now: float, window: int) -> float:
+    return state[1] * (1 - (now - state[0]) / window) + state[2]
+
+
+class _Shard:
+    __slots__ = ('lock', 'keys', 'inserts')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.keys: Dict[str, List[float]] = {}
+        self.inserts = 0
+
+
+class SlidingWindowLimiter(RateLimiter):
+    # drop idle keys from a shard every this many new keys
+    SWEEP_EVERY = 1024
 
-_lock = Lock()
-_buckets = {}  # api_key -> deque of timestamps
+    def __init__(self, window: int = RATE_LIMIT_WINDOW, limit: int = RATE_LIMIT_MAX, shards: int = RATE_LIMIT_SHARDS, clock=time.time):
+        self.window = max(1, window)
+        self.limit = limit
+        self._clock = clock
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[zlib.crc32(key.encode('utf-8')) % len(self._shards)]
+
+    def _sweep(self, shard: _Shard, window_start: float) -> None:
+        # keys whose current window ended before the previous one are idle
+        stale = [k for k, s in shard.keys.items() if s[0] < window_start - self.window]
+        for k in stale:
+            del shard.keys[k]
+
+    def allow(self, key: str) -> bool:
+        now = self._clock()
+        window_start = now - now % self.window
+        shard = self._shard(key)
+        with shard.lock:
+            state = shard.keys.get(key)
+            if state is None:
+                state = shard.keys[key] = [window_start, 0, 0]
+                shard.inserts += 1
+                if shard.inserts % self.SWEEP_EVERY == 0:
+                    self._sweep(shard, window_start)
+            _roll(state, window_start, self.window)
+            if _estimate(state, now, self.window) + 1 > self.limit:
+                return False
+            state[2] += 1
+            return True
+
+    def usage(self, key: str) -> dict:
+        now = self._clock()
+        window_start = now - now % self.window
+        shard = self._shard(key)
+        with shard.lock:
+            state = shard.keys.get(key)
+            count = 0
+            if state is not None:
+                state = list(state)
+                _roll(state, window_start, self.window)
+                count = int(_estimate(state, now, self.window))
+        return {"window_seconds": self.window, "count": count, "limit": self.limit}
+
+
+# KEYS[1] = counter hash; ARGV = window seconds, limit, consume (1/0).
+# Uses the Redis server clock so all workers agree on window boundaries.
+_SLIDING_WINDOW_LUA = """
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local consume = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local start = now - (now % window)
+local s = redis.call('HMGET', KEYS[1], 's', 'p', 'c')
+local prev = tonumber(s[2]) or 0
+local cur = tonumber(s[3]) or 0
+local old = tonumber(s[1])
+if old ~= start then
+  if old == start - window then prev = cur else prev = 0 end
+  cur = 0
+end
+local est = prev * (1 - (now - start) / window) + cur
+local allowed = 0
+if consume == 1 then
+  if est + 1 <= limit then
+    allowed = 1
+    cur = cur + 1
+    est = est + 1
+  end
+  redis.call('HSET', KEYS[1], 's', start, 'p', prev, 'c', cur)
+  redis.call('PEXPIRE', KEYS[1], window * 2000)
+end
+return {allowed, math.floor(est)}
+"""
+
+
+class _RedisDown(Exception):
+    pass
+
+
+class RedisRateLimiter(RateLimiter):
+    def __init__(self, url: str, window: int = RATE_LIMIT_WINDOW, limit: int = RATE_LIMIT_MAX, prefix: Optional[str] = None,
+                 fallback: Optional[RateLimiter] = None, retry_after: float = RATE_LIMIT_REDIS_RETRY_SECONDS, client=None, clock=time.monotonic):
+        self.window = max(1, window)
+        self.limit = limit
+        self.prefix = prefix if prefix is not None else os.getenv("RATE_LIMIT_KEY_PREFIX", "ratelimit:")
+        self._client = client if client is not None else redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._script = self._client.register_script(_SLIDING_WINDOW_LUA)
+        self._fallback = fallback or SlidingWindowLimiter(self.window, self.limit)
+        self.retry_after = retry_after
+        self._clock = clock
+        self._down_until = 0.0
+
+    @property
+    def blocking(self) -> bool:
+        # while backing off every call is served by the in-memory fallback
+        return self._clock() >= self._down_until
+
+    def _run(self, key: str, consume: bool):
+        if not self.blocking:
+            raise _RedisDown()
+        try:
+            allowed, count = self._script(keys=[self.prefix + key], args=[self.window, self.limit, 1 if consume else 0])
+        except Exception:
+            self._down_until = self._clock() + self.retry_after
+            raise
+        return bool(allowed), int(count)
+
+    def allow(self, key: str) -> bool:
+        try:
+            return self._run(key, True)[0]
+        except Exception:
+            return self._fallback.allow(key)
+
+    def usage(self, key: str) -> dict:
+        try:
+            count = self._run(key, False)[1]
+        except Exception:
+            return self._fallback.usage(key)
+        return {"window_seconds": self.window, "count": count, "limit": self.limit}
+
+
+def create_limiter() -> RateLimiter:
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
+    if backend == "redis":
+        url = os.getenv("RATE_LIMIT_REDIS_URL") or os.getenv("REDIS_URL")
+        if url and redis is not None:
+            try:
+                return RedisRateLimiter(url)
+            except Exception:
+                pass
+    return SlidingWindowLimiter()
+
+
+_limiter = None
+_limiter_lock = Lock()
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = create_limiter()
+    return _limiter
 
 
 def is_allowed(api_key: str) -> bool:
-    now = time.time()
-    with _lock:
-        dq = _buckets.get(api_key)
-        if dq is None:
-            dq = deque()
-            _buckets[api_key] = dq
-        # prune old
-        while dq and dq[0] < now - RATE_LIMIT_WINDOW:
-            dq.popleft()
-        if len(dq) >= RATE_LIMIT_MAX:
-            return False
-        dq.append(now)
-        return True
+    return get_limiter().allow(api_key)
+
+
+async def is_allowed_async(api_key: str) -> bool:
+    limiter = get_limiter()
+    if limiter.blocking:
+        return await asyncio.get_running_loop().run_in_executor(None, limiter.allow, api_key)
+    return limiter.allow(api_key)
 
 
 def get_usage(api_key: str) -> dict:
-    now = time.time()
-    with _lock:
-        dq = _buckets.get(api_key) or deque()
-        while dq and dq[0] < now - RATE_LIMIT_WINDOW:
-            dq.popleft()
-        return {"window_seconds": RATE_LIMIT_WINDOW, "count": len(dq), "limit": RATE_LIMIT_MAX}
+    return get_limiter().usage(api_key)
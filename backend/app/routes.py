@@ -1,20 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
-from .schemas import IngestRequest, IngestResponse
+from fastapi.encoders import jsonable_encoder
+from .schemas import IngestRequest, IngestResponse, BatchIngestRequest, BatchIngestResponse, IntelLookupRequest
 from .auth import require_api_key, require_admin_key
-from .detector import detect
-from .db import SessionLocal, init_db, Session as DBSess, Message as DBMessage, Extraction as DBExtraction, get_db
+from .detector import detect, detect_many
+from .db import SessionLocal, init_db, Session as DBSess, Message as DBMessage, Extraction as DBExtraction, get_db, get_async_db
+from .db import message_content_hash, insert_messages_ignore_duplicates, insert_incoming_message, pool_stats, AsyncSessionLocal
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from .audit import append_event
 from datetime import datetime
 from .circuit_breaker import outgoing_breaker
 import os
-from .rate_limit import is_allowed, get_usage
+from .rate_limit import is_allowed, is_allowed_async, get_usage
 from .callback_queue import enqueue
 import json
 import requests
 from .agent import respond as agent_respond
 from .db import OutgoingMessage as DBOutgoing
+from .outgoing_worker import notify_outgoing
 from typing import Optional
 from fastapi.responses import StreamingResponse
 import csv
@@ -22,6 +26,7 @@ from io import StringIO
 from backend.phase4.metrics import MESSAGES_TOTAL
 from backend.phase4.metrics import DETECTOR_INVOCATIONS
 from .sse_broker import get_broker
+from .live_events import publish_session_event
 from fastapi import Request, HTTPException
 import asyncio
 from jose import jwt as jose_jwt, JWTError as JoseJWTError
@@ -30,9 +35,18 @@ from fastapi.responses import JSONResponse
 from base64 import b64decode
 from typing import Tuple
 from .profiler import get_recent_slow_requests
+from .unit_of_work import commit_mode, get_committer
+from .persona_registry import get_registry
+from . import session_summary
+from . import extractions
+from . import intel_index
+from .session_summary import SummaryDelta
 
 router = APIRouter()
 
+# idle SSE streams send a comment line this often (keeps proxies from timing out)
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
 
 def _sse_defaults() -> tuple:
     """Return (history_limit, max_lifetime) for SSE streams.
@@ -67,49 +81,91 @@ def _sse_defaults() -> tuple:
         return (None, None)
 from .guvi_callback import send_guvi_callback
 
+def _publish_message(db, session_id: str, message) -> None:
+    """Publish an ingested message to the session's SSE channel once `db` commits."""
+    publish_session_event(db, session_id, {'type': 'message', 'sender': message.sender, 'text': message.text, 'timestamp': message.timestamp.isoformat() if message.timestamp else None})
+
+
+def _publish_extraction(db, session_id: str, kind: str, value: str) -> None:
+    publish_session_event(db, session_id, {'type': 'extraction', 'kind': kind, 'value': value})
+
+
 @router.get("/health")
 def health():
     return {"status": "ok"}
 
+async def _run_db(adb, fn, *args, **kwargs):
+    """Run sync `fn(db, *args, **kwargs)` without tying up a threadpool worker.
+
+    With an async engine the function runs through `AsyncSession.run_sync`,
+    so its queries go through the async driver on the event loop. Without
+    one (no aiosqlite/asyncpg installed) it runs in the threadpool with a
+    regular SessionLocal.
+    """
+    if adb is not None:
+        return await adb.run_sync(fn, *args, **kwargs)
+
+    def _call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+
+    return await run_in_threadpool(_call)
+
+
+def _merge_history(db: Session, session_id: str, history) -> list:
+    """Insert the history items not already stored, in one bulk statement.
+
+    Exact duplicates (same sender, text and timestamp) are skipped via the
+    (session_id, content_hash) unique index instead of one SELECT per item.
+    Returns the inserted rows.
+    """
+    rows = {}
+    for m in history:
+        h = message_content_hash(m.sender, m.text, m.timestamp)
+        if h not in rows:
+            rows[h] = {'session_id': session_id, 'sender': m.sender, 'text': m.text, 'timestamp': m.timestamp, 'raw': m.text, 'content_hash': h}
+    return insert_messages_ignore_duplicates(db, list(rows.values()))
+
+
 @router.post("/v1/message", response_model=IngestResponse)
-def ingest_message(payload: IngestRequest, db: Session = Depends(get_db), authorized: bool = Depends(require_api_key), background_tasks: BackgroundTasks = None):
-    # Ensure session exists
+async def ingest_message(payload: IngestRequest, adb=Depends(get_async_db), authorized: bool = Depends(require_api_key)):
     # rate limiting per API key
-    if not is_allowed(authorized):
+    if not await is_allowed_async(authorized):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    if commit_mode() != 'sync':
+        # group commit / write-behind: the committer owns the transaction
+        return await get_committer().run(_ingest_message, payload, commit=False)
+    return await _run_db(adb, _ingest_message, payload)
+
+
+def _ingest_message(db: Session, payload: IngestRequest, commit: bool = True):
+    """Persist one ingested message as a single unit of work.
+
+    Session, history, message, extraction and agent rows (agent message,
+    conversation state, outgoing row) are staged and flushed into one
+    transaction that is committed once at the end. With commit=False the
+    caller owns the transaction (see `unit_of_work.GroupCommitter`).
+    """
+    # Ensure session exists
     sess = db.query(DBSess).filter(DBSess.id == payload.sessionId).first()
     if not sess:
         sess = DBSess(id=payload.sessionId, metadata_json=json.dumps(payload.metadata or {}))
         db.add(sess)
-        db.commit()
-    # Merge any provided conversationHistory into DB (best-effort)
-    try:
-        if payload.conversationHistory:
-            for m in payload.conversationHistory:
-                # avoid exact-duplicate inserts by checking for same timestamp+text
-                exists = db.query(DBMessage).filter(DBMessage.session_id == payload.sessionId, DBMessage.sender == m.sender, DBMessage.text == m.text, DBMessage.timestamp == m.timestamp).first()
-                if not exists:
-                    hist_msg = DBMessage(session_id=payload.sessionId, sender=m.sender, text=m.text, timestamp=m.timestamp, raw=m.text)
-                    db.add(hist_msg)
-            db.commit()
-    except Exception:
-        try:
-            db.rollback()
-        except Exception:
-            pass
+    summary = SummaryDelta()
+    # Merge any provided conversationHistory into DB
+    if payload.conversationHistory:
+        for row in _merge_history(db, payload.sessionId, payload.conversationHistory):
+            summary.add_message(row['timestamp'])
     # store incoming message
-    msg = DBMessage(session_id=payload.sessionId, sender=payload.message.sender, text=payload.message.text, timestamp=payload.message.timestamp, raw=payload.message.text)
-    db.add(msg)
-    db.commit()
+    m = payload.message
+    insert_incoming_message(db, {'session_id': payload.sessionId, 'sender': m.sender, 'text': m.text, 'timestamp': m.timestamp, 'raw': m.text, 'content_hash': message_content_hash(m.sender, m.text, m.timestamp)})
+    summary.add_message(m.timestamp)
 
-    # publish to SSE broker so live UIs can receive updates
-    try:
-        broker = get_broker()
-        # publish payload.message as JSON minimal
-        import json as _json
-        asyncio.get_event_loop().create_task(broker.publish(f'session:{payload.sessionId}', _json.dumps({'sender': payload.message.sender, 'text': payload.message.text, 'timestamp': payload.message.timestamp.isoformat() if payload.message.timestamp else None})))
-    except Exception:
-        pass
+    # publish to SSE broker (on commit) so live UIs can receive updates
+    _publish_message(db, payload.sessionId, payload.message)
     try:
         MESSAGES_TOTAL.inc()
     except Exception:
@@ -124,17 +180,11 @@ def ingest_message(payload: IngestRequest, db: Session = Depends(get_db), author
     score = det["score"]
     route = score >= float(os.getenv("DETECTOR_THRESHOLD", 0.5))
 
-    # save extractions (simple)
-    for p in det["matches"].get("phones", []):
-        ex = DBExtraction(session_id=payload.sessionId, type="phone", value=p, confidence=0.9)
-        db.add(ex)
-    for u in det["matches"].get("upis", []):
-        ex = DBExtraction(session_id=payload.sessionId, type="upi", value=u, confidence=0.9)
-        db.add(ex)
-    for u in det["matches"].get("urls", []):
-        ex = DBExtraction(session_id=payload.sessionId, type="url", value=u, confidence=0.8)
-        db.add(ex)
-    db.commit()
+    # save extractions (one row per canonical value, repeats bump its count)
+    for ex in extractions.upsert(db, extractions.from_matches(payload.sessionId, det["matches"])):
+        summary.add_extraction(ex['type'], ex['canonical_value'])
+        _publish_extraction(db, payload.sessionId, ex['type'], ex['canonical_value'])
+    session_summary.record(db, payload.sessionId, summary)
 
     # audit event
     try:
@@ -151,11 +201,14 @@ def ingest_message(payload: IngestRequest, db: Session = Depends(get_db), author
             if cs and cs.human_override:
                 append_event('agent_skipped_human_override', {'sessionId': payload.sessionId})
             else:
-                # auto-respond using agent and persist agent message
+                # auto-respond using agent and persist agent message; the turn
+                # runs in a SAVEPOINT so a failed turn loses only the reply,
+                # not the ingest staged above
                 try:
                     # prefer persona set on session if available
                     persona_id = getattr(sess, 'persona', None) or None
-                    resp = agent_respond(payload.sessionId, payload.message.text, db, persona_id or 'honeypot_default', background_tasks=background_tasks)
+                    with db.begin_nested():
+                        resp = agent_respond(payload.sessionId, payload.message.text, db, persona_id or 'honeypot_default', commit=False)
                     agent_reply = resp.get('reply')
                     append_event('agent_auto_reply', {'sessionId': payload.sessionId, 'reply': agent_reply})
                 except Exception:
@@ -163,9 +216,98 @@ def ingest_message(payload: IngestRequest, db: Session = Depends(get_db), author
         except Exception:
             pass
 
+    if commit:
+        db.commit()
+
     return IngestResponse(scamProbability=score, routeToAgent=route, sessionId=payload.sessionId, reasons=det["reasons"]) if not agent_reply else {"scamProbability": score, "routeToAgent": route, "sessionId": payload.sessionId, "reasons": det["reasons"], "agentReply": agent_reply}
 
 
+@router.post("/v1/messages:batch", response_model=BatchIngestResponse)
+def ingest_messages_batch(payload: BatchIngestRequest, db: Session = Depends(get_db), authorized: bool = Depends(require_api_key)):
+    """Ingest many messages in one round trip.
+
+    Missing sessions are created with one lookup, Message and Extraction rows
+    are written with one bulk insert per table and the batch commits once.
+    Messages already stored for their session (same sender, text and
+    timestamp) are skipped, as in the history merge.
+    Results are returned in request order. Agent auto-replies and
+    conversationHistory merging stay on the single-message endpoint.
+    """
+    if not is_allowed(authorized):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    items = payload.messages
+    max_items = int(os.getenv("INGEST_BATCH_MAX", "500"))
+    if len(items) > max_items:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {max_items})")
+    if not items:
+        return BatchIngestResponse(results=[])
+
+    dets = detect_many([it.message.text for it in items])
+    threshold = float(os.getenv("DETECTOR_THRESHOLD", 0.5))
+
+    # create missing sessions (first item for a session supplies its metadata)
+    session_ids = list(dict.fromkeys(it.sessionId for it in items))
+    existing = {r[0] for r in db.query(DBSess.id).filter(DBSess.id.in_(session_ids)).all()}
+    new_sessions = {}
+    for it in items:
+        if it.sessionId not in existing and it.sessionId not in new_sessions:
+            new_sessions[it.sessionId] = {'id': it.sessionId, 'metadata_json': json.dumps(it.metadata or {}), 'created_at': datetime.utcnow()}
+
+    # keyed like the history merge, so a message is stored once whichever
+    # path (batch, message, conversationHistory) delivers it first
+    message_rows = {}
+    item_keys = []
+    for it in items:
+        m = it.message
+        h = message_content_hash(m.sender, m.text, m.timestamp)
+        item_keys.append((it.sessionId, h))
+        message_rows.setdefault((it.sessionId, h), {'session_id': it.sessionId, 'sender': m.sender, 'text': m.text, 'timestamp': m.timestamp, 'raw': m.text, 'content_hash': h})
+
+    try:
+        if new_sessions:
+            db.bulk_insert_mappings(DBSess, list(new_sessions.values()))
+        inserted = {(r['session_id'], r['content_hash']) for r in insert_messages_ignore_duplicates(db, list(message_rows.values()))}
+        # repeats of stored messages add neither messages nor extractions
+        extraction_rows = []
+        summaries = {}
+        stored = set()
+        for i, (it, det, key) in enumerate(zip(items, dets, item_keys)):
+            if key not in inserted:
+                continue
+            inserted.discard(key)
+            stored.add(i)
+            delta = summaries.setdefault(it.sessionId, SummaryDelta()).add_message(it.message.timestamp)
+            for ex in extractions.from_matches(it.sessionId, det["matches"]):
+                extraction_rows.append(ex)
+                delta.add_extraction(ex['type'], ex['canonical_value'])
+        extractions.upsert(db, extraction_rows)
+        session_summary.record_many(db, summaries)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise HTTPException(status_code=500, detail="batch_persist_failed")
+
+    try:
+        MESSAGES_TOTAL.inc(len(items))
+        DETECTOR_INVOCATIONS.inc(len(items))
+    except Exception:
+        pass
+
+    results = []
+    for i, (it, det) in enumerate(zip(items, dets)):
+        if i in stored:
+            # already committed: publish now
+            _publish_message(None, it.sessionId, it.message)
+            for ex in extractions.from_matches(it.sessionId, det["matches"]):
+                _publish_extraction(None, it.sessionId, ex['type'], ex['canonical_value'])
+        try:
+            append_event("ingest_message", {"sessionId": it.sessionId, "score": det["score"], "reasons": det.get("reasons", []), "batch": True})
+        except Exception:
+            pass
+        results.append(IngestResponse(scamProbability=det["score"], routeToAgent=det["score"] >= threshold, sessionId=it.sessionId, reasons=det["reasons"]))
+    return BatchIngestResponse(results=results)
+
+
 @router.post("/v1/admin/override-session")
 def override_session(data: dict, db: Session = Depends(get_db), admin: bool = Depends(require_admin_key)):
     session_id = data.get('sessionId')
@@ -183,32 +325,68 @@ def override_session(data: dict, db: Session = Depends(get_db), admin: bool = De
     append_event('override_set', {'sessionId': session_id, 'enabled': bool(enable)})
     return {'status': 'ok', 'sessionId': session_id, 'human_override': bool(enable)}
 
+@router.post("/v1/admin/personas/reload")
+def reload_personas(admin: bool = Depends(require_admin_key)):
+    personas = get_registry().reload()
+    append_event('personas_reloaded', {'personas': personas})
+    return {'status': 'ok', 'personas': personas}
+
+
+@router.post("/v1/admin/rebuild-session-summary")
+def rebuild_session_summary(data: dict, db: Session = Depends(get_db), admin: bool = Depends(require_admin_key)):
+    """Recompute a session's summary from a full scan; reports what was stale."""
+    session_id = data.get('sessionId')
+    if not session_id:
+        raise HTTPException(status_code=400, detail="sessionId required")
+    mismatches = session_summary.verify(db, session_id)
+    if data.get('dryRun'):
+        return {'status': 'ok', 'sessionId': session_id, 'mismatches': jsonable_encoder(mismatches), 'rebuilt': False}
+    session_summary.rebuild(db, session_id)
+    db.commit()
+    append_event('session_summary_rebuilt', {'sessionId': session_id, 'mismatched': sorted(mismatches)})
+    return {'status': 'ok', 'sessionId': session_id, 'mismatches': jsonable_encoder(mismatches), 'rebuilt': True}
+
+
+def _check_intel_type(type_: Optional[str]) -> None:
+    if type_ is not None and type_ not in intel_index.TYPES:
+        raise HTTPException(status_code=400, detail=f"type must be one of {', '.join(intel_index.TYPES)}")
+
+
+@router.get("/v1/admin/intel/lookup")
+async def intel_lookup(value: str, type: Optional[str] = None, adb=Depends(get_async_db), admin: bool = Depends(require_admin_key)):
+    """Sessions in which `value` (a phone, UPI id or URL, in any spelling) was extracted."""
+    _check_intel_type(type)
+    res = await _run_db(adb, intel_index.lookup, value, type)
+    return dict({'status': 'ok'}, **res)
+
+
+@router.post("/v1/admin/intel/lookup:bulk")
+async def intel_lookup_bulk(payload: IntelLookupRequest, adb=Depends(get_async_db), admin: bool = Depends(require_admin_key)):
+    """`intel_lookup` for many values with one index scan; results in request order."""
+    _check_intel_type(payload.type)
+    if len(payload.values) > intel_index.BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many values (max {intel_index.BATCH_MAX})")
+    results = await _run_db(adb, intel_index.lookup_many, payload.values, payload.type)
+    return {'status': 'ok', 'results': results}
+
+
 @router.post("/v1/admin/terminate-session")
-def terminate_session(data: dict, background_tasks: BackgroundTasks, db: Session = Depends(get_db), admin: bool = Depends(require_admin_key)):
+def terminate_session(data: dict, db: Session = Depends(get_db), admin: bool = Depends(require_admin_key)):
     session_id = data.get("sessionId")
     if not session_id:
         raise HTTPException(status_code=400, detail="sessionId required")
-    # Build payload from DB
-    messages = db.query(DBMessage).filter(DBMessage.session_id == session_id).all()
-    extractions = db.query(DBExtraction).filter(DBExtraction.session_id == session_id).all()
-    extracted = {"bankAccounts": [], "upiIds": [], "phishingLinks": [], "phoneNumbers": [], "suspiciousKeywords": []}
-    for e in extractions:
-        if e.type == "phone":
-            extracted["phoneNumbers"].append(e.value)
-        if e.type == "upi":
-            extracted["upiIds"].append(e.value)
-        if e.type == "url":
-            extracted["phishingLinks"].append(e.value)
-    total_messages = len(messages)
+    # Build payload from the session summary
+    summary = session_summary.get(db, session_id)
+    total_messages = summary.message_count or 0
     guvi_payload = {
         "sessionId": session_id,
         "scamDetected": True,
         "totalMessagesExchanged": total_messages,
-        "extractedIntelligence": extracted,
+        "extractedIntelligence": session_summary.extracted_intelligence(summary),
         "agentNotes": "Auto-terminated by admin"
     }
-    # schedule background callback with retries
-    background_tasks.add_task(send_guvi_callback, guvi_payload)
+    # schedule callback with retries on the async sender
+    send_guvi_callback(guvi_payload)
     append_event("terminate_scheduled", {"sessionId": session_id, "messages": total_messages})
     return {"status": "scheduled"}
 
@@ -239,7 +417,8 @@ def list_outgoing(status: Optional[str] = None, q: Optional[str] = None, page: i
     rows = qdb.order_by(DBOutgoing.created_at.desc()).offset(offset).limit(page_size).all()
     res = {'total': total, 'page': page, 'page_size': page_size, 'items': []}
     for r in rows:
-        res['items'].append({'id': r.id, 'sessionId': r.session_id, 'content': r.content, 'status': r.status, 'created_at': r.created_at.isoformat() if r.created_at else None})
+        res['items'].append({'id': r.id, 'sessionId': r.session_id, 'content': r.content, 'status': r.status, 'created_at': r.created_at.isoformat() if r.created_at else None,
+                             'attempts': r.attempts or 0, 'next_attempt_at': r.next_attempt_at.isoformat() if r.next_attempt_at else None})
     return res
 
 
@@ -249,8 +428,13 @@ def retry_outgoing(msg_id: int, db: Session = Depends(get_db), admin: bool = Dep
     if not row:
         raise HTTPException(status_code=404, detail='not found')
     row.status = 'queued'
+    row.attempts = 0
+    row.next_attempt_at = datetime.utcnow()
+    row.claimed_by = None
+    row.lease_until = None
     db.add(row)
     db.commit()
+    notify_outgoing()
     append_event('outgoing_retry', {'id': msg_id})
     return {'status': 'queued', 'id': msg_id}
 
@@ -362,7 +546,11 @@ def admin_outgoing_ui():
 
 
 @router.get('/admin/ui/sessions')
-def admin_ui_sessions(db: Session = Depends(get_db), admin: bool = Depends(require_admin_key)):
+async def admin_ui_sessions(adb=Depends(get_async_db), admin: bool = Depends(require_admin_key)):
+    return await _run_db(adb, _admin_ui_sessions)
+
+
+def _admin_ui_sessions(db: Session):
     rows = db.query(DBSess).order_by(DBSess.created_at.desc()).limit(200).all()
     out = []
     for r in rows:
@@ -375,16 +563,25 @@ def admin_ui_sessions(db: Session = Depends(get_db), admin: bool = Depends(requi
 
 
 @router.get('/admin/ui/session/{session_id}')
-def admin_ui_session(session_id: str, db: Session = Depends(get_db), admin: bool = Depends(require_admin_key)):
+async def admin_ui_session(session_id: str, adb=Depends(get_async_db), admin: bool = Depends(require_admin_key)):
+    res = await _run_db(adb, _admin_ui_session, session_id)
+    if res is None:
+        raise HTTPException(status_code=404, detail='session not found')
+    return res
+
+
+def _admin_ui_session(db: Session, session_id: str):
     sess = db.query(DBSess).filter(DBSess.id == session_id).first()
     if not sess:
-        raise HTTPException(status_code=404, detail='session not found')
+        return None
     messages = db.query(DBMessage).filter(DBMessage.session_id == session_id).order_by(DBMessage.timestamp).all()
     extractions = db.query(DBExtraction).filter(DBExtraction.session_id == session_id).all()
     return {
         'session': {'id': sess.id, 'persona': sess.persona, 'metadata': sess.metadata_json, 'created_at': sess.created_at.isoformat() if sess.created_at else None},
         'messages': [{'id': m.id, 'sender': m.sender, 'text': m.text, 'timestamp': m.timestamp.isoformat() if m.timestamp else None} for m in messages],
-        'extractions': [{'id': e.id, 'type': e.type, 'value': e.value, 'confidence': e.confidence} for e in extractions]
+        'extractions': [{'id': e.id, 'type': e.type, 'value': e.value, 'canonical_value': e.canonical_value, 'confidence': e.confidence,
+                         'count': e.count, 'first_seen': e.first_seen.isoformat() if e.first_seen else None,
+                         'last_seen': e.last_seen.isoformat() if e.last_seen else None} for e in extractions]
     }
 
 
@@ -413,29 +610,17 @@ def admin_ui_session_export_csv(session_id: str, db: Session = Depends(get_db),
 
 
 @router.get('/v1/session/{session_id}/result')
-def session_result(session_id: str, db: Session = Depends(get_db), authorized: bool = Depends(require_api_key)):
+async def session_result(session_id: str, adb=Depends(get_async_db), authorized: bool = Depends(require_api_key)):
+    return await _run_db(adb, _session_result, session_id)
+
+
+def _session_result(db: Session, session_id: str):
     # Build structured intelligence and engagement metrics for a session
-    messages = db.query(DBMessage).filter(DBMessage.session_id == session_id).order_by(DBMessage.timestamp).all()
-    extractions = db.query(DBExtraction).filter(DBExtraction.session_id == session_id).all()
-    extracted = {"bankAccounts": [], "upiIds": [], "phishingLinks": [], "phoneNumbers": [], "suspiciousKeywords": []}
-    for e in extractions:
-        if e.type == "phone":
-            extracted["phoneNumbers"].append(e.value)
-        if e.type == "upi":
-            extracted["upiIds"].append(e.value)
-        if e.type == "url":
-            extracted["phishingLinks"].append(e.value)
-
-    total_messages = len(messages)
-    engagement_seconds = 0
-    if total_messages >= 2:
-        try:
-            first = messages[0].timestamp
-            last = messages[-1].timestamp
-            if first and last:
-                engagement_seconds = int((last - first).total_seconds())
-        except Exception:
-            engagement_seconds = 0
+    # from its summary row (O(1), no Message/Extraction scan)
+    summary = session_summary.get(db, session_id)
+    extracted = session_summary.extracted_intelligence(summary)
+    total_messages = summary.message_count or 0
+    engagement_seconds = session_summary.engagement_seconds(summary)
 
     # agent notes from conversation state
     agent_notes = None
@@ -447,7 +632,7 @@ def session_result(session_id: str, db: Session = Depends(get_db), authorized: b
     except Exception:
         agent_notes = None
 
-    scam_detected = bool(extractions) or any((m.sender == 'agent') for m in messages)
+    scam_detected = bool(summary.scam_detected)
 
     return {
         "status": "success",
@@ -458,8 +643,30 @@ def session_result(session_id: str, db: Session = Depends(get_db), authorized: b
     }
 
 
+async def _run_short_db(fn, *args, **kwargs):
+    """Like `_run_db`, but with a session opened and closed around the call.
+
+    For long-lived responses (SSE) that must not hold a pooled connection
+    through a request-scoped dependency.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as adb:
+            return await adb.run_sync(fn, *args, **kwargs)
+    return await _run_db(None, fn, *args, **kwargs)
+
+
+def _sse_history(db: Session, session_id: str, limit: Optional[int] = None) -> list:
+    """Stored messages of a session as SSE payloads, oldest first."""
+    q = db.query(DBMessage).filter(DBMessage.session_id == session_id).order_by(DBMessage.timestamp.desc())
+    if limit:
+        q = q.limit(limit)
+    # rows are newest-first; send them oldest-first to preserve chronology
+    return [{'type': 'message', 'id': r.id, 'sender': r.sender, 'text': r.text, 'timestamp': r.timestamp.isoformat() if r.timestamp else None}
+            for r in reversed(q.all())]
+
+
 @router.get('/admin/ui/sse/session/{session_id}')
-async def admin_ui_sse_session(session_id: str, request: Request, db: Session = Depends(get_db)):
+async def admin_ui_sse_session(session_id: str, request: Request):
     # accept either admin API key (dev) or a short-lived JWT token via `token` query param
     api_key = request.headers.get('x-api-key')
     token = request.query_params.get('token')
@@ -484,83 +691,67 @@ async def admin_ui_sse_session(session_id: str, request: Request, db: Session =
     # subscribe to broker channel for this session
     broker = get_broker()
 
-    async def event_generator():
-        # first, yield existing messages once (yield bytes and give control to event loop)
-        # yield a limited set of historical messages (most recent first) when configured,
-        # otherwise in production return full history. Defaults are environment-specific
-        # and come from `_sse_defaults()` (CI/test get conservative defaults).
-        limit, max_lifetime = _sse_defaults()
-        if limit:
-            rows = db.query(DBMessage).filter(DBMessage.session_id == session_id).order_by(DBMessage.timestamp.desc()).limit(limit).all()
-        else:
-            rows = db.query(DBMessage).filter(DBMessage.session_id == session_id).order_by(DBMessage.timestamp.desc()).all()
-        # rows are newest-first; send them oldest-first to preserve chronology
-        rows = list(reversed(rows))
-        for r in rows:
-            data = {'type': 'message', 'id': r.id, 'sender': r.sender, 'text': r.text, 'timestamp': r.timestamp.isoformat() if r.timestamp else None}
-            chunk = (f"data: {json.dumps(data)}\n\n").encode('utf-8')
-            yield chunk
-            try:
-                await asyncio.sleep(0)
-            except Exception:
-                pass
+    # EventSource resends the id of the last event it saw on reconnect
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('lastEventId')
 
-        # then stream pubsub messages
+    async def event_generator():
         chan = f'session:{session_id}'
-        # send an initial heartbeat so clients get something immediately
-        try:
-            heartbeat = (": ping\n\n").encode('utf-8')
-            yield heartbeat
-            try:
-                await asyncio.sleep(0)
-            except Exception:
-                pass
-        except Exception:
-            pass
-
-        # proceed to streaming pubsub messages using non-blocking get_message
-        start_time = asyncio.get_event_loop().time()
+        heartbeat = b": ping\n\n"
+        limit, max_lifetime = _sse_defaults()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_lifetime if max_lifetime is not None else None
         try:
-            while True:
-                if await request.is_disconnected():
-                    break
-                # stop streaming after configured lifetime to avoid long-running tests
-                if max_lifetime is not None and asyncio.get_event_loop().time() - start_time > max_lifetime:
-                    break
-                try:
-                    # Prefer broker.get_message which returns None on timeout
-                    msg = None
-                    try:
-                        msg = await broker.get_message(chan, timeout=1.0)
-                    except AttributeError:
-                        # older broker implementations may not have get_message
-                        # fall back to a short subscribe iteration
-                        async for m in broker.subscribe(chan):
-                            msg = m
+            async with broker.subscribe(chan, last_event_id) as sub:
+                if sub.backlog is not None:
+                    # reconnect inside the replay ring: send only what was missed
+                    for ev in sub.backlog:
+                        yield (f"id: {ev.id}\ndata: {ev.data}\n\n").encode('utf-8')
+                else:
+                    # first connect (or a gap the ring cannot cover): history from
+                    # the DB, limited when configured. Defaults are environment-specific
+                    # and come from `_sse_defaults()` (CI/test get conservative defaults).
+                    # The session is released before the first byte is streamed.
+                    for data in await _run_short_db(_sse_history, session_id, limit):
+                        yield (f"data: {json.dumps(data)}\n\n").encode('utf-8')
+                        await asyncio.sleep(0)
+                    # checkpoint: a reconnect resumes from here via the ring
+                    yield (f"id: {sub.cursor}\n\n").encode('utf-8')
+                # send an initial heartbeat so clients get something immediately
+                yield heartbeat
+
+                # then stream pubsub messages as they are pushed; when idle the
+                # generator sleeps until a message or the next heartbeat is due
+                while True:
+                    wait = SSE_HEARTBEAT_SECONDS
+                    if deadline is not None:
+                        # stop streaming after configured lifetime to avoid long-running tests
+                        wait = min(wait, deadline - loop.time())
+                        if wait <= 0:
                             break
-
-                    if msg is None:
-                        # no message this interval; continue to check disconnect
-                        continue
-
-                    # msg may be JSON text
-                    chunk = (f"data: {msg}\n\n").encode('utf-8')
-                    yield chunk
                     try:
-                        await asyncio.sleep(0)
-                    except Exception:
-                        pass
-                except asyncio.CancelledError:
-                    break
-                except Exception:
-                    # swallow errors and continue streaming
-                    continue
+                        ev = await sub.get(timeout=wait)
+                    except StopAsyncIteration:
+                        # dropped as a slow consumer; the client reconnects
+                        break
+                    if await request.is_disconnected():
+                        break
+                    if ev is None:
+                        yield heartbeat
+                        continue
+                    # ev.data may be JSON text
+                    yield (f"id: {ev.id}\ndata: {ev.data}\n\n").encode('utf-8')
         except asyncio.CancelledError:
             return
 
     return StreamingResponse(event_generator(), media_type='text/event-stream')
 
 
+@router.get('/admin/ui/db-pool')
+def admin_ui_db_pool(admin: bool = Depends(require_admin_key)):
+    """Connections each engine has checked out now and in total."""
+    return pool_stats()
+
+
 @router.get('/admin/ui/slow-requests')
 def admin_ui_slow_requests(limit: int = 50, admin: bool = Depends(require_admin_key)):
     """Admin-only endpoint returning recent slow requests recorded by profiler."""
@@ -20,3 +20,17 @@ class IngestResponse(BaseModel):
     routeToAgent: bool = False
     sessionId: str
     reasons: Optional[List[str]] = []
+
+
+class BatchIngestRequest(BaseModel):
+    messages: List[IngestRequest]
+
+
+class BatchIngestResponse(BaseModel):
+    status: str = "success"
+    results: List[IngestResponse] = []
+
+
+class IntelLookupRequest(BaseModel):
+    values: List[str]
+    type: Optional[str] = None
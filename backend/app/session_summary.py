@@ -0,0 +1,199 @@
+"""Materialized per-session aggregates.
+
+`session_summary` holds what the result endpoint, terminate-session and the
+agent's completion callback need (message count, first/last message time,
+distinct canonical extraction values per type, scam flag) so they read one
+row instead of scanning every Message and Extraction of the session.
+
+Writers call `record()` / `record_many()` in the same transaction as the rows
+they insert, after those rows are flushed. A session without a summary row
+(new, or older than this table) is built from a full scan on its first write;
+`rebuild()` and `verify()` expose the same scan for repair and checks.
+"""
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+
+from .db import SessionSummary, Message as DBMessage, Extraction as DBExtraction
+
+# extraction type -> key in the `extractedIntelligence` payload
+INTEL_KEYS = {'phone': 'phoneNumbers', 'upi': 'upiIds', 'url': 'phishingLinks'}
+
+
+def _naive(ts):
+    # stored timestamps are wall time without tzinfo (see db.message_content_hash)
+    if ts is not None and ts.tzinfo is not None:
+        return ts.replace(tzinfo=None)
+    return ts
+
+
+def _load_intel(raw: Optional[str]) -> Dict[str, List[str]]:
+    try:
+        return json.loads(raw) if raw else {}
+    except Exception:
+        return {}
+
+
+class SummaryDelta:
+    """Rows one unit of work added to a session."""
+    __slots__ = ('timestamps', 'extractions', 'agent')
+
+    def __init__(self):
+        self.timestamps = []
+        self.extractions = []
+        self.agent = False
+
+    def add_message(self, timestamp, agent: bool = False) -> 'SummaryDelta':
+        self.timestamps.append(_naive(timestamp))
+        self.agent = self.agent or agent
+        return self
+
+    def add_extraction(self, type_: str, value: str) -> 'SummaryDelta':
+        self.extractions.append((type_, value))
+        return self
+
+
+def _apply(row: SessionSummary, delta: SummaryDelta) -> None:
+    row.message_count = (row.message_count or 0) + len(delta.timestamps)
+    for ts in delta.timestamps:
+        if ts is None:
+            continue
+        if row.first_ts is None or ts < row.first_ts:
+            row.first_ts = ts
+        if row.last_ts is None or ts > row.last_ts:
+            row.last_ts = ts
+    if delta.extractions:
+        intel = _load_intel(row.extractions_json)
+        changed = False
+        for type_, value in delta.extractions:
+            values = intel.setdefault(type_, [])
+            if value not in values:
+                values.append(value)
+                changed = True
+        if changed:
+            row.extractions_json = json.dumps(intel)
+    if delta.agent or delta.extractions:
+        row.scam_detected = True
+    row.updated_at = datetime.utcnow()
+
+
+def scan(db, session_id: str) -> SessionSummary:
+    """Compute a (transient) summary from the session's Message/Extraction rows."""
+    count, first_ts, last_ts = db.query(
+        func.count(DBMessage.id), func.min(DBMessage.timestamp), func.max(DBMessage.timestamp)
+    ).filter(DBMessage.session_id == session_id).one()
+    has_agent = db.query(DBMessage.id).filter(DBMessage.session_id == session_id, DBMessage.sender == 'agent').first() is not None
+    intel: Dict[str, List[str]] = {}
+    for type_, value in db.query(DBExtraction.type, func.coalesce(DBExtraction.canonical_value, DBExtraction.value)).filter(DBExtraction.session_id == session_id).order_by(DBExtraction.id):
+        values = intel.setdefault(type_, [])
+        if value not in values:
+            values.append(value)
+    return SessionSummary(
+        session_id=session_id,
+        message_count=count or 0,
+        first_ts=_naive(first_ts),
+        last_ts=_naive(last_ts),
+        extractions_json=json.dumps(intel),
+        scam_detected=bool(intel) or has_agent,
+        updated_at=datetime.utcnow(),
+    )
+
+
+def _insert_scanned(db, row: SessionSummary) -> bool:
+    """Insert a scanned summary unless one exists by now; True if inserted.
+
+    FOR UPDATE cannot lock a row that is not there yet, so two first writes
+    of one session may both get here; the loser must not fail on the key.
+    """
+    values = {c.name: getattr(row, c.name) for c in SessionSummary.__table__.columns}
+    dialect = db.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(SessionSummary.__table__).values(**values).on_conflict_do_nothing(index_elements=['session_id'])
+        return db.execute(stmt).rowcount == 1
+    try:
+        with db.begin_nested():
+            db.execute(insert(SessionSummary.__table__).values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+def record_many(db, deltas: Dict[str, SummaryDelta]) -> None:
+    """Fold per-session deltas into their summary rows (one SELECT for all)."""
+    if not deltas:
+        return
+    query = db.query(SessionSummary).with_for_update()
+    rows = {s.session_id: s for s in query.filter(SessionSummary.session_id.in_(list(deltas))).all()}
+    raced = []
+    for session_id, delta in deltas.items():
+        row = rows.get(session_id)
+        if row is None:
+            # the scan already sees the rows this unit flushed, so the delta
+            # must not be applied on top of it
+            if not _insert_scanned(db, scan(db, session_id)):
+                raced.append(session_id)
+        else:
+            _apply(row, delta)
+    if raced:
+        # a concurrent writer created these rows first: lock and apply as usual
+        for row in query.filter(SessionSummary.session_id.in_(raced)).all():
+            _apply(row, deltas[row.session_id])
+    db.flush()
+
+
+def record(db, session_id: str, delta: SummaryDelta) -> None:
+    record_many(db, {session_id: delta})
+
+
+def get(db, session_id: str) -> SessionSummary:
+    """Return the stored summary, or a scanned one if the session has none yet."""
+    row = db.query(SessionSummary).filter(SessionSummary.session_id == session_id).first()
+    return row if row is not None else scan(db, session_id)
+
+
+def rebuild(db, session_id: str) -> SessionSummary:
+    """Recompute the session's summary from a full scan and stage it."""
+    return db.merge(scan(db, session_id))
+
+
+def verify(db, session_id: str) -> Dict[str, Dict]:
+    """Compare the stored summary against a full scan; returns mismatched fields."""
+    stored = db.query(SessionSummary).filter(SessionSummary.session_id == session_id).first()
+    expected = scan(db, session_id)
+    if stored is None:
+        return {'row': {'stored': None, 'expected': 'present'}}
+    mismatches = {}
+    for field in ('message_count', 'first_ts', 'last_ts', 'scam_detected'):
+        a, b = getattr(stored, field), getattr(expected, field)
+        if a != b:
+            mismatches[field] = {'stored': a, 'expected': b}
+    a = {k: sorted(v) for k, v in _load_intel(stored.extractions_json).items()}
+    b = {k: sorted(v) for k, v in _load_intel(expected.extractions_json).items()}
+    if a != b:
+        mismatches['extractions'] = {'stored': a, 'expected': b}
+    return mismatches
+
+
+def extracted_intelligence(summary: SessionSummary) -> Dict[str, List[str]]:
+    extracted = {"bankAccounts": [], "upiIds": [], "phishingLinks": [], "phoneNumbers": [], "suspiciousKeywords": []}
+    for type_, values in _load_intel(summary.extractions_json).items():
+        key = INTEL_KEYS.get(type_)
+        if key:
+            extracted[key] = list(values)
+    return extracted
+
+
+def engagement_seconds(summary: SessionSummary) -> int:
+    if (summary.message_count or 0) < 2 or summary.first_ts is None or summary.last_ts is None:
+        return 0
+    try:
+        return int((summary.last_ts - summary.first_ts).total_seconds())
+    except Exception:
+        return 0
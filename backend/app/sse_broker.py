@@ -1,52 +1,250 @@
+"""Publish/subscribe for live session views (SSE).
+
+Every viewer gets its own `Subscription` with a bounded queue
+(`SSE_SUBSCRIBER_QUEUE` messages), so two dashboards on one session each see
+every message. A viewer that falls that far behind is dropped: its
+subscription ends and the client reconnects, instead of buffering without
+limit or slowing delivery to everyone else.
+
+`RedisBroker` keeps a single upstream pubsub connection per process,
+pattern-subscribed to `SSE_REDIS_PATTERN` (default `session:*`) while it has
+at least one local subscriber, and fans each message out to the local
+subscribers of its channel. Connection count to Redis therefore stays at one
+however many viewers are attached. When the last subscriber leaves the
+pattern subscription and the reader task are torn down (after
+`SSE_REPLAY_GRACE` seconds, so a reconnecting viewer finds its replay ring
+intact).
+
+Every published message gets an event id `<epoch>.<seq>`: `seq` is a
+per-process counter and `epoch` identifies the broker instance, so ids from
+before a restart are recognised as unknown. Each watched channel keeps the
+last `SSE_REPLAY_SIZE` events in a ring. `subscribe(channel, last_event_id)`
+returns the events after `last_event_id` as `Subscription.backlog`, or None
+when the ring cannot prove nothing was missed (unknown epoch, or the ring
+already dropped events after that id); callers then fall back to the DB.
+"""
 import os
+import uuid
 import asyncio
-from typing import AsyncIterator
+import logging
+from collections import OrderedDict, deque, namedtuple
+from typing import Dict, List, Optional, Set
 
 try:
     import redis.asyncio as aioredis
 except Exception:
     aioredis = None
 
+logger = logging.getLogger(__name__)
 
-class MemoryBroker:
-    def __init__(self):
-        self.channels = {}
+SUBSCRIBER_QUEUE = int(os.getenv('SSE_SUBSCRIBER_QUEUE', '100'))
+REDIS_PATTERN = os.getenv('SSE_REDIS_PATTERN', 'session:*')
+REPLAY_SIZE = int(os.getenv('SSE_REPLAY_SIZE', '256'))
+REPLAY_CHANNELS = int(os.getenv('SSE_REPLAY_CHANNELS', '1024'))
+REPLAY_GRACE = float(os.getenv('SSE_REPLAY_GRACE', '60'))
 
-    async def publish(self, channel: str, message: str):
-        q = self.channels.get(channel)
-        if q:
-            await q.put(message)
+_CLOSED = object()
 
-    async def subscribe(self, channel: str) -> AsyncIterator[str]:
-        q = asyncio.Queue()
-        self.channels.setdefault(channel, q)
-        try:
-            while True:
-                # wait with timeout to avoid blocking forever
-                try:
-                    msg = await asyncio.wait_for(q.get(), timeout=1.0)
-                    yield msg
-                except asyncio.TimeoutError:
-                    # no message; yield control back to caller loop
-                    await asyncio.sleep(0)
-                    continue
-        finally:
-            # best-effort cleanup
-            pass
+Event = namedtuple('Event', 'id data')
+
+
+class _Ring:
+    """Recent events of one channel; `floor` is the newest seq it no longer has."""
+
+    __slots__ = ('entries', 'floor')
+
+    def __init__(self, floor: int, size: int):
+        self.entries = deque(maxlen=max(1, size))
+        self.floor = floor
+
+    def append(self, seq: int, event: Event) -> None:
+        if len(self.entries) == self.entries.maxlen:
+            self.floor = self.entries[0][0]
+        self.entries.append((seq, event))
+
+    def since(self, seq: int) -> Optional[List[Event]]:
+        if seq < self.floor:
+            return None
+        return [e for s, e in self.entries if s > seq]
+
+
+class Subscription:
+    """One viewer's bounded mailbox on a channel.
+
+    Iterate it (`async for msg in sub`) to await messages as they are
+    pushed; idle subscribers cost no wake-ups. Use as an async context
+    manager (`async with broker.subscribe(chan) as sub`) so it is always
+    unregistered.
+    """
 
-    async def get_message(self, channel: str, timeout: float = 1.0):
-        q = self.channels.setdefault(channel, asyncio.Queue())
+    def __init__(self, broker: '_FanOutBroker', channel: str, maxsize: int = SUBSCRIBER_QUEUE):
+        self.broker = broker
+        self.channel = channel
+        self.dropped = False
+        self.closed = False
+        # events missed since the subscriber's Last-Event-ID (None: unknown)
+        self.backlog: Optional[List[Event]] = None
+        # id of the newest event published before this subscription
+        self.cursor: Optional[str] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, maxsize) + 1)  # + room for the close marker
+        self._limit = max(1, maxsize)
+
+    def _deliver(self, event: Event) -> None:
+        if self.closed:
+            return
+        if self._queue.qsize() >= self._limit:
+            # slow consumer: cut it loose rather than buffer or block the publisher
+            self.dropped = True
+            self.broker._unregister(self)
+            self._close()
+            return
+        self._queue.put_nowait(event)
+
+    def _close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.dropped:
+            # nothing buffered is worth delivering once the stream is broken
+            while not self._queue.empty():
+                self._queue.get_nowait()
+        self._queue.put_nowait(_CLOSED)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """Next event, or None on timeout. Raises StopAsyncIteration once closed."""
         try:
-            msg = await asyncio.wait_for(q.get(), timeout=timeout)
-            return msg
+            item = await asyncio.wait_for(self._queue.get(), timeout) if timeout is not None else await self._queue.get()
         except asyncio.TimeoutError:
             return None
+        if item is _CLOSED:
+            self._queue.put_nowait(_CLOSED)
+            raise StopAsyncIteration
+        return item
+
+    def close(self) -> None:
+        self.broker._unregister(self)
+        self._close()
+
+    def __aiter__(self) -> 'Subscription':
+        return self
 
+    async def __anext__(self) -> Event:
+        # parks on the queue until a publish (or close) wakes it
+        return await self.get()
+
+    async def __aenter__(self) -> 'Subscription':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+
+class _FanOutBroker:
+    def __init__(self, replay_size: int = REPLAY_SIZE, replay_channels: int = REPLAY_CHANNELS):
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._rings: 'OrderedDict[str, _Ring]' = OrderedDict()
+        self.replay_size = replay_size
+        self.replay_channels = max(1, replay_channels)
+
+    def _event_id(self, seq: int) -> str:
+        return f'{self.epoch}.{seq}'
+
+    def _parse_id(self, event_id: Optional[str]) -> Optional[int]:
+        if not event_id:
+            return None
+        epoch, _, seq = event_id.strip().partition('.')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
 
-class RedisBroker:
-    def __init__(self, url: str):
+    def _ring(self, channel: str) -> _Ring:
+        ring = self._rings.get(channel)
+        if ring is None:
+            ring = self._rings[channel] = _Ring(self._seq, self.replay_size)
+            while len(self._rings) > self.replay_channels:
+                self._rings.popitem(last=False)
+        self._rings.move_to_end(channel)
+        return ring
+
+    def _forget_rings(self) -> None:
+        """Called when events may have been missed (e.g. upstream reconnect)."""
+        self._rings.clear()
+
+    def subscribe(self, channel: str, last_event_id: Optional[str] = None, maxsize: int = SUBSCRIBER_QUEUE) -> Subscription:
+        sub = Subscription(self, channel, maxsize)
+        # registering and reading the ring happen without yielding to the
+        # loop, so the backlog and the live queue neither overlap nor gap
+        ring = self._ring(channel)
+        seq = self._parse_id(last_event_id)
+        if seq is not None:
+            sub.backlog = ring.since(seq)
+        sub.cursor = self._event_id(self._seq)
+        first = not self._subs
+        self._subs.setdefault(channel, set()).add(sub)
+        if first:
+            self._on_first_subscriber()
+        return sub
+
+    def _unregister(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.channel)
+        if not subs or sub not in subs:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._subs[sub.channel]
+            if not self._subs:
+                self._on_last_subscriber()
+
+    def _dispatch(self, channel: str, message: str) -> None:
+        subs = self._subs.get(channel)
+        if not subs and channel not in self._rings:
+            return
+        self._seq += 1
+        event = Event(self._event_id(self._seq), message)
+        self._ring(channel).append(self._seq, event)
+        for sub in list(subs or ()):
+            sub._deliver(event)
+
+    def subscriber_count(self, channel: Optional[str] = None) -> int:
+        if channel is not None:
+            return len(self._subs.get(channel, ()))
+        return sum(len(s) for s in self._subs.values())
+
+    def _on_first_subscriber(self) -> None:
+        pass
+
+    def _on_last_subscriber(self) -> None:
+        pass
+
+
+class MemoryBroker(_FanOutBroker):
+    """In-process broker; publishers must run on the subscribers' loop.
+
+    Rings of recently watched channels keep filling while nobody is
+    subscribed, so replay survives any disconnect shorter than the ring.
+    """
+
+    async def publish(self, channel: str, message: str):
+        self._dispatch(channel, message)
+
+    async def publish_many(self, items):
+        for channel, message in items:
+            self._dispatch(channel, message)
+
+
+class RedisBroker(_FanOutBroker):
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, url: str, pattern: str = REDIS_PATTERN, grace: float = REPLAY_GRACE):
+        super().__init__()
         self._url = url
+        self._pattern = pattern
+        self._grace = grace
         self._client = aioredis.from_url(url)
+        self._reader: Optional[asyncio.Task] = None
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
 
     async def publish(self, channel: str, message: str):
         try:
@@ -54,36 +252,64 @@ class RedisBroker:
         except Exception:
             pass
 
-    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+    async def publish_many(self, items):
+        """One pipelined round trip for a batch of (channel, message)."""
         try:
-            pubsub = self._client.pubsub()
-            await pubsub.subscribe(channel)
-            while True:
-                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if msg and msg.get('type') == 'message':
-                    data = msg.get('data')
-                    if isinstance(data, bytes):
-                        data = data.decode('utf-8')
-                    yield data
-                else:
-                    await asyncio.sleep(0.1)
+            async with self._client.pipeline(transaction=False) as pipe:
+                for channel, message in items:
+                    pipe.publish(channel, message)
+                await pipe.execute()
         except Exception:
-            # fallback: nothing
+            pass
+
+    def _on_first_subscriber(self) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.ensure_future(self._read())
+
+    def _on_last_subscriber(self) -> None:
+        if self._grace > 0:
+            self._idle_timer = asyncio.get_running_loop().call_later(self._grace, self._stop_reader)
+        else:
+            self._stop_reader()
+
+    def _stop_reader(self) -> None:
+        self._idle_timer = None
+        if self._subs:
             return
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        # nothing is recorded from here on
+        self._forget_rings()
 
-    async def get_message(self, channel: str, timeout: float = 1.0):
-        try:
+    async def _read(self) -> None:
+        while True:
             pubsub = self._client.pubsub()
-            await pubsub.subscribe(channel)
-            msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
-            if msg and msg.get('type') == 'message':
-                data = msg.get('data')
-                if isinstance(data, bytes):
-                    data = data.decode('utf-8')
-                return data
-            return None
-        except Exception:
-            return None
+            try:
+                await pubsub.psubscribe(self._pattern)
+                async for msg in pubsub.listen():
+                    if msg.get('type') != 'pmessage':
+                        continue
+                    channel, data = msg.get('channel'), msg.get('data')
+                    if isinstance(channel, bytes):
+                        channel = channel.decode('utf-8')
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    self._dispatch(channel, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('sse redis subscription failed: %s', e)
+                self._forget_rings()
+                await asyncio.sleep(self.RECONNECT_DELAY)
+            finally:
+                try:
+                    await asyncio.shield(pubsub.aclose() if hasattr(pubsub, 'aclose') else pubsub.close())
+                except Exception:
+                    pass
 
 
 _broker = None
@@ -0,0 +1,197 @@
+"""Group commit for ingest units of work.
+
+`INGEST_COMMIT_MODE` selects the durability of `/v1/message`:
+
+- `sync` (default): each request runs and commits its own transaction
+  before responding.
+- `group`: requests are handed to one committer thread that runs them in a
+  shared transaction and commits every `INGEST_GROUP_COMMIT_MS` ms (or every
+  `INGEST_GROUP_COMMIT_MAX` units). A request responds only after its
+  group committed, so durability matches `sync` with far fewer fsyncs.
+- `write_behind`: same batching, but a request responds as soon as its unit
+  has been flushed into the open group transaction. A crash can lose up to
+  one window of already-acknowledged messages.
+
+Each unit runs inside a SAVEPOINT so a failing unit is rolled back alone
+without aborting the rest of its group.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from .db import DATABASE_URL
+from .audit import append_event
+
+COMMIT_MODES = ('sync', 'group', 'write_behind')
+GROUP_COMMIT_MS = int(os.getenv('INGEST_GROUP_COMMIT_MS', '10'))
+GROUP_COMMIT_MAX = int(os.getenv('INGEST_GROUP_COMMIT_MAX', '100'))
+
+
+def commit_mode() -> str:
+    mode = os.getenv('INGEST_COMMIT_MODE', 'sync').strip().lower()
+    return mode if mode in COMMIT_MODES else 'sync'
+
+
+def _savepoint_engine():
+    """Engine for the committer; enables working SAVEPOINTs on pysqlite."""
+    if not DATABASE_URL.startswith('sqlite'):
+        return create_engine(DATABASE_URL, pool_pre_ping=True)
+    eng = create_engine(DATABASE_URL, connect_args={'check_same_thread': False})
+
+    # pysqlite issues its own BEGIN lazily, which breaks SAVEPOINT; take over
+    # transaction control and start write transactions up front so the
+    # committer never deadlocks upgrading a read lock
+    @event.listens_for(eng, 'connect')
+    def _no_implicit_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(eng, 'begin')
+    def _begin_immediate(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    return eng
+
+
+class _Unit:
+    __slots__ = ('fn', 'args', 'kwargs', 'future')
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class GroupCommitter:
+    """Runs `fn(db, *args, **kwargs)` units on one thread, committing in groups."""
+
+    def __init__(self, session_factory: Callable, window_ms: int = GROUP_COMMIT_MS, max_batch: int = GROUP_COMMIT_MAX, wait_for_commit: bool = True):
+        self._session_factory = session_factory
+        self.window = max(0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.wait_for_commit = wait_for_commit
+        self._q: 'queue.Queue[Optional[_Unit]]' = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name='group-committer', daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if self._stopping:
+            raise RuntimeError('group committer is stopping')
+        self.start()
+        unit = _Unit(fn, args, kwargs)
+        self._q.put(unit)
+        return unit.future
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stop(self, timeout: float = 5.0):
+        """Drain queued units, commit them and stop the thread."""
+        self._stopping = True
+        self._q.put(None)
+        t = self._thread
+        if t is not None:
+            t.join(timeout)
+
+    def _loop(self):
+        stopping = False
+        while True:
+            if stopping:
+                try:
+                    first = self._q.get_nowait()
+                except queue.Empty:
+                    return
+            else:
+                first = self._q.get()
+            if first is None:
+                # stop requested: finish what's queued, then exit
+                stopping = True
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    unit = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if unit is None:
+                    stopping = True
+                    break
+                batch.append(unit)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_Unit]):
+        db = self._session_factory()
+        staged = []
+        try:
+            for unit in batch:
+                sp = db.begin_nested()
+                try:
+                    res = unit.fn(db, *unit.args, **unit.kwargs)
+                    db.flush()
+                    sp.commit()
+                except Exception as e:
+                    try:
+                        sp.rollback()
+                    except Exception:
+                        pass
+                    unit.future.set_exception(e)
+                    continue
+                if self.wait_for_commit:
+                    staged.append((unit, res))
+                else:
+                    unit.future.set_result(res)
+                    staged.append((unit, None))
+            db.commit()
+            for unit, res in staged:
+                if self.wait_for_commit:
+                    unit.future.set_result(res)
+        except Exception as e:
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            for unit, _ in staged:
+                if not unit.future.done():
+                    unit.future.set_exception(e)
+            try:
+                append_event('group_commit_failed', {'units': len(staged), 'acknowledged': 0 if self.wait_for_commit else len(staged), 'error': str(e)})
+            except Exception:
+                pass
+        finally:
+            db.close()
+
+
+_committer = None
+_committer_lock = threading.Lock()
+
+
+def get_committer() -> GroupCommitter:
+    global _committer
+    with _committer_lock:
+        if _committer is None:
+            factory = sessionmaker(autoflush=False, bind=_savepoint_engine())
+            _committer = GroupCommitter(factory, wait_for_commit=commit_mode() != 'write_behind')
+        return _committer
+
+
+def shutdown_committer():
+    if _committer is not None:
+        _committer.stop()
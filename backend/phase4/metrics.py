@@ -8,7 +8,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 try:
-    from prometheus_client import Counter, generate_latest, CollectorRegistry
+    from prometheus_client import Counter, Gauge, generate_latest, CollectorRegistry
 
     registry = CollectorRegistry()
     MESSAGES_TOTAL = Counter("sentinel_messages_total", "Total messages processed", registry=registry)
@@ -16,6 +16,8 @@ try:
     OUTGOING_SUCCESS = Counter("sentinel_outgoing_success_total", "Outgoing successes", registry=registry)
     OUTGOING_FAILURE = Counter("sentinel_outgoing_failure_total", "Outgoing failures", registry=registry)
     DETECTOR_INVOCATIONS = Counter("sentinel_detector_invocations_total", "Detector runs", registry=registry)
+    DB_POOL_CHECKED_OUT = Gauge("sentinel_db_pool_checked_out", "DB connections currently checked out", ['engine'], registry=registry)
+    DB_POOL_CHECKOUTS = Counter("sentinel_db_pool_checkouts_total", "DB connection checkouts", ['engine'], registry=registry)
     try:
         from prometheus_client import Histogram
         REQUEST_LATENCY = Histogram('sentinel_request_latency_seconds', 'Request latency seconds', ['path'], registry=registry)
@@ -31,11 +33,19 @@ except Exception:  # pragma: no cover - optional dependency
         def inc(self, *a, **k):
             return None
 
+        def dec(self, *a, **k):
+            return None
+
+        def labels(self, *a, **k):
+            return self
+
     MESSAGES_TOTAL = _Noop()
     OUTGOING_ATTEMPTS = _Noop()
     OUTGOING_SUCCESS = _Noop()
     OUTGOING_FAILURE = _Noop()
     DETECTOR_INVOCATIONS = _Noop()
+    DB_POOL_CHECKED_OUT = _Noop()
+    DB_POOL_CHECKOUTS = _Noop()
     REQUEST_LATENCY = None
 
     def metrics_payload() -> bytes:  # type: ignore[return-value]
@@ -4,16 +4,39 @@ This script is intentionally safe and conservative: it rewrites audit/log
 files by redacting long digit sequences and optionally removes files older
 than `max_age_days`.
 
+Files are processed in parallel (`--workers` processes). Each one is
+streamed line by line into a temp file next to it, which then atomically
+replaces the original (keeping its mtime, so redaction does not reset the
+file's age); a crash mid-file leaves the original intact. Files that need
+no change are not rewritten. Finished files are recorded in a checkpoint
+(`.purge_checkpoint.json` in the log dir) so an interrupted purge resumes
+where it stopped; `--restart` ignores it.
+
+The live audit log is never rewritten (the writer holds it open and its
+entries are signed). Sealed audit segments are handled per segment by
+`audit_segments.apply_retention`: deleted past `max_age_days`, otherwise
+redacted and re-signed.
+
 Usage (from repo root):
     python -m backend.safety.purge_old_logs --log-dir logs --max-age-days 90 --dry-run
 """
 import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 import re
 
 _PII_DIGITS_RE = re.compile(r"(\d{6,})")
 
+CHECKPOINT_NAME = ".purge_checkpoint.json"
+TMP_SUFFIX = ".purge-tmp"
+# never rewritten here: the live audit log and its sidecar index
+_SKIP_NAMES = {"audit.log", "audit.log.idx", CHECKPOINT_NAME}
+
 
 def redact_content(s: str) -> str:
     def _mask(m):
@@ -24,7 +47,87 @@ def redact_content(s: str) -> str:
     return _PII_DIGITS_RE.sub(_mask, s)
 
 
-def purge_logs(log_dir: Path, max_age_days: int = 90, dry_run: bool = True):
+def redact_file(path: Path, dry_run: bool = True) -> dict:
+    """Stream `path` through `redact_content`; replace it atomically if anything changed."""
+    path = Path(path)
+    tmp = path.with_name(path.name + TMP_SUFFIX)
+    stat = path.stat()
+    nbytes = lines = changed = 0
+    t0 = time.monotonic()
+    out = None if dry_run else open(tmp, 'wb')
+    try:
+        with open(path, 'rb') as fin:
+            for raw in fin:
+                nbytes += len(raw)
+                lines += 1
+                # surrogateescape keeps undecodable bytes as they were
+                line = raw.decode('utf-8', 'surrogateescape')
+                red = redact_content(line)
+                if red != line:
+                    changed += 1
+                if out is not None:
+                    out.write(red.encode('utf-8', 'surrogateescape'))
+        if out is not None:
+            out.flush()
+            os.fsync(out.fileno())
+            out.close()
+            out = None
+            if changed:
+                shutil.copymode(path, tmp)
+                os.replace(tmp, path)
+                os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            else:
+                tmp.unlink()
+    finally:
+        if out is not None:
+            out.close()
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+    return {"bytes": nbytes, "lines": lines, "changed_lines": changed, "seconds": time.monotonic() - t0}
+
+
+def _purge_one(args) -> dict:
+    path, delete, dry_run = args
+    path = Path(path)
+    res = {"file": path.name, "bytes": 0, "lines": 0, "changed_lines": 0, "actions": []}
+    if delete:
+        res["actions"].append('delete')
+        res["bytes"] = path.stat().st_size
+        if not dry_run:
+            try:
+                path.unlink()
+            except Exception as e:
+                res["error"] = f"Failed to delete {path}: {e}"
+        return res
+    res.update(redact_file(path, dry_run))
+    if res["changed_lines"]:
+        res["actions"].append('redact')
+    return res
+
+
+def _load_checkpoint(path: Path) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_checkpoint(path: Path, data: dict) -> None:
+    tmp = path.with_name(path.name + TMP_SUFFIX)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _fingerprint(p: Path) -> list:
+    st = p.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def purge_logs(log_dir: Path, max_age_days: int = 90, dry_run: bool = True, workers: int = None, restart: bool = False):
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=max_age_days)
     log_dir = Path(log_dir)
@@ -32,32 +135,77 @@ def purge_logs(log_dir: Path, max_age_days: int = 90, dry_run: bool = True):
         print(f"Log directory {log_dir} not found")
         return
 
-    for p in log_dir.iterdir():
-        if not p.is_file():
-            continue
-        stat = p.stat()
-        mtime = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
-        action = []
-        if mtime < cutoff:
-            action.append('delete')
-        # Always redact file content in-place (or in dry-run show diff)
-        with open(p, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-        redacted = redact_content(content)
-        if content != redacted:
-            action.append('redact')
-
-        print(f"{p.name}: mtime={mtime.isoformat()} actions={action}")
-        if dry_run:
+    checkpoint_path = log_dir / CHECKPOINT_NAME
+    checkpoint = {} if restart else _load_checkpoint(checkpoint_path)
+    if checkpoint.get("max_age_days") != max_age_days:
+        checkpoint = {}
+    done = checkpoint.setdefault("done", {})
+    checkpoint["max_age_days"] = max_age_days
+
+    tasks = []
+    for p in sorted(log_dir.iterdir()):
+        if not p.is_file() or p.name in _SKIP_NAMES:
             continue
-        if 'redact' in action:
-            with open(p, 'w', encoding='utf-8') as f:
-                f.write(redacted)
-        if 'delete' in action:
-            try:
+        if p.name.endswith(TMP_SUFFIX):
+            # left behind by an interrupted run; the original is intact
+            if not dry_run:
                 p.unlink()
-            except Exception as e:
-                print(f"Failed to delete {p}: {e}")
+            continue
+        if done.get(p.name) == _fingerprint(p):
+            print(f"{p.name}: done in previous run, skipping")
+            continue
+        mtime = datetime.fromtimestamp(p.stat().st_mtime, timezone.utc)
+        tasks.append((str(p), mtime < cutoff, dry_run))
+
+    t0 = time.monotonic()
+    totals = {"files": 0, "bytes": 0, "lines": 0, "changed_lines": 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_purge_one, t): t for t in tasks}
+        for fut in as_completed(futures):
+            res = fut.result()
+            print(f"{res['file']}: actions={res['actions']} lines={res['lines']} redacted_lines={res['changed_lines']}")
+            if res.get("error"):
+                print(res["error"])
+                continue
+            for k in ("bytes", "lines", "changed_lines"):
+                totals[k] += res[k]
+            totals["files"] += 1
+            if not dry_run:
+                p = log_dir / res["file"]
+                if p.exists():
+                    done[res["file"]] = _fingerprint(p)
+                else:
+                    done.pop(res["file"], None)
+                _save_checkpoint(checkpoint_path, checkpoint)
+
+    segments = _purge_audit_segments(log_dir, max_age_days, dry_run)
+
+    elapsed = max(time.monotonic() - t0, 1e-9)
+    totals.update(seconds=round(elapsed, 3), mb_per_s=round(totals["bytes"] / 1e6 / elapsed, 2),
+                  lines_per_s=round(totals["lines"] / elapsed), segments=segments)
+    print(f"processed {totals['files']} file(s), {totals['bytes'] / 1e6:.1f} MB, {totals['lines']} lines in {elapsed:.2f}s "
+          f"({totals['mb_per_s']} MB/s, {totals['lines_per_s']} lines/s)")
+    if not dry_run:
+        # complete: the next run starts from scratch
+        try:
+            checkpoint_path.unlink()
+        except FileNotFoundError:
+            pass
+    return totals
+
+
+def _purge_audit_segments(log_dir: Path, max_age_days: int, dry_run: bool) -> dict:
+    """Retention for sealed audit segments (when `log_dir` is the audit LOG_DIR)."""
+    try:
+        from backend.app import audit, audit_segments
+    except Exception:
+        return {}
+    if Path(audit.LOG_DIR).resolve() != log_dir.resolve():
+        return {}
+    res = audit_segments.apply_retention(delete_after_days=max_age_days, redact_after_days=0, dry_run=dry_run)
+    if res["deleted"] or res["redacted"]:
+        print(f"audit segments: deleted={res['deleted']} redacted={res['redacted']}")
+    return res
 
 
 def main():
@@ -65,8 +213,10 @@ def main():
     ap.add_argument('--log-dir', default='logs')
     ap.add_argument('--max-age-days', type=int, default=90)
     ap.add_argument('--dry-run', action='store_true')
+    ap.add_argument('--workers', type=int, default=None, help='parallel processes (default: CPU count)')
+    ap.add_argument('--restart', action='store_true', help='ignore the checkpoint of an interrupted run')
     args = ap.parse_args()
-    purge_logs(Path(args.log_dir), args.max_age_days, args.dry_run)
+    purge_logs(Path(args.log_dir), args.max_age_days, args.dry_run, args.workers, args.restart)
 
 
 if __name__ == '__main__':
@@ -20,3 +20,42 @@ def test_agent_persists_message():
     msg = db.query(DBMessage).filter(DBMessage.session_id == sid, DBMessage.sender == 'agent').order_by(DBMessage.id.desc()).first()
     assert msg is not None
     db.close()
+
+
+def test_failed_agent_turn_keeps_the_ingest(monkeypatch):
+    from backend.app import agent
+    from backend.app.routes import _ingest_message
+    from backend.app.schemas import IngestRequest
+
+    def _fail(*args, **kwargs):
+        raise RuntimeError('turn failed')
+
+    monkeypatch.setattr(agent, '_persist_turn', _fail)
+    sid = 'agent-turn-fails'
+    payload = IngestRequest(sessionId=sid, message={'sender': 'scammer', 'text': 'Send money to fail@upi now', 'timestamp': '2026-01-01T00:00:00Z'})
+    db = SessionLocal()
+    try:
+        res = _ingest_message(db, payload)
+        assert res.routeToAgent
+        assert [m.text for m in db.query(DBMessage).filter(DBMessage.session_id == sid).all()] == ['Send money to fail@upi now']
+    finally:
+        db.close()
+
+
+def test_final_callback_waits_for_commit(monkeypatch):
+    from backend.app import agent
+    sent = []
+    monkeypatch.setattr(agent, 'send_guvi_callback', lambda payload: sent.append(payload) or {'status': 'queued'})
+    sid = 'agent-final-callback'
+    db = SessionLocal()
+    try:
+        # 'thank you' completes the conversation
+        respond(sid, 'ok thank you', db=db, commit=False)
+        assert sent == []
+        db.rollback()
+        assert sent == []
+        respond(sid, 'ok thank you', db=db, commit=False)
+        db.commit()
+        assert [p['sessionId'] for p in sent] == [sid]
+    finally:
+        db.close()
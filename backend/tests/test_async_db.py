@@ -0,0 +1,9 @@
+from backend.app.db import _async_database_url
+
+
+def test_async_database_url_mapping():
+    assert _async_database_url('sqlite:///data/sentinel.db') == 'sqlite+aiosqlite:///data/sentinel.db'
+    assert _async_database_url('postgresql://u:p@h/db') == 'postgresql+asyncpg://u:p@h/db'
+    assert _async_database_url('postgres://u:p@h/db') == 'postgresql+asyncpg://u:p@h/db'
+    assert _async_database_url('postgresql+psycopg2://u:p@h/db') == 'postgresql+asyncpg://u:p@h/db'
+    assert _async_database_url('mysql://u:p@h/db') is None
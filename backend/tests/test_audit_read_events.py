@@ -21,3 +21,54 @@ def test_read_events_roundtrip(tmp_path, monkeypatch):
     parsed = json.loads(events[0]["raw"]) if events[0]["raw"] else {}
     assert parsed.get("type") == "test_event"
     assert parsed.get("payload") == {"k": "v"}
+
+
+def test_concurrent_appends_are_batched_and_all_signed(tmp_path, monkeypatch):
+    import threading
+    monkeypatch.setenv("LOG_DIR", str(tmp_path / "logs"))
+    monkeypatch.setenv("AUDIT_HMAC_KEY", "testkey")
+    monkeypatch.setenv("AUDIT_FSYNC", "always")
+    import backend.app.audit as audit
+    importlib.reload(audit)
+
+    def worker(n):
+        for i in range(50):
+            audit.append_event("bulk", {"worker": n, "i": i})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert audit.flush()
+    events = audit.read_events()
+    assert len(events) == 200 and all(e["valid"] for e in events)
+    audit.shutdown_audit()
+
+
+def test_indexed_queries_and_parallel_verification(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOG_DIR", str(tmp_path / "logs"))
+    monkeypatch.setenv("AUDIT_HMAC_KEY", "testkey")
+    import backend.app.audit as audit
+    importlib.reload(audit)
+    from backend.app import audit_reader
+
+    for i in range(25):
+        audit.append_event("even" if i % 2 == 0 else "odd", {"i": i})
+    audit.flush()
+    path = audit.AUDIT_FILE
+    blocks = audit_reader.build_index(path, every=4)
+    assert len(blocks) == 6 and audit_reader.index_path(path).exists()
+    monkeypatch.setattr(audit_reader, "INDEX_EVERY", 4)
+
+    odd = [json.loads(e["raw"])["payload"]["i"] for e in audit_reader.iter_events(path, types=["odd"])]
+    assert odd == list(range(1, 25, 2))
+    last_ts = json.loads(list(audit_reader.iter_events(path))[-1]["raw"])["ts"]
+    assert [e["valid"] for e in audit_reader.iter_events(path, since=last_ts)] == [True]
+
+    # tamper with one entry: verification pinpoints it
+    data = path.read_bytes().replace(b'"i":7}', b'"i":8}', 1)
+    path.write_bytes(data)
+    res = audit_reader.verify_file(path, workers=2)
+    assert res["total"] == 25 and res["invalid"] == 1
+    audit.shutdown_audit()
@@ -0,0 +1,68 @@
+import importlib
+import json
+from datetime import datetime, timedelta
+
+
+def _fresh_audit(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOG_DIR", str(tmp_path / "logs"))
+    monkeypatch.setenv("AUDIT_HMAC_KEY", "testkey")
+    monkeypatch.setenv("AUDIT_SEGMENT_COMPRESS", "0")
+    import backend.app.audit as audit
+    importlib.reload(audit)
+    import backend.app.audit_segments as audit_segments
+    importlib.reload(audit_segments)
+    return audit, audit_segments
+
+
+def test_rotation_seals_segments_with_chained_manifests(tmp_path, monkeypatch):
+    audit, segs = _fresh_audit(tmp_path, monkeypatch)
+    for batch in range(3):
+        for i in range(5):
+            audit.append_event("e", {"batch": batch, "phone": "9876543210"})
+        assert audit.rotate()
+    audit.append_event("live", {})
+    audit.flush()
+
+    manifests = segs.list_segments()
+    assert [m["segment"] for m in manifests] == [1, 2, 3]
+    assert all(m["entries"] == 5 for m in manifests)
+    assert segs.verify_chain(manifests) == []
+    compressed = segs.compress_segment(manifests[0])
+    assert compressed["file"].endswith(".gz")
+    assert all(segs.verify_segment(m)["ok"] for m in segs.list_segments())
+    # the whole log reads across segments and the live file
+    assert len(audit.read_events()) == 16
+
+    # retention: redact segment 2, delete segment 1, never the live file
+    now = datetime.utcnow()
+    res = segs.apply_retention(delete_after_days=0, now=now + timedelta(days=1), dry_run=True)
+    assert res["deleted"] == [1, 2, 3]
+    m2 = segs.redact_segment(segs.list_segments()[1])
+    assert m2["redacted"] and segs.verify_segment(m2)["ok"]
+    payloads = [json.loads(raw)["payload"] for raw, _ in segs.iter_segment(m2)]
+    assert all(p["phone"] == "XXXXXX3210" for p in payloads)
+    assert segs.verify_chain() == []
+    segs.delete_segment(segs.list_segments()[0])
+    assert [m["segment"] for m in segs.list_segments()] == [2, 3]
+    assert audit.AUDIT_FILE.exists()
+    audit.shutdown_audit()
+
+
+def test_tampered_segment_fails_verification(tmp_path, monkeypatch):
+    audit, segs = _fresh_audit(tmp_path, monkeypatch)
+    for i in range(4):
+        audit.append_event("e", {"i": i})
+    audit.rotate()
+    m = segs.list_segments()[0]
+    path = segs.segment_dir() / m["file"]
+    lines = path.read_bytes().splitlines(keepends=True)
+    # drop one whole entry (raw + sig): signatures stay valid, the chain does not
+    path.write_bytes(b"".join(lines[:2] + lines[4:]))
+    res = segs.verify_segment(m)
+    assert not res["ok"] and not res["chain_ok"] and res["invalid"] == 0
+    # the full-log check covers sealed segments, not just the live file
+    from backend.app.audit_reader import verify_all
+    full = verify_all(workers=1)
+    assert not full["ok"] and [r["segment"] for r in full["segments"] if not r["ok"]] == [1]
+    assert full["live"]["invalid"] == 0
+    audit.shutdown_audit()
@@ -0,0 +1,50 @@
+from fastapi.testclient import TestClient
+from backend.app.main import app
+from backend.app.db import SessionLocal, Message as DBMessage, Extraction as DBExtraction, Session as DBSess
+import os
+
+
+client = TestClient(app)
+
+
+def test_batch_ingest_persists_and_returns_in_order():
+    os.environ['API_KEY'] = os.environ.get('API_KEY', 'test_client_key')
+    headers = {'x-api-key': os.environ['API_KEY']}
+    items = [
+        {'sessionId': 'batch-s1', 'message': {'sender': 'scammer', 'text': 'Send money to batch1@upi now', 'timestamp': '2026-01-01T00:00:00Z'}},
+        {'sessionId': 'batch-s2', 'message': {'sender': 'scammer', 'text': 'hello there', 'timestamp': '2026-01-01T00:00:01Z'}},
+        {'sessionId': 'batch-s1', 'message': {'sender': 'scammer', 'text': 'call +91 98765 43210', 'timestamp': '2026-01-01T00:00:02Z'}},
+    ]
+    r = client.post('/v1/messages:batch', json={'messages': items}, headers=headers)
+    assert r.status_code == 200
+    results = r.json()['results']
+    assert [x['sessionId'] for x in results] == ['batch-s1', 'batch-s2', 'batch-s1']
+    assert results[0]['routeToAgent'] is True
+    assert results[1]['routeToAgent'] is False
+
+    db = SessionLocal()
+    try:
+        assert db.query(DBSess).filter(DBSess.id.in_(['batch-s1', 'batch-s2'])).count() == 2
+        assert db.query(DBMessage).filter(DBMessage.session_id == 'batch-s1').count() >= 2
+        upis = [e.value for e in db.query(DBExtraction).filter(DBExtraction.session_id == 'batch-s1', DBExtraction.type == 'upi').all()]
+        assert 'batch1@upi' in upis
+    finally:
+        db.close()
+
+
+def test_batch_messages_are_not_merged_again_from_history():
+    os.environ['API_KEY'] = os.environ.get('API_KEY', 'test_client_key')
+    headers = {'x-api-key': os.environ['API_KEY']}
+    sid = 'batch-dedup-s1'
+    msg = {'sender': 'scammer', 'text': 'pay to dedup@upi', 'timestamp': '2026-01-01T00:00:00Z'}
+    r = client.post('/v1/messages:batch', json={'messages': [{'sessionId': sid, 'message': msg}, {'sessionId': sid, 'message': msg}]}, headers=headers)
+    assert r.status_code == 200 and len(r.json()['results']) == 2
+    turn = {'sessionId': sid, 'message': {'sender': 'scammer', 'text': 'hello?', 'timestamp': '2026-01-01T00:00:30Z'}, 'conversationHistory': [msg]}
+    assert client.post('/v1/message', json=turn, headers=headers).status_code == 200
+
+    db = SessionLocal()
+    try:
+        texts = [m.text for m in db.query(DBMessage).filter(DBMessage.session_id == sid, DBMessage.sender != 'agent').all()]
+        assert sorted(texts) == ['hello?', 'pay to dedup@upi']
+    finally:
+        db.close()
@@ -0,0 +1,48 @@
+import json
+import time
+from backend.app import callback_queue as cq
+
+
+def test_queue_backoff_dead_letter_and_ack(tmp_path, monkeypatch):
+    monkeypatch.setattr(cq, 'MAX_ATTEMPTS', 2)
+    q = cq.CallbackQueue(tmp_path / 'q.db')
+    a = q.enqueue({'sessionId': 's1', 'n': 1})
+    b = q.enqueue({'sessionId': 's2', 'n': 2})
+
+    items = q.dequeue(10)
+    assert [i.id for i in items] == [a, b] and all(i.attempts == 1 for i in items)
+    assert q.dequeue(10) == []  # leased
+
+    q.ack([a])
+    q.nack([(items[1], 'boom')])
+    assert q.stats() == {'pending': 1}
+    assert q.dequeue(10) == []  # backing off
+    retry = q.dequeue(10, now=time.time() + cq.BACKOFF_MAX + 1)
+    assert [(i.id, i.attempts, i.payload['n']) for i in retry] == [(b, 2, 2)]
+    assert q.nack([(retry[0], 'boom again')]) == [b]
+    assert q.stats() == {'dead': 1}
+
+    assert q.requeue_dead() == 1
+    assert [i.id for i in q.dequeue(10)] == [b]
+    q.close()
+
+
+def test_expired_lease_is_redelivered(tmp_path):
+    q = cq.CallbackQueue(tmp_path / 'q.db')
+    a = q.enqueue({'sessionId': 's1'})
+    assert [i.id for i in q.dequeue(1)] == [a]
+    later = time.time() + cq.LEASE_SECONDS + 1
+    assert [i.attempts for i in q.dequeue(1, now=later)] == [2]
+    q.close()
+
+
+def test_import_legacy_files(tmp_path):
+    legacy = tmp_path / 'callback_queue'
+    legacy.mkdir()
+    (legacy / '1700000000000.json').write_text(json.dumps({'sessionId': 'old-1'}))
+    (legacy / '1700000000001.json').write_text('{not json')
+    q = cq.CallbackQueue(tmp_path / 'q.db')
+    assert cq.import_legacy_files(legacy, q) == 1
+    assert [i.payload for i in q.dequeue(10)] == [{'sessionId': 'old-1'}]
+    assert sorted(p.name for p in legacy.iterdir()) == ['1700000000001.json.bad']
+    q.close()
@@ -0,0 +1,82 @@
+from datetime import datetime
+from backend.app.db import SessionLocal, ConversationState, ConversationSlot
+from backend.app.conversation_state import ConversationStore
+
+
+def test_turns_append_and_slots_upsert():
+    sid = 'turnlog-session-001'
+    store = ConversationStore()
+    db = SessionLocal()
+    try:
+        store.append_turn(db, sid, 'agent', 'one', datetime.utcnow(), {'name': 'Ravi'})
+        db.commit()
+        state = store.append_turn(db, sid, 'agent', 'two', datetime.utcnow(), {'name': 'Ravi', 'acct': '1234'})
+        db.commit()
+        assert state.turn_count == 2 and state.slots == {'name': 'Ravi', 'acct': '1234'}
+        assert [t.text for t in store.recent_turns(db, sid)] == ['one', 'two']
+        cs = db.query(ConversationState).filter(ConversationState.session_id == sid).one()
+        assert (cs.turn_count, cs.version, cs.last_agent_reply) == (2, 2, 'two')
+        assert db.query(ConversationSlot).filter(ConversationSlot.session_id == sid).count() == 2
+    finally:
+        db.close()
+
+
+def test_stale_cache_is_detected_by_version_check():
+    sid = 'turnlog-session-002'
+    a, b = ConversationStore(), ConversationStore()
+    db = SessionLocal()
+    try:
+        a.append_turn(db, sid, 'agent', 'a1', None)
+        db.commit()
+        # b (another worker) moves the session on; a's cached version is stale
+        b.append_turn(db, sid, 'agent', 'b1', None, {'k': 'v'})
+        db.commit()
+        state = a.append_turn(db, sid, 'agent', 'a2', None)
+        db.commit()
+        assert state.turn_count == 3 and state.slots == {'k': 'v'}
+        assert [t.turn_no for t in a.recent_turns(db, sid)] == [1, 2, 3]
+    finally:
+        db.close()
+
+
+def test_rollback_drops_cached_state():
+    from backend.app import conversation_state
+    sid = 'turnlog-session-003'
+    store = conversation_state.get_store()
+    db = SessionLocal()
+    try:
+        store.append_turn(db, sid, 'agent', 'kept', None)
+        db.commit()
+        store.append_turn(db, sid, 'agent', 'dropped', None, {'x': 1})
+        db.rollback()
+        state = store.get(db, sid)
+        assert state.turn_count == 1 and state.slots == {}
+    finally:
+        db.close()
+
+
+def test_concurrent_first_turn_falls_back_to_versioned_update():
+    sid = 'turnlog-session-first-race'
+    other = SessionLocal()
+    db = SessionLocal()
+    store = ConversationStore()
+    real_get = store.get
+    calls = []
+
+    def get(db_, session_id):
+        # the first lookup runs before the other writer's first turn lands
+        calls.append(session_id)
+        return None if len(calls) == 1 else real_get(db_, session_id)
+
+    store.get = get
+    try:
+        other.add(ConversationState(session_id=sid, turn_count=1, version=1, last_agent_reply='theirs'))
+        other.commit()
+        state = store.append_turn(db, sid, 'agent', 'ours', datetime.utcnow())
+        db.commit()
+        assert (state.turn_count, state.version) == (2, 2)
+        cs = db.query(ConversationState).filter(ConversationState.session_id == sid).one()
+        assert (cs.turn_count, cs.last_agent_reply) == (2, 'ours')
+    finally:
+        other.close()
+        db.close()
@@ -1,3 +1,4 @@
+import random
 import sys
 from pathlib import Path
 import pytest
@@ -7,7 +8,7 @@ ROOT = Path(__file__).resolve().parents[2]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from backend.app.detector import detect
+from backend.app.detector import detect, detect_many, _detect_reference
 
 
 def test_detector_detects_upi_and_urgency():
@@ -31,5 +32,32 @@ def test_detector_ignores_benign_message():
     assert res["score"] < 0.2
 
 
+def test_compiled_detector_matches_reference():
+    samples = [
+        "Share your UPI ID to avoid account suspension. Verify immediately!",
+        "Please send payment to +91 98765 43210 or visit http://malicious.example.com",
+        "Hi there, are we still on for lunch tomorrow at the cafe?",
+        "pay 9876543210@ybl now or www.example.com/pay?ref=12345678",
+        "@start user.name-1@okaxis http://u:p@host.in/a HTTP://upper.case",
+        "Order 12 shipped 2026-01-05, ref 998877, call +1-800-555-0199",
+        "",
+    ]
+    alphabet = list("ab@.-_ 0123456789+:/hwWH") + ["http://", "www.", "upi id", "paytm", "send money", "\u0966"]
+    rng = random.Random(7)
+    for _ in range(2000):
+        samples.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))))
+    for text in samples:
+        assert detect(text) == _detect_reference(text), text
+
+
+def test_detect_many_preserves_order_and_duplicates():
+    texts = ["Share your UPI ID scam@okaxis", "hello", "Share your UPI ID scam@okaxis"]
+    res = detect_many(texts)
+    assert res == [detect(t) for t in texts]
+    # duplicate inputs get independent result objects
+    assert res[0] is not res[2]
+    assert res[0]["matches"]["upis"] is not res[2]["matches"]["upis"]
+
+
 if __name__ == "__main__":
     pytest.main([str(Path(__file__))])
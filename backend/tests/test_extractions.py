@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+from backend.app.db import SessionLocal, Extraction as DBExtraction
+from backend.app import extractions
+
+
+def test_canonical_values():
+    assert extractions.canonical('phone', '+91 98765-43210') == '+919876543210'
+    assert extractions.canonical('phone', '09876543210') == '+919876543210'
+    assert extractions.canonical('upi', ' Scammer@YBL ') == 'scammer@ybl'
+    assert extractions.canonical('url', 'HTTP://Evil.COM:80/pay/') == 'http://evil.com/pay'
+    assert extractions.canonical('url', 'https://evil.com:8443/?a=1#top') == 'https://evil.com:8443?a=1'
+    assert extractions.canonical('url', 'www.Evil.com/login.') == 'http://www.evil.com/login'
+
+
+def test_upsert_folds_repeats_into_one_row():
+    sid = 'extractions-session-001'
+    t0 = datetime(2026, 1, 1, 12, 0, 0)
+    db = SessionLocal()
+    try:
+        rows = extractions.from_matches(sid, {'upis': ['Pay@YBL', 'pay@ybl'], 'phones': ['+91 98765 43210']})
+        merged = extractions.upsert(db, rows, seen_at=t0)
+        assert sorted((r['type'], r['canonical_value'], r['count']) for r in merged) == [('phone', '+919876543210', 1), ('upi', 'pay@ybl', 2)]
+        db.commit()
+        extractions.upsert(db, extractions.from_matches(sid, {'upis': ['PAY@ybl']}), seen_at=t0 + timedelta(minutes=5))
+        db.commit()
+
+        upi = db.query(DBExtraction).filter(DBExtraction.session_id == sid, DBExtraction.type == 'upi').one()
+        assert (upi.value, upi.canonical_value, upi.count) == ('Pay@YBL', 'pay@ybl', 3)
+        assert (upi.first_seen, upi.last_seen) == (t0, t0 + timedelta(minutes=5))
+        assert db.query(DBExtraction).filter(DBExtraction.session_id == sid).count() == 2
+    finally:
+        db.close()
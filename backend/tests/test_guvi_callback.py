@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+import httpx
+from backend.app import guvi_callback
+from backend.app.circuit_breaker import outgoing_breaker
+
+
+def test_sender_retries_then_hands_off_to_queue(monkeypatch):
+    calls = []
+    queued = []
+    monkeypatch.setattr(guvi_callback, 'BACKOFF_BASE', 0.01)
+    monkeypatch.setattr(guvi_callback, 'enqueue', lambda payload: queued.append(payload) or 1)
+    outgoing_breaker.record_success()
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    sender = guvi_callback.CallbackSender(attempts=3, transport=httpx.MockTransport(handler))
+    try:
+        fut = asyncio.run_coroutine_threadsafe(sender.deliver({'sessionId': 's1'}), sender._ensure_loop())
+        res = fut.result(5)
+    finally:
+        sender.stop()
+        outgoing_breaker.record_success()
+    assert len(calls) == 3
+    assert res['status'] == 'queued' and queued == [{'sessionId': 's1'}]
+
+
+def test_submit_returns_immediately_and_sends(monkeypatch):
+    sent = threading.Event()
+    outgoing_breaker.record_success()
+
+    def handler(request):
+        sent.set()
+        return httpx.Response(200, json={'ok': True})
+
+    sender = guvi_callback.CallbackSender(transport=httpx.MockTransport(handler))
+    try:
+        assert sender.submit({'sessionId': 's2'}) == {'status': 'scheduled'}
+        assert sent.wait(5)
+    finally:
+        sender.stop()
+
+
+def test_submits_within_debounce_are_coalesced_and_unchanged_skipped(monkeypatch):
+    requests = []
+    outgoing_breaker.record_success()
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={'ok': True})
+
+    sender = guvi_callback.CallbackSender(debounce=0.2, transport=httpx.MockTransport(handler))
+    try:
+        for n in range(5):
+            sender.submit({'sessionId': 's3', 'totalMessagesExchanged': n})
+        time.sleep(0.6)
+        assert len(requests) == 1
+        assert b'"totalMessagesExchanged":4' in requests[0].content.replace(b' ', b'')
+        key = requests[0].headers['Idempotency-Key']
+        assert key == guvi_callback.idempotency_key({'sessionId': 's3', 'totalMessagesExchanged': 4})
+
+        # same content again: nothing new to tell GUVI
+        sender.submit({'sessionId': 's3', 'totalMessagesExchanged': 4})
+        time.sleep(0.5)
+        assert len(requests) == 1
+    finally:
+        sender.stop()
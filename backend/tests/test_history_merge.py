@@ -0,0 +1,32 @@
+from fastapi.testclient import TestClient
+from backend.app.main import app
+from backend.app.db import SessionLocal, Message as DBMessage
+import os
+
+
+client = TestClient(app)
+
+
+def test_history_merge_skips_already_stored_messages():
+    os.environ['API_KEY'] = os.environ.get('API_KEY', 'test_client_key')
+    headers = {'x-api-key': os.environ['API_KEY']}
+    sid = 'history-merge-001'
+    history = [
+        {'sender': 'scammer', 'text': 'hello', 'timestamp': '2026-01-01T00:00:00Z'},
+        {'sender': 'user', 'text': 'who is this?', 'timestamp': '2026-01-01T00:00:05Z'},
+        {'sender': 'user', 'text': 'who is this?', 'timestamp': '2026-01-01T00:00:05Z'},
+    ]
+    turn1 = {'sessionId': sid, 'message': {'sender': 'scammer', 'text': 'lunch tomorrow?', 'timestamp': '2026-01-01T00:00:10Z'}, 'conversationHistory': history}
+    assert client.post('/v1/message', json=turn1, headers=headers).status_code == 200
+
+    # next turn resends the full history, including the previous incoming message
+    turn2 = {'sessionId': sid, 'message': {'sender': 'scammer', 'text': 'see you', 'timestamp': '2026-01-01T00:00:20Z'},
+             'conversationHistory': history + [turn1['message']]}
+    assert client.post('/v1/message', json=turn2, headers=headers).status_code == 200
+
+    db = SessionLocal()
+    try:
+        texts = sorted(m.text for m in db.query(DBMessage).filter(DBMessage.session_id == sid, DBMessage.sender != 'agent').all())
+        assert texts == ['hello', 'lunch tomorrow?', 'see you', 'who is this?']
+    finally:
+        db.close()
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from backend.app.main import app
+from backend.app.db import SessionLocal
+from backend.app import extractions, intel_index
+import os
+
+
+client = TestClient(app)
+
+
+def _seed(prefix, phone):
+    """Sessions <prefix>-s1..s3 sharing values namespaced by `prefix`, so
+    tests do not see each other's rows whatever order they run in."""
+    t0 = datetime(2026, 2, 1, 9, 0, 0)
+    db = SessionLocal()
+    try:
+        extractions.upsert(db, extractions.from_matches(f'{prefix}-s1', {'upis': [f'{prefix}.Mule@YBL'], 'phones': [phone]}), seen_at=t0)
+        extractions.upsert(db, extractions.from_matches(f'{prefix}-s2', {'upis': [f'{prefix}.mule@ybl', f'{prefix}.mule@ybl']}), seen_at=t0 + timedelta(hours=1))
+        extractions.upsert(db, extractions.from_matches(f'{prefix}-s3', {'upis': [f'{prefix}.other@ybl']}), seen_at=t0)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_lookup_lists_sessions_sharing_a_value():
+    _seed('lookup', '+91 98765 11111')
+    os.environ['ADMIN_API_KEY'] = os.environ.get('ADMIN_API_KEY', 'test_admin_key')
+    headers = {'x-api-key': os.environ['ADMIN_API_KEY']}
+    r = client.get('/v1/admin/intel/lookup', params={'value': 'Lookup.MULE@ybl'}, headers=headers)
+    assert r.status_code == 200
+    [match] = r.json()['matches']
+    assert (match['type'], match['canonicalValue'], match['sessionCount']) == ('upi', 'lookup.mule@ybl', 2)
+    # most recently seen first
+    assert [(s['sessionId'], s['count']) for s in match['sessions']] == [('lookup-s2', 2), ('lookup-s1', 1)]
+
+    r = client.post('/v1/admin/intel/lookup:bulk', json={'values': ['09876511111', 'lookup.nobody@ybl', 'lookup.other@YBL']}, headers=headers)
+    assert r.status_code == 200
+    results = r.json()['results']
+    assert [[s['sessionId'] for m in res['matches'] for s in m['sessions']] for res in results] == [['lookup-s1'], [], ['lookup-s3']]
+
+
+def test_lookup_truncates_long_posting_lists():
+    _seed('truncate', '+91 98765 22222')
+    db = SessionLocal()
+    try:
+        res = intel_index.lookup(db, 'truncate.mule@ybl', 'upi', max_sessions=1)
+        [match] = res['matches']
+        assert match['sessionCount'] == 2 and match['truncated']
+        assert [s['sessionId'] for s in match['sessions']] == ['truncate-s2']
+    finally:
+        db.close()
@@ -0,0 +1,49 @@
+import asyncio
+import json
+import threading
+from backend.app.db import SessionLocal
+from backend.app.live_events import PublishBridge, publish_session_event
+from backend.app import live_events
+from backend.app.sse_broker import MemoryBroker
+
+
+def test_bridge_delivers_publishes_from_worker_threads_in_order():
+    async def run():
+        broker = MemoryBroker()
+        bridge = PublishBridge(max_batch=7, broker=broker)
+        bridge.start(asyncio.get_running_loop())
+        sub = broker.subscribe('session:t')
+
+        def worker():
+            for i in range(50):
+                assert bridge.publish('session:t', str(i))
+
+        t = threading.Thread(target=worker)
+        t.start()
+        await asyncio.to_thread(t.join)
+        got = [(await sub.get(timeout=1)).data for _ in range(50)]
+        assert got == [str(i) for i in range(50)]
+
+    asyncio.run(run())
+
+
+def test_session_events_publish_on_commit_only(monkeypatch):
+    published = []
+
+    class _Bridge:
+        def publish(self, channel, message):
+            published.append((channel, json.loads(message)))
+
+    monkeypatch.setattr(live_events, 'get_bridge', lambda: _Bridge())
+    db = SessionLocal()
+    try:
+        db.connection()
+        sp = db.begin_nested()
+        publish_session_event(db, 'live-1', {'n': 1})
+        sp.rollback()
+        publish_session_event(db, 'live-1', {'n': 2})
+        assert published == []
+        db.commit()
+    finally:
+        db.close()
+    assert published == [('session:live-1', {'n': 2})]
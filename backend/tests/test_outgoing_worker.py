@@ -28,3 +28,35 @@ def test_outgoing_process_one():
             db.close()
         except Exception:
             pass
+
+
+def test_claim_batch_leases_rows_and_schedules_retries():
+    from datetime import datetime, timedelta
+    from backend.app import outgoing_worker as ow
+    db = SessionLocal()
+    now = datetime.utcnow()
+    try:
+        for i in range(3):
+            db.add(OutgoingMessage(session_id='claim-test', content=f'm{i}', status='queued', next_attempt_at=now - timedelta(seconds=1)))
+        db.commit()
+        first = ow.claim_batch(db, 2, worker_id='w1', now=now)
+        second = ow.claim_batch(db, 10, worker_id='w2', now=now)
+        ids = [m.id for m in first] + [m.id for m in second]
+        assert len(first) == 2 and len(second) == 1 and len(ids) == len(set(ids))
+        assert all(m.attempts == 1 for m in first + second)
+
+        # w1's first row fails and is re-queued for later; w2's lease lapses
+        ow.apply_results(db, [(first[0], 'failed'), (first[1], 'sent')], now=now)
+        assert ow.claim_batch(db, 10, worker_id='w3', now=now) == []
+        later = now + timedelta(seconds=ow.LEASE_SECONDS + ow.BACKOFF_BASE + 1)
+        reclaimed = ow.claim_batch(db, 10, worker_id='w3', now=later)
+        assert sorted(m.id for m in reclaimed) == sorted([first[0].id, second[0].id])
+
+        # the late result of w2's expired claim is ignored
+        ow.apply_results(db, [(second[0], 'sent')])
+        row = db.query(OutgoingMessage).filter(OutgoingMessage.id == second[0].id).one()
+        assert (row.status, row.claimed_by, row.attempts) == ('sending', 'w3', 2)
+    finally:
+        db.query(OutgoingMessage).filter(OutgoingMessage.session_id == 'claim-test').delete()
+        db.commit()
+        db.close()
@@ -0,0 +1,43 @@
+import json
+import os
+
+from backend.app.persona_registry import PersonaRegistry, PersonaMatcher
+
+
+def _write(path, persona, mtime=None):
+    path.write_text(json.dumps(persona), encoding='utf-8')
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_registry_serves_personas_by_id_and_reloads_on_mtime(tmp_path):
+    _write(tmp_path / 'a.json', {'id': 'honeypot_default', 'behaviors': [{'match': ['upi'], 'response_templates': ['default-upi']}]}, 1000)
+    _write(tmp_path / 'b.json', {'id': 'granny', 'behaviors': [{'match': ['upi'], 'response_templates': ['granny-upi']}]}, 1000)
+    reg = PersonaRegistry(tmp_path, check_interval=0)
+
+    assert reg.ids() == ['granny', 'honeypot_default']
+    assert reg.get('granny').matcher.match('my UPI')[0] == 'granny-upi'
+    # unknown ids fall back to the default persona
+    assert reg.get('missing').id == 'honeypot_default'
+
+    first = reg.get('granny')
+    assert reg.get('granny') is first
+    _write(tmp_path / 'b.json', {'id': 'granny', 'behaviors': [{'match': ['upi'], 'response_templates': ['granny-v2']}]}, 2000)
+    assert reg.get('granny').matcher.match('upi please')[0] == 'granny-v2'
+
+
+def test_registry_keeps_previous_version_on_bad_file(tmp_path):
+    _write(tmp_path / 'a.json', {'id': 'honeypot_default', 'fallbacks': ['ok']}, 1000)
+    reg = PersonaRegistry(tmp_path, check_interval=0)
+    assert reg.get().persona['fallbacks'] == ['ok']
+    (tmp_path / 'a.json').write_text('{not json', encoding='utf-8')
+    os.utime(tmp_path / 'a.json', (2000, 2000))
+    assert reg.reload() == ['honeypot_default']
+    assert reg.get().persona['fallbacks'] == ['ok']
+
+
+def test_matcher_patterns_and_digit_fallback():
+    m = PersonaMatcher({'behaviors': [{'match': [], 'patterns': ['(?P<upi>[\\w.\\-]+@[\\w.\\-]+)'], 'response_templates': ['got-upi']}], 'fallbacks': ['fb']})
+    assert m.match('pay to Name@Bank') == ('got-upi', {'upi': 'Name@Bank'})
+    assert m.match('hello') == ('fb', {})
+    assert m.match('ref 123456')[0] != 'fb'
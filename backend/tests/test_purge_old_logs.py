@@ -0,0 +1,38 @@
+import json
+import os
+import time
+from backend.safety import purge_old_logs
+from backend.safety.purge_old_logs import purge_logs, redact_file, CHECKPOINT_NAME
+
+
+def test_redact_file_streams_and_keeps_mtime(tmp_path):
+    p = tmp_path / "app.log"
+    p.write_text("call 9876543210 now\nnothing here\n", encoding="utf-8")
+    old = time.time() - 3600
+    os.utime(p, (old, old))
+    res = redact_file(p, dry_run=False)
+    assert res["lines"] == 2 and res["changed_lines"] == 1
+    assert p.read_text(encoding="utf-8") == "call XXXXXX3210 now\nnothing here\n"
+    assert abs(p.stat().st_mtime - old) < 1
+    assert not (tmp_path / ("app.log" + purge_old_logs.TMP_SUFFIX)).exists()
+
+
+def test_purge_resumes_from_checkpoint_and_reports_throughput(tmp_path):
+    (tmp_path / "a.log").write_text("acct 1234567890\n", encoding="utf-8")
+    (tmp_path / "b.log").write_text("acct 1234567890\n", encoding="utf-8")
+    stale = tmp_path / "old.log"
+    stale.write_text("x\n", encoding="utf-8")
+    os.utime(stale, (time.time() - 200 * 86400,) * 2)
+    (tmp_path / ("a.log" + purge_old_logs.TMP_SUFFIX)).write_text("partial", encoding="utf-8")
+    # a previous run already finished b.log
+    b = tmp_path / "b.log"
+    (tmp_path / CHECKPOINT_NAME).write_text(json.dumps({"max_age_days": 90, "done": {"b.log": [b.stat().st_size, b.stat().st_mtime_ns]}}))
+
+    totals = purge_logs(tmp_path, max_age_days=90, dry_run=False, workers=2)
+    assert totals["files"] == 2 and totals["changed_lines"] == 1
+    assert "mb_per_s" in totals and "lines_per_s" in totals
+    assert (tmp_path / "a.log").read_text(encoding="utf-8") == "acct XXXXXX7890\n"
+    assert b.read_text(encoding="utf-8") == "acct 1234567890\n"  # skipped via checkpoint
+    assert not stale.exists()
+    assert not (tmp_path / CHECKPOINT_NAME).exists()
+    assert not (tmp_path / ("a.log" + purge_old_logs.TMP_SUFFIX)).exists()
@@ -0,0 +1,56 @@
+from backend.app.rate_limit import SlidingWindowLimiter
+
+
+class _Clock:
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def test_sliding_window_counter_limits_and_decays():
+    clock = _Clock(1000.0)  # start of a 10s window
+    rl = SlidingWindowLimiter(window=10, limit=5, shards=4, clock=clock)
+    assert all(rl.allow('k') for _ in range(5))
+    assert not rl.allow('k')
+    assert rl.allow('other')
+    assert rl.usage('k') == {'window_seconds': 10, 'count': 5, 'limit': 5}
+
+    # halfway into the next window half of the previous count still weighs in
+    clock.t = 1015.0
+    assert rl.usage('k')['count'] == 2
+    assert rl.allow('k') and rl.allow('k')
+    assert not rl.allow('k')
+
+    # two windows later the key is idle again
+    clock.t = 1030.0
+    assert rl.usage('k')['count'] == 0
+    assert rl.allow('k')
+
+
+class _DownRedis:
+    def __init__(self):
+        self.calls = 0
+
+    def register_script(self, script):
+        def run(keys, args):
+            self.calls += 1
+            raise ConnectionError('redis down')
+        return run
+
+
+def test_redis_limiter_backs_off_to_memory_when_redis_is_down():
+    from backend.app.rate_limit import RedisRateLimiter
+    clock = _Clock(100.0)
+    client = _DownRedis()
+    rl = RedisRateLimiter('redis://unused', window=10, limit=2, retry_after=5, client=client, clock=clock)
+    assert rl.blocking
+    assert rl.allow('k') and rl.allow('k')
+    assert not rl.allow('k')
+    # one failed dial, then the fallback answers without touching Redis
+    assert client.calls == 1 and not rl.blocking
+    clock.t = 106.0
+    assert rl.blocking
+    rl.usage('k')
+    assert client.calls == 2
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from backend.app.db import SessionLocal, Message as DBMessage, Extraction as DBExtraction, SessionSummary
+from backend.app import session_summary
+from backend.app.session_summary import SummaryDelta
+
+
+def _add(db, sid, sender, ts, extractions=()):
+    db.add(DBMessage(session_id=sid, sender=sender, text='x', timestamp=ts, raw='x'))
+    delta = SummaryDelta().add_message(ts, agent=sender == 'agent')
+    for type_, value in extractions:
+        db.add(DBExtraction(session_id=sid, type=type_, value=value, confidence=0.9))
+        delta.add_extraction(type_, value)
+    db.flush()
+    session_summary.record(db, sid, delta)
+    db.commit()
+
+
+def test_incremental_summary_matches_full_scan():
+    sid = 'summary-session-001'
+    t0 = datetime(2026, 1, 1, 12, 0, 0)
+    db = SessionLocal()
+    try:
+        # a row that predates the summary is picked up by the first write's scan
+        db.add(DBMessage(session_id=sid, sender='scammer', text='hi', timestamp=t0, raw='hi'))
+        db.commit()
+        _add(db, sid, 'scammer', t0 + timedelta(seconds=30), [('upi', 'a@ybl'), ('phone', '+919876543210')])
+        _add(db, sid, 'agent', t0 + timedelta(seconds=40))
+        _add(db, sid, 'scammer', t0 + timedelta(seconds=90), [('upi', 'a@ybl'), ('url', 'http://x.co')])
+
+        row = db.query(SessionSummary).filter(SessionSummary.session_id == sid).one()
+        assert row.message_count == 4
+        assert session_summary.engagement_seconds(row) == 90
+        assert row.scam_detected
+        intel = session_summary.extracted_intelligence(row)
+        assert intel['upiIds'] == ['a@ybl']
+        assert intel['phoneNumbers'] == ['+919876543210']
+        assert intel['phishingLinks'] == ['http://x.co']
+        assert session_summary.verify(db, sid) == {}
+    finally:
+        db.close()
+
+
+def test_missing_summary_falls_back_to_scan():
+    sid = 'summary-session-unwritten'
+    db = SessionLocal()
+    try:
+        db.add(DBMessage(session_id=sid, sender='scammer', text='hi', timestamp=None, raw='hi'))
+        db.commit()
+        s = session_summary.get(db, sid)
+        assert s.message_count == 1 and not s.scam_detected
+        assert 'row' in session_summary.verify(db, sid)
+        session_summary.rebuild(db, sid)
+        db.commit()
+        assert session_summary.verify(db, sid) == {}
+    finally:
+        db.close()
+
+
+def test_first_write_tolerates_a_concurrently_created_row():
+    sid = 'summary-session-race'
+    db = SessionLocal()
+    other = SessionLocal()
+    try:
+        other.add(SessionSummary(session_id=sid, message_count=0))
+        other.commit()
+        # this writer missed the row in its locking SELECT and scans instead
+        assert session_summary._insert_scanned(db, session_summary.scan(db, sid)) is False
+        db.commit()
+        assert db.query(SessionSummary).filter(SessionSummary.session_id == sid).count() == 1
+    finally:
+        other.close()
+        db.close()
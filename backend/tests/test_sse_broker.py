@@ -0,0 +1,85 @@
+import asyncio
+from backend.app.sse_broker import MemoryBroker
+
+
+def test_every_subscriber_gets_every_message():
+    async def run():
+        broker = MemoryBroker()
+        async with broker.subscribe('session:a') as s1, broker.subscribe('session:a') as s2:
+            await broker.publish('session:a', 'm1')
+            await broker.publish('session:b', 'other')
+            assert (await s1.get(timeout=1)).data == 'm1'
+            assert (await s2.get(timeout=1)).data == 'm1'
+            assert await s1.get(timeout=0.01) is None
+        assert broker.subscriber_count() == 0
+
+    asyncio.run(run())
+
+
+def test_slow_consumer_is_dropped_without_affecting_others():
+    async def run():
+        broker = MemoryBroker()
+        slow = broker.subscribe('session:a', maxsize=2)
+        fast = broker.subscribe('session:a', maxsize=10)
+        for i in range(3):
+            await broker.publish('session:a', f'm{i}')
+        assert slow.dropped and broker.subscriber_count('session:a') == 1
+        try:
+            await slow.get(timeout=1)
+            assert False, 'dropped subscription should end'
+        except StopAsyncIteration:
+            pass
+        assert [(await fast.get(timeout=1)).data for _ in range(3)] == ['m0', 'm1', 'm2']
+        fast.close()
+        assert broker.subscriber_count() == 0
+
+    asyncio.run(run())
+
+
+def test_iteration_waits_for_pushed_messages_until_closed():
+    async def run():
+        broker = MemoryBroker()
+        sub = broker.subscribe('session:a')
+        received = []
+
+        async def consume():
+            async for ev in sub:
+                received.append(ev.data)
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.05)
+        assert received == [] and not task.done()
+        await broker.publish('session:a', 'm1')
+        await asyncio.sleep(0)
+        sub.close()
+        await asyncio.wait_for(task, 1)
+        assert received == ['m1']
+
+    asyncio.run(run())
+
+
+def test_reconnect_with_last_event_id_replays_only_missed_events():
+    async def run():
+        broker = MemoryBroker(replay_size=3)
+        sub = broker.subscribe('session:a')
+        assert sub.backlog is None
+        await broker.publish('session:a', 'm1')
+        seen = await sub.get(timeout=1)
+        sub.close()
+        # published while the viewer is away
+        await broker.publish('session:a', 'm2')
+        await broker.publish('session:a', 'm3')
+
+        again = broker.subscribe('session:a', seen.id)
+        assert [ev.data for ev in again.backlog] == ['m2', 'm3']
+        again.close()
+
+        # ids from another broker instance (e.g. before a restart) are unknown
+        assert broker.subscribe('session:a', 'deadbeef.1').backlog is None
+
+        # the ring no longer reaches back to m1: fall back to full history
+        await broker.publish('session:a', 'm4')
+        await broker.publish('session:a', 'm5')
+        assert broker.subscribe('session:a', seen.id).backlog is None
+
+    asyncio.run(run())
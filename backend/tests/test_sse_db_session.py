@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+from backend.app.main import app
+from backend.app.db import pool_stats
+import os
+
+
+client = TestClient(app)
+
+
+def test_sse_stream_holds_no_db_connection_while_streaming():
+    os.environ['ADMIN_API_KEY'] = os.environ.get('ADMIN_API_KEY', 'test_admin_key')
+    headers = {'x-api-key': os.environ['ADMIN_API_KEY']}
+    before = pool_stats()
+    with client.stream('GET', '/admin/ui/sse/session/sse-pool-001', headers=headers) as resp:
+        assert resp.status_code == 200
+        lines = resp.iter_lines()
+        # history (none) is followed by the resume checkpoint and a heartbeat
+        assert next(l for l in lines if l.startswith('id:'))
+        # history was read and its connection returned before streaming
+        now = pool_stats()
+        assert all(v['checked_out'] == 0 for v in now.values())
+        assert sum(v['checkouts'] for v in now.values()) > sum(v['checkouts'] for v in before.values())
@@ -0,0 +1,33 @@
+from backend.app.db import Message as DBMessage, SessionLocal
+from backend.app.unit_of_work import GroupCommitter, _savepoint_engine
+from sqlalchemy.orm import sessionmaker
+import pytest
+
+
+def _add_message(db, sid, text):
+    db.add(DBMessage(session_id=sid, sender='tester', text=text, timestamp=None, raw=text))
+    return text
+
+
+def _fail(db, sid):
+    db.add(DBMessage(session_id=sid, sender='tester', text='must-not-persist', timestamp=None, raw=''))
+    db.flush()
+    raise ValueError('boom')
+
+
+def test_group_committer_commits_batch_and_isolates_failures():
+    sid = 'uow-group-session'
+    committer = GroupCommitter(sessionmaker(autoflush=False, bind=_savepoint_engine()), window_ms=50)
+    futures = [committer.submit(_add_message, sid, 'one'), committer.submit(_fail, sid), committer.submit(_add_message, sid, 'two')]
+    assert futures[0].result(timeout=5) == 'one'
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 'two'
+    committer.stop()
+
+    db = SessionLocal()
+    try:
+        texts = sorted(m.text for m in db.query(DBMessage).filter(DBMessage.session_id == sid).all())
+        assert texts == ['one', 'two']
+    finally:
+        db.close()
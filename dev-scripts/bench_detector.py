@@ -0,0 +1,39 @@
+"""Microbenchmark: compiled detector engine vs the original multi-pass detect().
+
+Usage (from repo root):
+    python dev-scripts/bench_detector.py [repeat]
+"""
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.app.detector import detect, _detect_reference
+
+BENIGN = "Hi there, are we still on for lunch tomorrow at the cafe?"
+SCAM = "Share your UPI ID scam@okaxis now, call +91 98765 43210 or open http://x.co/verify"
+
+CASES = {
+    'short_benign': BENIGN,
+    'short_scam': SCAM,
+    'long_benign': (BENIGN + ' ') * 50,
+    'long_scam_tail': (BENIGN + ' ') * 50 + SCAM,
+    'long_numeric': 'Order 12 shipped on 2026-01-05 at 5 pm, ref 998877. ' * 40,
+}
+
+
+def run(repeat: int = 5):
+    print(f"{'case':<16}{'chars':>7}{'reference us':>15}{'compiled us':>14}{'speedup':>9}")
+    for name, text in CASES.items():
+        assert detect(text) == _detect_reference(text), name
+        number = 20000 if len(text) < 200 else 300
+        ref = min(timeit.repeat(lambda: _detect_reference(text), number=number, repeat=repeat)) / number
+        new = min(timeit.repeat(lambda: detect(text), number=number, repeat=repeat)) / number
+        print(f"{name:<16}{len(text):>7}{ref * 1e6:>15.1f}{new * 1e6:>14.1f}{ref / new:>8.2f}x")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
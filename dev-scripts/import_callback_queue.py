@@ -0,0 +1,13 @@
+"""
+Move payloads from the old file-per-payload callback queue directory
+(CALLBACK_QUEUE_DIR, default data/callback_queue) into the durable queue DB.
+Usage:
+  python dev-scripts/import_callback_queue.py [queue_dir]
+"""
+import sys
+from backend.app.callback_queue import import_legacy_files, get_queue, QUEUE_DIR
+
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else QUEUE_DIR
+    n = import_legacy_files(src)
+    print(f"Imported {n} payload(s) from {src}; queue: {get_queue().stats()}")
@@ -0,0 +1,41 @@
+"""
+Verify the audit log: every sealed segment against its signed manifest, the
+manifest chain, and every HMAC signature in the live file (across a process
+pool). With an explicit audit_file only that file is checked ("-" keeps
+the default, to pass workers).
+Exits non-zero if anything fails.
+Usage:
+  python dev-scripts/verify_audit_log.py [audit_file|-] [workers]
+"""
+import sys
+import time
+from backend.app.audit_reader import verify_file, verify_all
+
+
+def _report_file(path, res):
+    print(f"{path}: {res['total']} entries, {res['invalid']} invalid")
+    for off in res["invalid_offsets"][:20]:
+        print(f"  invalid entry at byte {off}")
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != "-" else None
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    t0 = time.monotonic()
+    if path is not None:
+        res = verify_file(path, workers=workers)
+        _report_file(path, res)
+        ok = not res["invalid"]
+    else:
+        res = verify_all(workers=workers)
+        for seg in res["segments"]:
+            if not seg["ok"]:
+                print(f"segment {seg['segment']}: manifest_ok={seg['manifest_ok']} chain_ok={seg['chain_ok']} "
+                      f"entries={seg['entries']} invalid={seg['invalid']}")
+        print(f"{len(res['segments'])} sealed segment(s), {sum(1 for s in res['segments'] if not s['ok'])} failed")
+        for n in res["chain_breaks"]:
+            print(f"  manifest chain broken before segment {n}")
+        _report_file("live audit log", res["live"])
+        ok = res["ok"]
+    print(f"{'OK' if ok else 'FAILED'} in {time.monotonic() - t0:.1f}s")
+    sys.exit(0 if ok else 1)
@@ -31,7 +31,7 @@ def load_messages(conn, session_id):
 
 
 def load_extractions(conn, session_id):
-    q = "SELECT id, type, value, confidence FROM extractions WHERE session_id = ?"
+    q = "SELECT id, type, canonical_value, value, count, first_seen, last_seen, confidence FROM extractions WHERE session_id = ?"
     return pd.read_sql_query(q, conn, params=(session_id,)) if conn else pd.DataFrame()
 
 